@@ -13,7 +13,7 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 # Import our app components
 from app.config import settings
 from app.database import Base
-from app.models import User, DatabaseConnection, Query, Feedback  # Import all models
+from app.models import User, DatabaseConnection, Query, Feedback, QueryDailyRollup  # Import all models
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,64 @@
+"""Add composite indexes for keyset-paginated query history
+
+Revision ID: 492a7e28eb87
+Revises: 493e9049af30
+Create Date: 2026-10-18 17:52:40.511870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '492a7e28eb87'
+down_revision: Union[str, Sequence[str], None] = '493e9049af30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built CONCURRENTLY so large queries tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_queries_user_created_id', 'queries',
+            ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_queries_user_status_created_id', 'queries',
+            ['user_id', 'status', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_queries_connection_created_id', 'queries',
+            ['connection_id', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False, postgresql_concurrently=True,
+        )
+        # Redundant: user_id is the leading column of ix_queries_user_created_id
+        op.drop_index(
+            'ix_queries_user_id', table_name='queries', postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_queries_user_id', 'queries', ['user_id'],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_queries_connection_created_id', table_name='queries',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_queries_user_status_created_id', table_name='queries',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_queries_user_created_id', table_name='queries',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,59 @@
+"""Unique connection names and one primary connection per user
+
+Revision ID: c41d7a9e3b58
+Revises: b9f1f6f35330
+Create Date: 2026-10-18 21:14:09.326651
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7a9e3b58'
+down_revision: Union[str, Sequence[str], None] = 'b9f1f6f35330'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing data may break both rules: keep the newest primary per user
+    # and suffix duplicate names with the connection id
+    op.execute("""
+        UPDATE database_connections AS c SET is_primary = false
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id ORDER BY updated_at DESC NULLS LAST, created_at DESC
+            ) AS n
+            FROM database_connections WHERE is_primary
+        ) AS ranked
+        WHERE c.id = ranked.id AND ranked.n > 1
+    """)
+    op.execute("""
+        UPDATE database_connections AS c SET name = c.name || ' (' || c.id || ')'
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY user_id, name ORDER BY created_at) AS n
+            FROM database_connections
+        ) AS ranked
+        WHERE c.id = ranked.id AND ranked.n > 1
+    """)
+    op.create_index(
+        'uq_database_connections_user_id_name', 'database_connections',
+        ['user_id', 'name'], unique=True,
+    )
+    op.execute("""
+        ALTER TABLE database_connections
+        ADD CONSTRAINT ex_database_connections_one_primary
+        EXCLUDE USING btree (user_id WITH =) WHERE (is_primary)
+        DEFERRABLE INITIALLY IMMEDIATE
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint(
+        'ex_database_connections_one_primary', 'database_connections'
+    )
+    op.drop_index('uq_database_connections_user_id_name', table_name='database_connections')
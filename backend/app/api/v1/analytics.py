@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.database import get_db
+from app.middleware.auth import get_current_user_id
+from app.schemas.analytics import DailyUsage, LatencyHistogram, UsageSummary
+from app.models.rollup import QueryDailyRollup
+from app.services.rollups import LATENCY_BUCKETS_MS, merge_histograms, usage_stats
+from app.tracing import TimedRoute
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+router = APIRouter(route_class=TimedRoute)
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+
+
+async def load_rollups(
+    db: AsyncSession,
+    user_id: str,
+    connection_id: Optional[str],
+    start: Optional[date],
+    end: Optional[date],
+):
+    """
+    Rollup rows for a user and date range (default: the last 30 days).
+    Reads the rollups only, never the queries table.
+    """
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end or (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"start must be on or before end, at most {MAX_RANGE_DAYS} days apart"
+        )
+
+    statement = select(QueryDailyRollup).where(
+        QueryDailyRollup.user_id == user_id,
+        QueryDailyRollup.day.between(start, end),
+    )
+    if connection_id:
+        statement = statement.where(QueryDailyRollup.connection_id == connection_id)
+    result = await db.execute(statement.order_by(QueryDailyRollup.day))
+    return result.scalars().all(), start, end
+
+
+@router.get("/summary", response_model=UsageSummary)
+async def get_usage_summary(
+    user_id: str = Depends(get_current_user_id),
+    connection_id: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get success rate, response times and volume over a date range (UTC days).
+    """
+    rollups, start, end = await load_rollups(db, user_id, connection_id, start, end)
+
+    return UsageSummary(
+        start=start,
+        end=end,
+        connection_id=connection_id,
+        latency_histogram=LatencyHistogram(
+            bucket_upper_bounds_ms=list(LATENCY_BUCKETS_MS),
+            counts=merge_histograms([r.latency_histogram for r in rollups]),
+        ),
+        **usage_stats(rollups),
+    )
+
+
+@router.get("/daily", response_model=List[DailyUsage])
+async def get_daily_usage(
+    user_id: str = Depends(get_current_user_id),
+    connection_id: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get usage per day (UTC). Days without queries are omitted.
+    """
+    rollups, start, end = await load_rollups(db, user_id, connection_id, start, end)
+
+    by_day = {}
+    for rollup in rollups:
+        by_day.setdefault(rollup.day, []).append(rollup)
+
+    return [DailyUsage(day=day, **usage_stats(rows)) for day, rows in by_day.items()]
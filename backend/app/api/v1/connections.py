@@ -1,18 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import exists, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from app.database import get_db
+from app.middleware.auth import get_current_user_id
 from app.schemas.connection import (
     DatabaseConnectionCreate,
     DatabaseConnectionUpdate,
     DatabaseConnectionResponse,
     DatabaseConnectionTest,
+    DatabaseConnectionTestResult,
+    DatabaseConnectionBatchTestResult,
 )
+from app.schemas.catalog import SchemaCatalog
 from app.models.connection import DatabaseConnection
+from app.services.connection_manager import connection_manager, TargetConnectionError
+from app.services.schema_catalog import schema_catalog
+from app.services.sql_cache import sql_cache
+from app.services.similarity import similarity_index
+from app.services.schema_retrieval import schema_retriever
+from app.services.result_cache import result_cache
+from app.services.connection_tester import probe_connection, probe_connections
+from app.tracing import TimedRoute
 from datetime import datetime
 import secrets
+import time
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Fields that change where or how we connect to the target database
+CONNECTION_DETAIL_FIELDS = {"host", "port", "database", "username", "password"}
 
 
 def generate_connection_id() -> str:
@@ -20,60 +39,84 @@ def generate_connection_id() -> str:
     return f"conn_{secrets.token_urlsafe(16)}"
 
 
+def make_primary(user_id: str, connection_id: str):
+    """
+    One UPDATE that makes connection_id the user's only primary connection:
+    is_primary = (id = :id) over all of the user's connections. Changes
+    nothing if the target doesn't exist or isn't the user's. Returns the
+    updated rows.
+    Every row is rewritten, not just the old and new primary: a concurrent
+    set-primary may change which row is primary after our snapshot, and
+    Postgres only re-checks rows the UPDATE already matched.
+    """
+    target = aliased(DatabaseConnection)
+    return (
+        update(DatabaseConnection)
+        .where(
+            DatabaseConnection.user_id == user_id,
+            exists().where(target.id == connection_id, target.user_id == user_id),
+        )
+        .values(is_primary=DatabaseConnection.id == connection_id)
+        .returning(DatabaseConnection)
+        .execution_options(synchronize_session=False)
+    )
+
+
 @router.post("/", response_model=DatabaseConnectionResponse, status_code=status.HTTP_201_CREATED)
 async def create_connection(
     connection_data: DatabaseConnectionCreate,
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new database connection.
     """
-    # Check if user already has a connection with this name
-    result = await db.execute(
-        select(DatabaseConnection).where(
-            DatabaseConnection.user_id == user_id,
-            DatabaseConnection.name == connection_data.name
+    # One round trip: the first connection becomes primary, and a name that's
+    # already taken inserts nothing
+    statement = (
+        insert(DatabaseConnection)
+        .values(
+            id=generate_connection_id(),
+            user_id=user_id,
+            name=connection_data.name,
+            dialect=connection_data.dialect,
+            host=connection_data.host,
+            port=connection_data.port,
+            database=connection_data.database,
+            username=connection_data.username,
+            password=connection_data.password,  # TODO: Encrypt in production
+            result_cache_ttl=connection_data.result_cache_ttl,
+            max_query_cost=connection_data.max_query_cost,
+            max_query_rows=connection_data.max_query_rows,
+            statement_timeout_ms=connection_data.statement_timeout_ms,
+            is_primary=~exists().where(DatabaseConnection.user_id == user_id),
         )
+        .on_conflict_do_nothing(index_elements=["user_id", "name"])
+        .returning(DatabaseConnection)
     )
-    existing = result.scalar_one_or_none()
+    try:
+        result = await db.execute(statement)
+    except IntegrityError:
+        # Two first connections created at once both claimed primary; the
+        # retry sees the other one and doesn't
+        await db.rollback()
+        result = await db.execute(statement)
+    new_connection = result.scalar_one_or_none()
     
-    if existing:
+    if new_connection is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="A connection with this name already exists"
         )
     
-    # If this is the first connection, make it primary
-    result = await db.execute(
-        select(DatabaseConnection).where(DatabaseConnection.user_id == user_id)
-    )
-    is_first_connection = result.first() is None
-    
-    # Create new connection
-    new_connection = DatabaseConnection(
-        id=generate_connection_id(),
-        user_id=user_id,
-        name=connection_data.name,
-        dialect=connection_data.dialect,
-        host=connection_data.host,
-        port=connection_data.port,
-        database=connection_data.database,
-        username=connection_data.username,
-        password=connection_data.password,  # TODO: Encrypt in production
-        is_primary=is_first_connection,
-    )
-    
-    db.add(new_connection)
     await db.commit()
-    await db.refresh(new_connection)
     
     return new_connection
 
 
 @router.get("/", response_model=list[DatabaseConnectionResponse])
 async def get_connections(
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -88,10 +131,19 @@ async def get_connections(
     return connections
 
 
+@router.get("/pools/stats")
+async def get_pool_stats():
+    """
+    Get target database pool totals, for sizing the connection manager.
+    Open to any caller, so it reports nothing per connection.
+    """
+    return connection_manager.stats()
+
+
 @router.get("/{connection_id}", response_model=DatabaseConnectionResponse)
 async def get_connection(
     connection_id: str,
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -114,11 +166,45 @@ async def get_connection(
     return connection
 
 
+@router.get("/{connection_id}/schema", response_model=SchemaCatalog)
+async def get_connection_schema(
+    connection_id: str,
+    user_id: str = Depends(get_current_user_id),
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the tables, columns and foreign keys of a connection's database.
+    Served from the schema cache; use refresh=true to force revalidation.
+    """
+    result = await db.execute(
+        select(DatabaseConnection).where(
+            DatabaseConnection.id == connection_id,
+            DatabaseConnection.user_id == user_id
+        )
+    )
+    connection = result.scalar_one_or_none()
+    
+    if not connection:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connection not found"
+        )
+    
+    try:
+        return await schema_catalog.get(connection, force=refresh)
+    except TargetConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not reach the database: {e}"
+        )
+
+
 @router.put("/{connection_id}", response_model=DatabaseConnectionResponse)
 async def update_connection(
     connection_id: str,
     connection_update: DatabaseConnectionUpdate,
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -141,20 +227,45 @@ async def update_connection(
     # Update connection fields
     update_data = connection_update.model_dump(exclude_unset=True)
     for field, value in update_data.items():
-        setattr(connection, field, value)
+        if field != "is_primary" or not value:
+            setattr(connection, field, value)
     
     connection.updated_at = datetime.utcnow()
     
-    await db.commit()
+    try:
+        if update_data.get("is_primary"):
+            # Flush first so the UPDATE doesn't overwrite our changes
+            await db.flush()
+            await db.execute(make_primary(user_id, connection.id))
+        
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if "uq_database_connections_user_id_name" not in str(e.orig):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A connection with this name already exists"
+        )
     await db.refresh(connection)
     
+    # Rebuild the target pool on next use if the connection details changed
+    if CONNECTION_DETAIL_FIELDS & update_data.keys():
+        await connection_manager.invalidate(connection.id)
+        await schema_catalog.invalidate(connection.id)
+        await sql_cache.evict_connection(connection.id)
+        similarity_index.invalidate(connection.id)
+        schema_retriever.invalidate(connection.id)
+    # Cached results may no longer match what the connection now points at
+    await result_cache.evict_connection(connection.id)
+    
     return connection
 
 
 @router.delete("/{connection_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_connection(
     connection_id: str,
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -176,42 +287,65 @@ async def delete_connection(
     
     await db.delete(connection)
     await db.commit()
+    
+    await connection_manager.invalidate(connection_id)
+    await schema_catalog.invalidate(connection_id)
+    await sql_cache.evict_connection(connection_id)
+    similarity_index.invalidate(connection_id)
+    schema_retriever.invalidate(connection_id)
+    await result_cache.evict_connection(connection_id)
 
 
-@router.post("/test", status_code=status.HTTP_200_OK)
+@router.post("/test", response_model=DatabaseConnectionTestResult, status_code=status.HTTP_200_OK)
 async def test_connection(connection_test: DatabaseConnectionTest):
     """
     Test a database connection without saving it.
-    Returns success/failure status.
+    Connects with a timeout and reports latency and server version.
+    """
+    return await probe_connection(**connection_test.model_dump())
+
+
+@router.post("/test-all", response_model=DatabaseConnectionBatchTestResult, status_code=status.HTTP_200_OK)
+async def test_all_connections(
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    # TODO: Implement actual connection testing
-    # For now, just return success
+    Test all saved connections for the current user concurrently.
+    Takes roughly as long as the slowest connection, not the sum of all.
+    """
+    result = await db.execute(
+        select(DatabaseConnection)
+        .where(DatabaseConnection.user_id == user_id)
+        .order_by(DatabaseConnection.is_primary.desc(), DatabaseConnection.created_at.desc())
+    )
+    connections = result.scalars().all()
+    
+    # Don't hold a metadata DB connection while waiting on target databases
+    await db.close()
+    
+    started = time.perf_counter()
+    results = await probe_connections(connections)
+    
     return {
-        "success": True,
-        "message": "Connection test successful",
-        "dialect": connection_test.dialect,
-        "host": connection_test.host,
-        "database": connection_test.database
+        "results": results,
+        "total": len(results),
+        "succeeded": sum(1 for r in results if r["success"]),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
     }
 
 
 @router.put("/{connection_id}/set-primary", response_model=DatabaseConnectionResponse)
 async def set_primary_connection(
     connection_id: str,
-    user_id: str,  # Will come from auth middleware
+    user_id: str = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Set a connection as the primary connection for the user.
     """
-    # Verify connection exists and belongs to user
-    result = await db.execute(
-        select(DatabaseConnection).where(
-            DatabaseConnection.id == connection_id,
-            DatabaseConnection.user_id == user_id
-        )
-    )
-    connection = result.scalar_one_or_none()
+    result = await db.execute(make_primary(user_id, connection_id))
+    connection = next((c for c in result.scalars() if c.id == connection_id), None)
     
     if not connection:
         raise HTTPException(
@@ -219,23 +353,6 @@ async def set_primary_connection(
             detail="Connection not found"
         )
     
-    # Unset all other primary connections for this user
-    result = await db.execute(
-        select(DatabaseConnection).where(
-            DatabaseConnection.user_id == user_id,
-            DatabaseConnection.is_primary == True
-        )
-    )
-    primary_connections = result.scalars().all()
-    
-    for conn in primary_connections:
-        conn.is_primary = False
-    
-    # Set this connection as primary
-    connection.is_primary = True
-    connection.updated_at = datetime.utcnow()
-    
     await db.commit()
-    await db.refresh(connection)
     
     return connection
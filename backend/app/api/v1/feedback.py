@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.middleware.auth import get_current_user_id
+from app.schemas.feedback import FeedbackCreate, FeedbackResponse
+from app.api.v1.queries import get_user_query
+from app.services.ai_service import ai_service
+from app.services.similarity import similarity_index
+from app.services.sql_cache import sql_cache
+from app.services.write_behind import write_behind
+from app.tracing import TimedRoute
+from datetime import datetime, timezone
+
+router = APIRouter(route_class=TimedRoute)
+
+
+def generate_feedback_id(query_id: str) -> str:
+    """
+    Feedback ID for a query. There is one feedback row per query, so the ID
+    is derived from it and stays the same when the rating is changed.
+    """
+    return f"feedback_{query_id}"
+
+
+@router.post("/", response_model=FeedbackResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_feedback(
+    feedback_data: FeedbackCreate,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Rate a generated query as helpful (1) or not (-1).
+    Rating the same query again replaces the earlier feedback.
+    The write is queued and saved in the background.
+    """
+    query = await get_user_query(db, feedback_data.query_id, user_id)
+
+    values = {
+        "id": generate_feedback_id(query.id),
+        "query_id": query.id,
+        "user_id": user_id,
+        "rating": feedback_data.rating,
+        "comment": feedback_data.comment,
+        "created_at": datetime.now(timezone.utc),
+    }
+    await write_behind.add_feedback(values)
+
+    # Stop reusing SQL users marked as unhelpful, wherever it came from
+    if query.connection_id:
+        dropped = similarity_index.record_feedback(
+            query.connection_id, query.natural_language, query.generated_sql, feedback_data.rating
+        )
+        if feedback_data.rating < 0:
+            await sql_cache.evict_questions(
+                query.connection_id,
+                ai_service.model_version,
+                [query.natural_language, *dropped],
+            )
+
+    return FeedbackResponse(**values)
@@ -0,0 +1,648 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Query as QueryParam, Request, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
+from app.database import get_db
+from app.middleware.auth import get_current_user_id
+from app.middleware.rate_limit import admission
+from app.schemas.query import QueryCreate, QueryResponse, QueryHistoryPage, QueryExecuteResponse
+from app.models.connection import DatabaseConnection
+from app.models.query import Query, QueryStatus
+from app.services.ai_service import AIServiceError
+from app.services.connection_manager import TargetConnectionError
+from app.services.query_executor import QueryStream, QueryExecutionError
+from app.services.cost_guard import CostLimitExceeded, cost_guard
+from app.services.execution_registry import execution_registry
+from app.services.query_generator import generate_sql
+from app.services.exporter import EXPORTERS, EXPORT_MEDIA_TYPES
+from app.services import result_encoding
+from app.config import settings
+from app.utils.serialization import dumps, json_column
+from app.utils.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from app.services.schema_catalog import schema_catalog
+from app.services.similarity import similarity_index
+from app.services.schema_retrieval import schema_retriever
+from app.services.sql_cache import sql_cache
+from app.services.sql_analysis import sql_analyzer
+from app.services.result_cache import CachedResult, result_cache
+from app.services.write_behind import write_behind
+from app.tracing import TimedRoute, span
+from typing import Awaitable, Literal, Optional, Tuple, TypeVar
+from contextlib import suppress
+import anyio
+import asyncio
+import secrets
+import time
+
+router = APIRouter(route_class=TimedRoute)
+
+T = TypeVar("T")
+
+# nginx's "client closed request"; nobody receives it, but it shows up in logs
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
+
+def generate_query_id() -> str:
+    """Generate a unique query ID"""
+    return f"query_{secrets.token_urlsafe(16)}"
+
+
+async def get_user_connection(
+    db: AsyncSession, connection_id: str, user_id: str
+) -> DatabaseConnection:
+    """Load a connection owned by the user, or raise 404"""
+    result = await db.execute(
+        select(DatabaseConnection).where(
+            DatabaseConnection.id == connection_id,
+            DatabaseConnection.user_id == user_id
+        )
+    )
+    connection = result.scalar_one_or_none()
+
+    if not connection:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connection not found"
+        )
+
+    return connection
+
+
+async def get_user_query(db: AsyncSession, query_id: str, user_id: str) -> Query:
+    """Load a query owned by the user, or raise 404"""
+    result = await db.execute(
+        select(Query).where(
+            Query.id == query_id,
+            Query.user_id == user_id
+        )
+    )
+    query = result.scalar_one_or_none()
+
+    if not query:
+        # Created moments ago and still waiting to be written
+        query = write_behind.pending_query(query_id)
+        if query is not None and query.user_id != user_id:
+            query = None
+
+    if not query:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query not found"
+        )
+
+    return query
+
+
+def to_query_response(query: Query, from_cache: bool = False) -> QueryResponse:
+    """Build the API representation of a saved query"""
+    return QueryResponse(
+        id=query.id,
+        user_id=query.user_id,
+        connection_id=query.connection_id,
+        natural_language_query=query.natural_language,
+        generated_sql=query.generated_sql,
+        query_type=query.query_type,
+        tables_used=query.tables_used,
+        status=query.status,
+        error_message=query.error_message,
+        execution_time_ms=query.response_time,
+        rows_returned=query.rows_returned,
+        from_cache=from_cache,
+        created_at=query.created_at,
+    )
+
+
+async def record_execution(
+    query_id: str,
+    query_status: QueryStatus,
+    rows_returned: int,
+    response_time: int,
+    error_message: Optional[str] = None,
+) -> None:
+    """Queue execution stats for the Query row"""
+    await write_behind.update_query(
+        query_id,
+        {
+            "status": query_status,
+            "rows_returned": rows_returned,
+            "response_time": response_time,
+            "error_message": error_message,
+        },
+    )
+
+
+async def get_query_target(
+    db: AsyncSession, query_id: str, user_id: str
+) -> Tuple[Query, DatabaseConnection]:
+    """Load a saved query and the connection it runs against, or raise 404"""
+    query = await get_user_query(db, query_id, user_id)
+    if not query.connection_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connection not found"
+        )
+    connection = await get_user_connection(db, query.connection_id, user_id)
+    await admission.check_connection(connection.id)
+    return query, connection
+
+
+async def open_query_stream(
+    db: AsyncSession, query_id: str, user_id: str, cursor: bool = True, export: bool = False
+) -> QueryStream:
+    """
+    Open a result stream for a saved query.
+    Errors are raised as HTTP errors here, before any response is started.
+    """
+    query, connection = await get_query_target(db, query_id, user_id)
+
+    # Don't hold a metadata DB connection for the lifetime of the stream
+    await db.close()
+
+    return await start_query_stream(query, connection, cursor=cursor, export=export)
+
+
+async def start_query_stream(
+    query: Query,
+    connection: DatabaseConnection,
+    cursor: bool = True,
+    preview_rows: Optional[int] = None,
+    export: bool = False,
+) -> QueryStream:
+    """
+    Open a QueryStream, translating failures into HTTP errors.
+    preview_rows caps the result in the SQL itself, for interactive previews;
+    export marks a full download (see QueryStream).
+    """
+    stream = QueryStream(
+        connection, query.generated_sql, query.id, preview_rows=preview_rows, export=export
+    )
+    try:
+        await stream.open(cursor=cursor)
+    except TargetConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not reach the database: {e}"
+        )
+    except CostLimitExceeded as e:
+        await record_execution(
+            query.id, QueryStatus.WARNING, 0, stream.elapsed_ms, f"Blocked by cost guard: {e}"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Query blocked by cost guard: {e}"
+        )
+    except QueryExecutionError as e:
+        await record_execution(query.id, QueryStatus.FAILED, 0, stream.elapsed_ms, str(e))
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query failed: {e}"
+        )
+    return stream
+
+
+@router.post("/", response_model=QueryResponse, status_code=status.HTTP_201_CREATED)
+async def create_query(
+    query_create: QueryCreate,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Generate SQL from a natural language question and save it to history.
+    Repeated or near-duplicate questions reuse previously generated SQL.
+    """
+    connection = await get_user_connection(db, query_create.connection_id, user_id)
+    await admission.check_connection(connection.id)
+
+    try:
+        generated = await generate_sql(connection, query_create.natural_language_query)
+    except TargetConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not reach the database: {e}"
+        )
+    except AIServiceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=str(e)
+        )
+
+    analysis = await sql_analyzer.analyze_async(generated.sql)
+    warning = None
+    if analysis.is_multi_statement:
+        warning = "The generated SQL contains more than one statement"
+    elif analysis.is_mutating:
+        warning = "The generated SQL modifies data; queries run read-only"
+
+    # Saved by the write-behind flusher; the response doesn't wait for the commit
+    new_query = await write_behind.add_query({
+        "id": generate_query_id(),
+        "user_id": user_id,
+        "connection_id": connection.id,
+        "natural_language": query_create.natural_language_query,
+        "generated_sql": generated.sql,
+        "tables_used": list(analysis.tables),
+        "query_type": analysis.query_type or None,
+        "status": QueryStatus.WARNING if warning else QueryStatus.SUCCESS,
+        "error_message": warning,
+    })
+
+    # Only safe SQL is offered again for similar questions
+    if generated.source == "llm" and analysis.is_read_only:
+        similarity_index.add(connection.id, new_query.id, new_query.natural_language, new_query.generated_sql)
+
+    return to_query_response(new_query, from_cache=generated.from_cache)
+
+
+@router.get("/", response_model=QueryHistoryPage)
+async def get_query_history(
+    user_id: str = Depends(get_current_user_id),
+    connection_id: Optional[str] = None,
+    query_status: Optional[QueryStatus] = QueryParam(None, alias="status"),
+    cursor: Optional[str] = None,
+    limit: int = QueryParam(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the user's query history, newest first.
+    Pages are keyset-paginated on (created_at, id): pass the returned
+    next_cursor to get the next page. Page cost does not grow with the
+    size of the history or with how deep the page is.
+    """
+    statement = select(Query).where(Query.user_id == user_id)
+    if connection_id:
+        statement = statement.where(Query.connection_id == connection_id)
+    if query_status:
+        statement = statement.where(Query.status == query_status)
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        # Row comparison matches the index order, so this is a range scan
+        statement = statement.where(tuple_(Query.created_at, Query.id) < (created_at, last_id))
+
+    # One extra row tells us whether there is a next page
+    result = await db.execute(
+        statement.order_by(Query.created_at.desc(), Query.id.desc()).limit(limit + 1)
+    )
+    queries = result.scalars().all()
+    has_more = len(queries) > limit
+    queries = queries[:limit]
+
+    return QueryHistoryPage(
+        items=[to_query_response(query) for query in queries],
+        next_cursor=encode_cursor(queries[-1].created_at, queries[-1].id) if has_more else None,
+        has_more=has_more,
+    )
+
+
+@router.post("/{query_id}/execute", response_model=QueryExecuteResponse)
+async def execute_query(
+    query_id: str,
+    request: Request,
+    user_id: str = Depends(get_current_user_id),
+    accept: Optional[str] = Header(None),
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Execute a saved query and return its results.
+    The Accept header picks the format: JSON rows (default), typed columnar
+    JSON (application/vnd.queryforge.columnar+json) or an Arrow IPC stream
+    (application/vnd.apache.arrow.stream).
+    JSON results are served from the result cache when possible; pass
+    refresh=true to re-run the query anyway. If the client disconnects
+    before the result is ready, the query is cancelled on the database.
+    """
+    result_format = result_encoding.negotiate_format(accept)
+    query, connection = await get_query_target(db, query_id, user_id)
+    await db.close()
+
+    if result_format == result_encoding.ARROW_STREAM_MEDIA_TYPE:
+        # Streamed straight from the cursor, so never cached
+        stream = await start_query_stream(query, connection)
+        return StreamingResponse(
+            arrow_body(stream, query_id),
+            media_type=result_encoding.ARROW_STREAM_MEDIA_TYPE,
+            headers={"X-Query-Id": query_id},
+        )
+
+    cache_ttl = result_cache.ttl_for(connection)
+    cache_key = await result_cache.key(connection.id, query.generated_sql) if cache_ttl else None
+    result = None if refresh else await result_cache.get(cache_key)
+    cached = result is not None
+
+    if not cached:
+        result = await run_until_disconnected(request, query_id, run_buffered(query, connection))
+        await result_cache.set(cache_key, result, ttl=cache_ttl)
+
+    cache_fields = {
+        "cached": cached,
+        "cached_at": result.cached_at_datetime if cached else None,
+        "cache_age_seconds": result.age_seconds if cached else None,
+    }
+
+    if result_format == result_encoding.COLUMNAR_JSON_MEDIA_TYPE:
+        with span("encode"):
+            content = dumps({
+                "query_id": query_id,
+                "columns": result.columns,
+                "data": result.data,
+                "status": result.status,
+                "error_message": result.error_message,
+                "execution_time_ms": result.execution_time_ms,
+                "rows_returned": result.rows_returned,
+                **cache_fields,
+            })
+        return Response(content, media_type=result_encoding.COLUMNAR_JSON_MEDIA_TYPE)
+
+    return QueryExecuteResponse(
+        query_id=query_id,
+        generated_sql=query.generated_sql,
+        result_data=result.rows(),
+        status=result.status,
+        error_message=result.error_message,
+        execution_time_ms=result.execution_time_ms,
+        rows_returned=result.rows_returned,
+        **cache_fields,
+    )
+
+
+async def run_buffered(query: Query, connection: DatabaseConnection) -> CachedResult:
+    """
+    Run a saved query to completion, up to EXECUTION_MAX_ROWS rows (or the
+    connection's max_query_rows, if lower), and record the execution stats.
+    Raises 400 if the query fails.
+    """
+    max_rows = cost_guard.row_cap(connection, settings.EXECUTION_MAX_ROWS)
+    # One row past the cap tells a truncated result from one that fits exactly
+    stream = await start_query_stream(query, connection, preview_rows=max_rows + 1)
+    data = [[] for _ in stream.columns]
+    query_status, error_message = QueryStatus.SUCCESS, None
+    try:
+        async for rows in stream:
+            remaining = max_rows - (stream.rows_returned - len(rows))
+            if len(rows) > remaining:
+                rows = rows[:remaining]
+                stream.rows_returned = max_rows
+                query_status = QueryStatus.WARNING
+                error_message = f"Result truncated to {max_rows} rows"
+            result_encoding.columnar_append(data, rows)
+            if query_status == QueryStatus.WARNING:
+                break
+    except QueryExecutionError as e:
+        query_status, error_message = QueryStatus.FAILED, str(e)
+    finally:
+        await stream.close()
+    await record_execution(
+        query.id, query_status, stream.rows_returned, stream.elapsed_ms, error_message
+    )
+
+    if query_status == QueryStatus.FAILED:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query failed: {error_message}"
+        )
+
+    return CachedResult(
+        columns=stream.columns,
+        # Encoded as the cache stores it, so a fresh result matches a cached one
+        data=[json_column(values) for values in data],
+        status=query_status.value,
+        error_message=error_message,
+        execution_time_ms=stream.elapsed_ms,
+        rows_returned=stream.rows_returned,
+        cached_at=time.time(),
+    )
+
+
+async def run_until_disconnected(request: Request, query_id: str, work: Awaitable[T]) -> T:
+    """
+    Await work, polling for the client going away meanwhile. If it does,
+    work is cancelled (asyncpg sends the database a protocol-level cancel
+    for the statement it was waiting on, and the connection goes back to
+    its pool) and the execution is recorded as failed.
+    """
+    started_at = time.perf_counter()
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.EXECUTION_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    finally:
+        task.cancel()
+
+    with suppress(asyncio.CancelledError):
+        await task
+    await record_execution(
+        query_id,
+        QueryStatus.FAILED,
+        0,
+        int((time.perf_counter() - started_at) * 1000),
+        "Cancelled: client disconnected",
+    )
+    raise HTTPException(
+        status_code=HTTP_499_CLIENT_CLOSED_REQUEST,
+        detail="Client closed request"
+    )
+
+
+async def arrow_body(stream: QueryStream, query_id: str):
+    """Encode cursor batches straight into Arrow record batches"""
+    query_status, error_message = QueryStatus.SUCCESS, None
+    try:
+        encoder = result_encoding.ArrowStreamEncoder(stream.columns)
+        yield encoder.header()
+        async for rows in stream:
+            with span("encode"):
+                chunk = encoder.encode(rows)
+            yield chunk
+        yield encoder.finish()
+    except QueryExecutionError as e:
+        # The Arrow stream is left without its end marker, so clients fail loudly
+        query_status, error_message = QueryStatus.FAILED, str(e)
+    except BaseException:
+        query_status, error_message = QueryStatus.FAILED, "Client disconnected"
+        raise
+    finally:
+        with anyio.CancelScope(shield=True):
+            await stream.close()
+            await record_execution(
+                query_id, query_status, stream.rows_returned, stream.elapsed_ms, error_message
+            )
+
+
+@router.post("/{query_id}/execute/stream")
+async def execute_query_stream(
+    query_id: str,
+    user_id: str = Depends(get_current_user_id),
+    format: Literal["ndjson", "sse"] = "ndjson",
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Execute a saved query and stream the results as NDJSON or Server-Sent Events.
+    Rows are read in batches from a server-side cursor, at the client's pace.
+    """
+    stream = await open_query_stream(db, query_id, user_id)
+
+    if format == "sse":
+        media_type = result_encoding.SSE_MEDIA_TYPE
+        header, encode_rows, trailer, error = (
+            result_encoding.sse_header,
+            result_encoding.sse_rows,
+            result_encoding.sse_trailer,
+            result_encoding.sse_error,
+        )
+    else:
+        media_type = result_encoding.NDJSON_MEDIA_TYPE
+        header, encode_rows, trailer, error = (
+            result_encoding.ndjson_header,
+            result_encoding.ndjson_rows,
+            result_encoding.ndjson_trailer,
+            result_encoding.ndjson_error,
+        )
+
+    async def body():
+        query_status, error_message = QueryStatus.SUCCESS, None
+        try:
+            yield header(stream.columns)
+            async for rows in stream:
+                with span("encode"):
+                    chunk = encode_rows(rows)
+                # Each yield waits until the client has taken the previous chunk
+                yield chunk
+            yield trailer(stream.rows_returned, stream.elapsed_ms)
+        except QueryExecutionError as e:
+            query_status, error_message = QueryStatus.FAILED, str(e)
+            yield error(error_message)
+        except BaseException:
+            query_status, error_message = QueryStatus.FAILED, "Client disconnected"
+            raise
+        finally:
+            # Runs even when the client went away and the response was cancelled
+            with anyio.CancelScope(shield=True):
+                await stream.close()
+                await record_execution(
+                    query_id, query_status, stream.rows_returned, stream.elapsed_ms, error_message
+                )
+
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/{query_id}/execution", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_query_execution(
+    query_id: str,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Cancel a saved query's running executions, on whichever worker they run.
+    The cancelled execution fails and is recorded with the cancellation
+    message. Raises 404 if the query isn't running.
+    """
+    query = await get_user_query(db, query_id, user_id)
+    if not query.connection_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connection not found"
+        )
+    connection = await get_user_connection(db, query.connection_id, user_id)
+    await db.close()
+
+    try:
+        cancelled = await execution_registry.cancel(query_id, connection)
+    except TargetConnectionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not reach the database: {e}"
+        )
+    if not cancelled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query is not running"
+        )
+
+
+@router.get("/{query_id}/export")
+async def export_query(
+    query_id: str,
+    user_id: str = Depends(get_current_user_id),
+    format: Literal["csv", "json", "xlsx"] = "csv",
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Re-run a saved query and download the full result as CSV, JSON or Excel.
+    Results are streamed with bounded memory and are not subject to
+    EXECUTION_MAX_ROWS, the cost guard's row threshold or the execution
+    statement timeout. The query's execution stats are only updated when
+    it is refused or fails to start, not by a completed download.
+    """
+    stream = await open_query_stream(
+        db, query_id, user_id, cursor=format != "csv", export=True
+    )
+    chunks = EXPORTERS[format](stream).__aiter__()
+
+    # Pull the first chunk before answering, so errors raised when the query
+    # starts running still become a proper error response
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except QueryExecutionError as e:
+        await chunks.aclose()
+        await stream.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query failed: {e}"
+        )
+    except BaseException:
+        await chunks.aclose()
+        await stream.close()
+        raise
+
+    async def body():
+        try:
+            yield first_chunk
+            # A failure midway cuts the download short, so it is visibly incomplete
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # The exporter (and a COPY it drives) stops before the connection
+            # goes back to its pool, also when the client went away
+            with anyio.CancelScope(shield=True):
+                await chunks.aclose()
+                await stream.close()
+
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{query_id}.{format}"'},
+    )
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get hit/miss counters for the generated-SQL, schema and result caches,
+    the schema pruning index, SQL analysis and the cost guard.
+    For MVP, this is open but should be admin-only later.
+    """
+    return {
+        "sql": sql_cache.stats(),
+        "schema": schema_catalog.stats(),
+        "similarity": similarity_index.stats(),
+        "schema_retrieval": schema_retriever.stats(),
+        "sql_analysis": sql_analyzer.stats(),
+        "results": result_cache.stats(),
+        "cost_guard": cost_guard.stats(),
+    }
@@ -1,13 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from app.database import get_db
+from app.middleware.auth import Identity, get_current_clerk_id, get_identity
 from app.schemas.user import UserResponse, UserUpdate, UserCreate
 from app.models.user import User
+from app.services.last_login import last_login
+from app.utils.lru import LRUCache
+from app.config import settings
+from app.tracing import TimedRoute
 from datetime import datetime
+from typing import Optional
 import secrets
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# clerk_id -> UserResponse for GET /me, which the frontend polls
+profile_cache = LRUCache(
+    maxsize=settings.USER_PROFILE_CACHE_MAX_ENTRIES,
+    ttl=settings.USER_PROFILE_CACHE_TTL_SECONDS,
+)
 
 
 def generate_user_id() -> str:
@@ -17,29 +30,33 @@ def generate_user_id() -> str:
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user(
-    clerk_id: str,  # This will come from auth middleware later
+    clerk_id: str = Depends(get_current_clerk_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get current user information.
-    For now, we're using clerk_id as a parameter. 
-    In production, this will come from JWT token via middleware.
+    The Clerk ID comes from the session token (or the clerk_id query
+    parameter in development).
+    A read only: served from a short-lived cache, with last_login recorded
+    in the background (at most once per LAST_LOGIN_UPDATE_INTERVAL_SECONDS).
     """
-    result = await db.execute(
-        select(User).where(User.clerk_id == clerk_id)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
+    user = profile_cache.get(clerk_id)
+    if user is None:
+        result = await db.execute(
+            select(User).where(User.clerk_id == clerk_id)
         )
-    
-    # Update last login
-    user.last_login = datetime.utcnow()
-    await db.commit()
-    await db.refresh(user)
+        row = result.scalar_one_or_none()
+        
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        
+        user = UserResponse.model_validate(row)
+        profile_cache.set(clerk_id, user)
+    
+    await last_login.touch(user.id)
     
     return user
 
@@ -47,13 +64,13 @@ async def get_current_user(
 @router.put("/me", response_model=UserResponse)
 async def update_current_user(
     user_update: UserUpdate,
-    clerk_id: str,  # This will come from auth middleware later
+    clerk_id: str = Depends(get_current_clerk_id),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Update current user information.
-    For now, we're using clerk_id as a parameter.
-    In production, this will come from JWT token via middleware.
+    The Clerk ID comes from the session token (or the clerk_id query
+    parameter in development).
     """
     result = await db.execute(
         select(User).where(User.clerk_id == clerk_id)
@@ -75,6 +92,7 @@ async def update_current_user(
     
     await db.commit()
     await db.refresh(user)
+    profile_cache.pop(clerk_id)
     
     return user
 
@@ -82,48 +100,51 @@ async def update_current_user(
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(
     user_create: UserCreate,
+    identity: Optional[Identity] = Depends(get_identity),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new user.
     This endpoint will typically be called during the signup flow.
     """
-    # Check if user already exists
-    result = await db.execute(
-        select(User).where(User.clerk_id == user_create.clerk_id)
-    )
-    existing_user = result.scalar_one_or_none()
-    
-    if existing_user:
+    # With a session token, users can only sign themselves up
+    if identity is not None and identity.clerk_id != user_create.clerk_id:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User with this Clerk ID already exists"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Clerk ID does not match the session"
         )
     
-    # Check if email is already registered
+    # One round trip: insert unless the Clerk ID or email is taken
     result = await db.execute(
-        select(User).where(User.email == user_create.email)
+        insert(User)
+        .values(
+            id=generate_user_id(),
+            clerk_id=user_create.clerk_id,
+            email=user_create.email,
+            full_name=user_create.full_name,
+            avatar_url=user_create.avatar_url,
+        )
+        .on_conflict_do_nothing()
+        .returning(User)
     )
-    existing_email = result.scalar_one_or_none()
+    new_user = result.scalar_one_or_none()
     
-    if existing_email:
+    if new_user is None:
+        # Only on conflict: find out which one for the error message
+        result = await db.execute(
+            select(User.clerk_id).where(User.clerk_id == user_create.clerk_id)
+        )
+        if result.first() is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="User with this Clerk ID already exists"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this email already exists"
         )
     
-    # Create new user
-    new_user = User(
-        id=generate_user_id(),
-        clerk_id=user_create.clerk_id,
-        email=user_create.email,
-        full_name=user_create.full_name,
-        avatar_url=user_create.avatar_url,
-    )
-    
-    db.add(new_user)
     await db.commit()
-    await db.refresh(new_user)
     
     return new_user
 
@@ -0,0 +1,19 @@
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from app.config import settings
+
+# Create shared Redis client (connections are opened lazily)
+redis_client = redis.from_url(
+    settings.REDIS_URL,
+    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+)
+
+# Redis is a shared cache tier, never the source of truth: callers catch
+# these and fall back to the in-process tier or the origin.
+REDIS_ERRORS = (RedisError, OSError)
+
+
+def redis_key(*parts: str) -> str:
+    """Build a namespaced Redis key, e.g. queryforge:schema:conn_123"""
+    return ":".join((settings.REDIS_KEY_PREFIX, *parts))
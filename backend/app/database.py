@@ -1,6 +1,25 @@
+import time
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app.metrics import DB_POOL_WAIT
+from app import tracing
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default async pool, recording how long each checkout waits"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            DB_POOL_WAIT.observe(waited)
+            tracing.record("db_pool", waited)
+
 
 # Create async engine
 engine = create_async_engine(
@@ -8,8 +27,25 @@ engine = create_async_engine(
     echo=settings.DEBUG,
     future=True,
     pool_pre_ping=True,
+    poolclass=TimedQueuePool,
 )
 
+# Statement time for the current request's Server-Timing breakdown
+event.listen(engine.sync_engine, "before_cursor_execute", tracing.before_cursor_execute)
+event.listen(engine.sync_engine, "after_cursor_execute", tracing.after_cursor_execute)
+event.listen(engine.sync_engine, "handle_error", tracing.handle_error)
+
+
+def pool_stats() -> dict:
+    """Connections of the metadata database pool, for /metrics"""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -29,8 +65,9 @@ async def get_db():
     Dependency function to get database session.
     Usage: db: AsyncSession = Depends(get_db)
     """
-    async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+    with tracing.span("db_session"):
+        async with AsyncSessionLocal() as session:
+            try:
+                yield session
+            finally:
+                await session.close()
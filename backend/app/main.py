@@ -1,9 +1,29 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.config import settings
-from app.database import engine, Base
+from app.database import engine, pool_stats
+from app.metrics import stats_collector
 from app.utils.init_db import create_database_if_not_exists
+from app.services.connection_manager import connection_manager
+from app.services.write_behind import write_behind
+from app.middleware.auth import AuthMiddleware, identity_cache, jwks_cache
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.timing import TimingMiddleware
+from app.profiler import profiler
+from app.middleware.rate_limit import RateLimitMiddleware, admission
+from app.services.last_login import last_login
+from app.services.llm_scheduler import llm_scheduler
+from app.services.execution_registry import execution_registry
+from app.services.sql_analysis import sql_analyzer
+from app.services.sql_cache import sql_cache
+from app.services.schema_catalog import schema_catalog
+from app.services.schema_retrieval import schema_retriever
+from app.services.similarity import similarity_index
+from app.services.result_cache import result_cache
+from app.services.cost_guard import cost_guard
+from app.services.readiness import READY, readiness
 
 
 @asynccontextmanager
@@ -12,18 +32,38 @@ async def lifespan(app: FastAPI):
     Lifespan events for FastAPI application.
     Handles startup and shutdown events.
     """
-    # Check/create database before connecting
-    await create_database_if_not_exists()
+    # Creating the database is a development convenience; elsewhere it would
+    # only cost an extra connection on every boot (schema: Alembic migrations)
+    create_database = settings.STARTUP_CREATE_DATABASE
+    if create_database is None:
+        create_database = settings.ENVIRONMENT == "development"
+    if create_database:
+        await create_database_if_not_exists()
     
-    # Startup: Create database tables
-    async with engine.begin() as conn:
-        # In production, use Alembic migrations instead
-        # await conn.run_sync(Base.metadata.create_all)
-        pass
+    # Start closing idle target database pools in the background
+    await connection_manager.start()
+    
+    # Flush query history, feedback and last_login writes in the background
+    await write_behind.start()
+    await last_login.start()
+    
+    # Keep Clerk's signing keys fresh so tokens are verified locally
+    if settings.CLERK_JWKS_URL:
+        await jwks_cache.start()
+    
+    # Warm the metadata pool in the background; /readyz passes once it's done
+    await readiness.start()
     
     yield
     
-    # Shutdown: Dispose engine
+    # Shutdown: Fail readiness, drain pending writes, close target database
+    # pools, then dispose engine
+    await readiness.close()
+    await jwks_cache.close()
+    await last_login.close()
+    await write_behind.close()
+    await connection_manager.close()
+    sql_analyzer.close()
     await engine.dispose()
 
 
@@ -37,6 +77,13 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Middleware added first runs innermost: rate limits need the identity
+# AuthMiddleware resolves, and both run inside CORS
+app.add_middleware(RateLimitMiddleware)
+
+# Verify session tokens
+app.add_middleware(AuthMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -46,6 +93,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request spans (Server-Timing header, trace logs) and sampled profiles
+app.add_middleware(TimingMiddleware)
+
+# Request latency histograms; outermost, so every middleware is timed
+app.add_middleware(MetricsMiddleware)
+
+# Component stats exported at /metrics, read when it is scraped
+for component, stats in (
+    ("db_pool", pool_stats),
+    ("target_pools", connection_manager.stats),
+    ("write_behind", write_behind.stats),
+    ("last_login", last_login.stats),
+    ("jwks", jwks_cache.stats),
+    ("identity_cache", identity_cache.stats),
+    ("llm_scheduler", llm_scheduler.stats),
+    ("sql_cache", sql_cache.stats),
+    ("schema_cache", schema_catalog.stats),
+    ("similarity", similarity_index.stats),
+    ("schema_retrieval", schema_retriever.stats),
+    ("sql_analysis", sql_analyzer.stats),
+    ("result_cache", result_cache.stats),
+    ("cost_guard", cost_guard.stats),
+    ("executions", execution_registry.stats),
+    ("profiler", profiler.stats),
+    ("readiness", readiness.stats),
+):
+    stats_collector.register(component, stats)
+for limit in (*admission.user_limits.values(), admission.connection_limit):
+    stats_collector.register("rate_limit", limit.stats, limit=limit.name)
+for limit in admission.concurrency.values():
+    stats_collector.register("admission", limit.stats, limit=limit.name)
+
 
 # Root endpoint
 @app.get("/")
@@ -64,18 +143,57 @@ async def root():
 async def health_check():
     """Health check endpoint for monitoring"""
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness.state == READY else readiness.state,
         "environment": settings.ENVIRONMENT,
         "version": settings.VERSION,
+        "write_behind": write_behind.stats(),
+        "last_login": last_login.stats(),
+        "admission": admission.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "executions": execution_registry.stats(),
     }
 
 
+# Liveness probe
+@app.get("/livez")
+async def liveness():
+    """
+    Liveness probe: the worker is up and serving. Dependencies aren't
+    checked, so an outage doesn't get workers restarted; the result of the
+    last readiness check is included for information.
+    """
+    return {"status": "alive", "state": readiness.state, "checks": readiness.last_checks()}
+
+
+# Readiness probe
+@app.get("/readyz")
+async def readiness_check(response: Response):
+    """
+    Readiness probe: 200 once warm-up has finished and the database (and
+    Redis, if required) is reachable, 503 before that, while a dependency
+    is down, and during shutdown.
+    """
+    ready, checks = await readiness.check()
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {
+        "status": "ready" if ready else ("unavailable" if readiness.state == READY else readiness.state),
+        "checks": checks,
+    }
+
+
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Request latencies and component stats, in the Prometheus text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # API v1 routes
-from app.api.v1 import users, connections
+from app.api.v1 import users, connections, queries, feedback, analytics
 
 app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
 app.include_router(connections.router, prefix="/api/v1/connections", tags=["connections"])
-
-# Future routes:
-# app.include_router(queries.router, prefix="/api/v1/queries", tags=["queries"])
-# app.include_router(feedback.router, prefix="/api/v1/feedback", tags=["feedback"])
+app.include_router(queries.router, prefix="/api/v1/queries", tags=["queries"])
+app.include_router(feedback.router, prefix="/api/v1/feedback", tags=["feedback"])
+app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["analytics"])
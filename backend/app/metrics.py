@@ -0,0 +1,106 @@
+"""
+Prometheus metrics, served at /metrics.
+
+Two kinds:
+- Instruments updated on the hot path: request latency (MetricsMiddleware),
+  metadata database pool waits, LLM call latency and tokens. Labelled
+  children are bound once and reused, so recording is one observe() or
+  inc() on an existing child, with no label dicts built per request.
+- Component stats, read at scrape time: each registered stats() dict
+  (queues, caches, pools, the LLM scheduler, ...) is exported when /metrics
+  is scraped and costs nothing in between. Keys of the component's
+  _counters dict become counters (<name>_total); other numbers and
+  booleans become gauges, nested dicts are flattened, anything else is
+  skipped.
+
+Metrics are per worker process.
+"""
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+NAMESPACE = "queryforge"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, until the response body is sent",
+    ["method", "route", "status"],
+    namespace=NAMESPACE,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time to check out a metadata database connection, connecting included",
+    namespace=NAMESPACE,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds",
+    "LLM provider calls, each hedge and retry counted separately",
+    ["outcome"],
+    namespace=NAMESPACE,
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Tokens sent to (prompt) and received from (completion) the LLM provider",
+    ["kind"],
+    namespace=NAMESPACE,
+)
+
+
+def _flatten(stats: dict, prefix: str = "") -> Iterator[Tuple[str, object]]:
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        else:
+            yield f"{prefix}{key}", value
+
+
+class StatsCollector(Collector):
+    """
+    Usage:
+        stats_collector.register("write_behind", write_behind.stats)
+        stats_collector.register("rate_limit", limit.stats, limit=limit.name)
+
+    Sources registered under the same component share metric families, so
+    they must use the same label names.
+    """
+
+    def __init__(self):
+        self._sources: List[Tuple[str, Callable[[], dict], Tuple[str, ...], List[str]]] = []
+
+    def register(self, component: str, stats: Callable[[], dict], **labels: str) -> None:
+        self._sources.append((component, stats, tuple(labels), list(labels.values())))
+
+    def describe(self) -> List[Metric]:
+        # Names depend on what the sources return; don't collect at registration
+        return []
+
+    def collect(self) -> Iterator[Metric]:
+        families: Dict[str, Metric] = {}
+        for component, stats, label_names, label_values in self._sources:
+            counters = getattr(getattr(stats, "__self__", None), "_counters", {})
+            for key, value in _flatten(stats()):
+                if isinstance(value, bool):
+                    value = int(value)
+                elif not isinstance(value, (int, float)):
+                    continue
+                name = f"{NAMESPACE}_{component}_{key}"
+                family = families.get(name)
+                if family is None:
+                    kind = CounterMetricFamily if key in counters else GaugeMetricFamily
+                    family = families[name] = kind(
+                        name, f"{component} stats: {key}", labels=label_names
+                    )
+                family.add_metric(label_values, value)
+        yield from families.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
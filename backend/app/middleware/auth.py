@@ -0,0 +1,321 @@
+"""
+Authentication: local JWT verification and a cached identity lookup.
+
+Clerk session tokens are verified in-process against Clerk's JWKS, which is
+fetched once, refreshed in the background and re-fetched early only when a
+token names an unknown key (rotation). The token's subject (clerk_id) maps
+to our User.id and role through a TTL-bounded in-process cache, so an
+authenticated request touches neither the network nor the database.
+
+AuthMiddleware stores the result on request.state.identity; endpoints get
+it through the get_current_user_id / get_current_clerk_id dependencies.
+While AUTH_REQUIRED is off (local development), requests without a token
+fall back to the user_id / clerk_id query parameters.
+
+Tests can verify tokens against a local JWKS stand-in, either by pointing
+CLERK_JWKS_URL at a local server or by swapping the fetcher:
+    async def local_jwks():
+        return {"keys": [test_public_jwk]}
+    jwks_cache.fetcher = local_jwks
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from fastapi import HTTPException, Request, status
+from jose import JWTError, jwk, jwt
+from jose.exceptions import JWKError
+from jose.backends.base import Key
+from sqlalchemy import select
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.user import User, UserRole
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_PATHS = {"/", "/health", "/livez", "/readyz", "/metrics", "/docs", "/redoc", "/openapi.json"}
+ALGORITHMS = ["RS256"]
+
+
+class AuthError(Exception):
+    """Raised when a token can't be verified"""
+
+
+@dataclass(frozen=True)
+class Identity:
+    """The authenticated caller"""
+    clerk_id: str
+    user_id: Optional[str]  # None until the user has signed up with us
+    role: Optional[UserRole] = None
+
+
+class JWKSCache:
+    """
+    Signing keys by kid, refreshed in the background.
+
+    Usage:
+        await jwks_cache.start()
+        key = await jwks_cache.get_key(kid)
+    """
+
+    def __init__(
+        self,
+        url: str = settings.CLERK_JWKS_URL,
+        refresh_interval: float = settings.JWKS_REFRESH_SECONDS,
+        min_refetch_interval: float = settings.JWKS_MIN_REFETCH_SECONDS,
+        fetcher: Optional[Callable[[], Awaitable[dict]]] = None,
+    ):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.fetcher = fetcher or self._fetch
+        self._keys: Dict[str, Key] = {}
+        self._fetched_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"refreshes": 0, "refresh_errors": 0, "unknown_kid_refetches": 0}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def get_key(self, kid: str) -> Key:
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        # Unknown kid: the keys may have rotated. Re-fetch, but not on every
+        # bad token, or anyone could make us hammer the JWKS endpoint.
+        if time.monotonic() - self._fetched_at >= self.min_refetch_interval:
+            self._counters["unknown_kid_refetches"] += 1
+            await self.refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            raise AuthError("Unknown signing key")
+        return key
+
+    async def refresh(self) -> None:
+        """Fetch the JWKS; concurrent callers share one fetch"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._load())
+        await asyncio.shield(self._refreshing)
+
+    def stats(self) -> dict:
+        return {**self._counters, "keys": len(self._keys)}
+
+    async def _load(self) -> None:
+        self._fetched_at = time.monotonic()
+        try:
+            keys = self._parse(await self.fetcher())
+        except Exception as e:
+            # Also a malformed document, so it can't end the refresh loop
+            self._counters["refresh_errors"] += 1
+            logger.warning("JWKS refresh failed: %r", e)
+            return
+        # Keep the old keys if the response was empty or broken
+        if keys:
+            self._keys = keys
+        self._counters["refreshes"] += 1
+
+    @staticmethod
+    def _parse(document: dict) -> Dict[str, Key]:
+        keys = {}
+        for key in document.get("keys", []):
+            if not isinstance(key, dict) or not isinstance(key.get("kid"), str):
+                continue
+            if key.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[key["kid"]] = jwk.construct(key, algorithm=key.get("alg", ALGORITHMS[0]))
+            except (JWKError, TypeError, ValueError) as e:
+                logger.warning("Skipping unusable JWKS key %s: %s", key["kid"], e)
+        return keys
+
+    async def _fetch(self) -> dict:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+            return response.json()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+
+class IdentityCache:
+    """clerk_id -> Identity, TTL-bounded; misses do one users lookup, shared by concurrent requests"""
+
+    def __init__(
+        self,
+        maxsize: int = settings.IDENTITY_CACHE_MAX_ENTRIES,
+        ttl: float = settings.IDENTITY_CACHE_TTL_SECONDS,
+    ):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._counters = {"hits": 0, "misses": 0}
+
+    async def get(self, clerk_id: str) -> Identity:
+        identity = self._cache.get(clerk_id)
+        if identity is not None:
+            self._counters["hits"] += 1
+            return identity
+        self._counters["misses"] += 1
+
+        task = self._loading.get(clerk_id)
+        if task is None:
+            task = self._loading[clerk_id] = asyncio.ensure_future(self._load(clerk_id))
+            task.add_done_callback(lambda _: self._loading.pop(clerk_id, None))
+        return await asyncio.shield(task)
+
+    def invalidate(self, clerk_id: str) -> None:
+        self._cache.pop(clerk_id)
+
+    def stats(self) -> dict:
+        return {**self._counters, "entries": len(self._cache)}
+
+    async def _load(self, clerk_id: str) -> Identity:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(User.id, User.role).where(User.clerk_id == clerk_id)
+            )
+            row = result.first()
+        if row is None:
+            # Not cached, so signing up takes effect immediately
+            return Identity(clerk_id=clerk_id, user_id=None)
+        identity = Identity(clerk_id=clerk_id, user_id=row.id, role=row.role)
+        self._cache.set(clerk_id, identity)
+        return identity
+
+
+jwks_cache = JWKSCache()
+identity_cache = IdentityCache()
+
+
+async def verify_token(token: str) -> dict:
+    """Verify a session token's signature and claims; returns the claims"""
+    try:
+        header = jwt.get_unverified_header(token)
+        key = await jwks_cache.get_key(header.get("kid") or "")
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=ALGORITHMS,
+            issuer=settings.CLERK_ISSUER or None,
+            options={"verify_aud": False, "leeway": settings.AUTH_CLOCK_SKEW_SECONDS},
+        )
+    except JWTError as e:
+        raise AuthError(str(e)) from e
+    if not claims.get("sub"):
+        raise AuthError("Token has no subject")
+    authorized_parties = settings.AUTH_AUTHORIZED_PARTIES
+    if authorized_parties and claims.get("azp") not in authorized_parties:
+        raise AuthError("Token was issued for another origin")
+    return claims
+
+
+class AuthMiddleware:
+    """
+    Resolves the bearer token of each HTTP request into an Identity.
+    Pure ASGI (no BaseHTTPMiddleware), so streaming responses are untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in PUBLIC_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})
+        token = _bearer_token(scope)
+        if token is None:
+            if settings.AUTH_REQUIRED:
+                await _unauthorized("Not authenticated")(scope, receive, send)
+                return
+            scope["state"]["identity"] = None
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            claims = await verify_token(token)
+        except AuthError as e:
+            await _unauthorized(f"Invalid token: {e}")(scope, receive, send)
+            return
+        scope["state"]["identity"] = await identity_cache.get(claims["sub"])
+        await self.app(scope, receive, send)
+
+
+def _bearer_token(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token.strip():
+                return token.strip()
+    return None
+
+
+def _unauthorized(detail: str) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def get_identity(request: Request) -> Optional[Identity]:
+    """Dependency: the caller's Identity, or None for a request without a token"""
+    return getattr(request.state, "identity", None)
+
+
+async def get_current_clerk_id(request: Request, clerk_id: Optional[str] = None) -> str:
+    """
+    Dependency: the caller's Clerk ID, from the token.
+    Without a token (only possible when AUTH_REQUIRED is off), the clerk_id
+    query parameter is used instead.
+    """
+    identity = get_identity(request)
+    if identity is not None:
+        return identity.clerk_id
+    if clerk_id and not settings.AUTH_REQUIRED:
+        return clerk_id
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def get_current_user_id(request: Request, user_id: Optional[str] = None) -> str:
+    """
+    Dependency: the caller's User.id, from the token.
+    Without a token (only possible when AUTH_REQUIRED is off), the user_id
+    query parameter is used instead.
+    """
+    identity = get_identity(request)
+    if identity is not None:
+        if identity.user_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        return identity.user_id
+    if user_id and not settings.AUTH_REQUIRED:
+        return user_id
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
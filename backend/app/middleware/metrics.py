@@ -0,0 +1,74 @@
+"""
+Request latency metrics.
+
+Each request is timed from arrival until its response body has been sent,
+and recorded in a histogram labelled by method, route template (e.g.
+/api/v1/queries/{query_id}/execute, never the raw path) and status code.
+Requests that match no route share one label value, so unknown paths can't
+inflate the number of series.
+"""
+import time
+from typing import Dict, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.metrics import HTTP_REQUEST_DURATION
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Runs outermost, so the latency covers every other middleware. Histogram
+    children are cached per (method, route, status); recording a request
+    builds no label dicts.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._children: Dict[Tuple[str, str, int], object] = {}
+        self._templates: Dict[int, str] = {}  # by id(route); routes live as long as the app
+
+    def _template(self, scope: Scope) -> str:
+        """
+        The matched route's full path template. Routes of an included router
+        may only know their path within it, so the router prefix is taken
+        once from the request path: the segments in front of the route's own.
+        """
+        route = scope.get("route")
+        path = getattr(route, "path", None)
+        if path is None:
+            return UNMATCHED_ROUTE
+        template = self._templates.get(id(route))
+        if template is None:
+            segments = scope["path"].split("/")
+            prefix = segments[: len(segments) - len(path.split("/")) + 1]
+            template = self._templates[id(route)] = "/".join(prefix).rstrip("/") + path
+        return template
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the scope
+            route = self._template(scope)
+            key = (scope["method"], route, status_code)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = HTTP_REQUEST_DURATION.labels(
+                    scope["method"], route, str(status_code)
+                )
+            child.observe(time.perf_counter() - started)
@@ -0,0 +1,300 @@
+"""
+Rate limiting and admission control for the expensive endpoints.
+
+SQL generation (an LLM call) and execution (work on a user's database) are
+limited three ways:
+
+- per user and per target connection, `limit` requests per
+  RATE_LIMIT_WINDOW_SECONDS: an in-process token bucket turns away bursts
+  without a network call, and a Redis sliding window behind it makes the
+  limit hold across workers (if Redis is down, the token bucket alone
+  applies);
+- per worker, at most ADMISSION_MAX_CONCURRENT_GENERATIONS /
+  ..._EXECUTIONS requests in flight; others wait up to
+  ADMISSION_QUEUE_TIMEOUT_SECONDS for a slot.
+
+Rejected requests get 429 with Retry-After. RateLimitMiddleware applies the
+user and concurrency limits by route; the connection is only known once an
+endpoint has loaded it, so endpoints call admission.check_connection().
+"""
+import asyncio
+import logging
+import math
+import re
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+GENERATE = "generate"
+EXECUTE = "execute"
+
+# (method, path) -> the kind of work a request does
+LIMITED_ROUTES = (
+    ("POST", re.compile(r"^/api/v1/queries/?$"), GENERATE),
+    ("POST", re.compile(r"^/api/v1/queries/[^/]+/execute(/stream)?$"), EXECUTE),
+    ("GET", re.compile(r"^/api/v1/queries/[^/]+/export$"), EXECUTE),
+)
+
+
+class RateLimited(Exception):
+    """Raised when a request is over a limit"""
+
+    def __init__(self, limit: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded: {limit}")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-key buckets of `burst` tokens, refilled at `rate` tokens per second"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        # key -> (tokens, updated_at)
+        self._buckets = LRUCache(maxsize=max_keys)
+
+    def take(self, key: str) -> float:
+        """Take a token; returns 0 if there was one, else seconds until there is"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            self._buckets.set(key, (tokens - 1, now))
+            return 0.0
+        self._buckets.set(key, (tokens, now))
+        return (1 - tokens) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimit:
+    """
+    `limit` requests per `window` seconds per key.
+
+    Usage:
+        retry_after = await limit.hit(user_id)  # 0 if allowed
+    """
+
+    def __init__(self, name: str, limit: int, window: float, max_keys: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.bucket = TokenBucket(rate=limit / window, burst=limit, max_keys=max_keys)
+        self._counters = {"allowed": 0, "rejected_local": 0, "rejected_shared": 0, "redis_errors": 0}
+
+    async def hit(self, key: str) -> float:
+        retry_after = self.bucket.take(key)
+        if retry_after:
+            self._counters["rejected_local"] += 1
+            return retry_after
+        try:
+            retry_after = await self._hit_window(key)
+        except REDIS_ERRORS as e:
+            # This worker's token bucket still applies
+            self._counters["redis_errors"] += 1
+            logger.debug("Shared rate limit %s unavailable: %s", self.name, e)
+            retry_after = 0.0
+        if retry_after:
+            self._counters["rejected_shared"] += 1
+            return retry_after
+        self._counters["allowed"] += 1
+        return 0.0
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "limit": self.limit,
+            "window_seconds": self.window,
+            "tracked_keys": len(self.bucket),
+        }
+
+    async def _hit_window(self, key: str) -> float:
+        """
+        Sliding window approximated from two fixed-window counters: the
+        previous window's count, weighted by how much of it still overlaps
+        the sliding window, plus the current one. One round trip.
+        """
+        now = time.time()
+        index, offset = divmod(now, self.window)
+        elapsed = offset / self.window
+        current_key = redis_key("ratelimit", self.name, key, str(int(index)))
+        previous_key = redis_key("ratelimit", self.name, key, str(int(index) - 1))
+
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(current_key)
+        pipe.expire(current_key, math.ceil(self.window * 2))
+        pipe.get(previous_key)
+        current, _, previous = await pipe.execute()
+        previous = int(previous or 0)
+
+        if previous * (1 - elapsed) + current <= self.limit:
+            return 0.0
+        # Rejected requests don't count against the window
+        await redis_client.decr(current_key)
+        if current > self.limit or not previous:
+            return (1 - elapsed) * self.window
+        # Wait until enough of the previous window has slid out
+        return max((1 - (self.limit - current) / previous - elapsed) * self.window, 0.001)
+
+
+class ConcurrencyLimit:
+    """At most `limit` requests in flight; others wait up to `queue_timeout` seconds for a slot"""
+
+    def __init__(self, name: str, limit: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self._in_flight = 0
+        self._waiting = 0
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked():
+            self._counters["queued"] += 1
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._counters["rejected"] += 1
+            raise RateLimited(self.name, retry_after=1.0)
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {**self._counters, "limit": self.limit, "in_flight": self._in_flight, "waiting": self._waiting}
+
+
+class AdmissionController:
+    """The configured limits; see the module docstring"""
+
+    def __init__(
+        self,
+        enabled: bool = settings.RATE_LIMIT_ENABLED,
+        window: float = settings.RATE_LIMIT_WINDOW_SECONDS,
+        max_keys: int = settings.RATE_LIMIT_MAX_TRACKED_KEYS,
+        queue_timeout: float = settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.enabled = enabled
+        self.user_limits: Dict[str, RateLimit] = {
+            GENERATE: RateLimit("user_generate", settings.RATE_LIMIT_USER_GENERATIONS, window, max_keys),
+            EXECUTE: RateLimit("user_execute", settings.RATE_LIMIT_USER_EXECUTIONS, window, max_keys),
+        }
+        self.connection_limit = RateLimit(
+            "connection", settings.RATE_LIMIT_CONNECTION_REQUESTS, window, max_keys
+        )
+        self.concurrency: Dict[str, ConcurrencyLimit] = {
+            GENERATE: ConcurrencyLimit(
+                "concurrent_generations", settings.ADMISSION_MAX_CONCURRENT_GENERATIONS, queue_timeout
+            ),
+            EXECUTE: ConcurrencyLimit(
+                "concurrent_executions", settings.ADMISSION_MAX_CONCURRENT_EXECUTIONS, queue_timeout
+            ),
+        }
+
+    def classify(self, method: str, path: str) -> Optional[str]:
+        for route_method, pattern, kind in LIMITED_ROUTES:
+            if method == route_method and pattern.match(path):
+                return kind
+        return None
+
+    async def check_user(self, kind: str, key: str) -> None:
+        limit = self.user_limits[kind]
+        retry_after = await limit.hit(key)
+        if retry_after:
+            raise RateLimited(limit.name, retry_after)
+
+    async def check_connection(self, connection_id: str) -> None:
+        """Count a generation or execution against a connection; raises 429 when it's over its limit"""
+        if not self.enabled:
+            return
+        retry_after = await self.connection_limit.hit(connection_id)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests for this connection, try again later",
+                headers={"Retry-After": _retry_after_header(retry_after)},
+            )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "user": {kind: limit.stats() for kind, limit in self.user_limits.items()},
+            "connection": self.connection_limit.stats(),
+            "concurrency": {kind: limit.stats() for kind, limit in self.concurrency.items()},
+        }
+
+
+admission = AdmissionController()
+
+
+class RateLimitMiddleware:
+    """
+    Applies the per-user and concurrency limits to generation and execution
+    requests. Must run inside AuthMiddleware, which identifies the user.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        kind = None
+        if scope["type"] == "http" and admission.enabled:
+            kind = admission.classify(scope["method"], scope["path"])
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        concurrency = admission.concurrency[kind]
+        try:
+            await admission.check_user(kind, _caller_key(scope))
+            await concurrency.acquire()
+        except RateLimited as e:
+            await _too_many_requests(e)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            concurrency.release()
+
+
+def _caller_key(scope: Scope) -> str:
+    identity = scope.get("state", {}).get("identity")
+    if identity is not None:
+        return identity.user_id or identity.clerk_id
+    # No token (AUTH_REQUIRED off): the user_id parameter, else the client address
+    user_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("user_id")
+    if user_id:
+        return user_id[0]
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "anonymous"
+
+
+def _retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def _too_many_requests(error: RateLimited) -> JSONResponse:
+    return JSONResponse(
+        {"detail": "Too many requests, try again later", "limit": error.limit},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": _retry_after_header(error.retry_after)},
+    )
@@ -0,0 +1,71 @@
+"""
+Per-request timing: Server-Timing header, trace logs and profiling.
+
+Every HTTP request gets a RequestTimings (see app.tracing). When the
+response starts, its spans are sent in a Server-Timing header
+(SERVER_TIMING_ENABLED). When the response is complete, requests slower
+than TRACE_LOG_MIN_MS are logged as one JSON line (TRACE_LOG_ENABLED).
+A sampled fraction of requests is also profiled (see app.profiler).
+"""
+import json
+import logging
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.profiler import profiler
+from app.tracing import start_request
+
+logger = logging.getLogger(__name__)
+
+
+class TimingMiddleware:
+    """
+    Runs right inside MetricsMiddleware, so spans are available to every
+    other middleware and the header's total covers them.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        server_timing: bool = settings.SERVER_TIMING_ENABLED,
+        trace_log: bool = settings.TRACE_LOG_ENABLED,
+        trace_log_min_ms: float = settings.TRACE_LOG_MIN_MS,
+    ):
+        self.app = app
+        self.server_timing = server_timing
+        self.trace_log = trace_log
+        self.trace_log_min_ms = trace_log_min_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_request()
+        profile = profiler.start(f"{scope['method']} {scope['path']}")
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            duration_ms = timings.elapsed_ms()
+            if profile is not None:
+                await profiler.finish(profile)
+            if self.trace_log and duration_ms >= self.trace_log_min_ms:
+                logger.info("request trace %s", json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "spans": timings.as_dict(),
+                }))
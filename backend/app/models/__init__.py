@@ -2,3 +2,4 @@ from app.models.user import User, UserRole
 from app.models.query import Query, QueryStatus
 from app.models.feedback import Feedback
 from app.models.connection import DatabaseConnection
+from app.models.rollup import QueryDailyRollup
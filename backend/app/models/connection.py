@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, Float, DateTime, ForeignKey, Boolean, Index, text
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -22,9 +23,35 @@ class DatabaseConnection(Base):
     
     is_primary = Column(Boolean, default=False)
     
+    # Seconds to cache query results for; NULL = server default, 0 = never
+    result_cache_ttl = Column(Integer, nullable=True)
+    
+    # Cost guard thresholds and statement timeout; NULL = server default, 0 = no limit
+    max_query_cost = Column(Float, nullable=True)  # planner cost units
+    max_query_rows = Column(BigInteger, nullable=True)  # estimated rows returned
+    statement_timeout_ms = Column(Integer, nullable=True)
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="connections")
     queries = relationship("Query", back_populates="connection")
+    
+    # Connection names are unique per user (the arbiter for create's ON CONFLICT).
+    # At most one primary connection per user: a partial uniqueness check on
+    # user_id WHERE is_primary. It is an exclusion constraint rather than a
+    # partial unique index only so it can be DEFERRABLE, i.e. checked at the end
+    # of the statement; set-primary flips the old and new primary in one UPDATE,
+    # which a row-by-row unique check could reject depending on row order.
+    __table_args__ = (
+        Index("uq_database_connections_user_id_name", "user_id", "name", unique=True),
+        ExcludeConstraint(
+            ("user_id", "="),
+            name="ex_database_connections_one_primary",
+            using="btree",
+            where=text("is_primary"),
+            deferrable=True,
+            initially="IMMEDIATE",
+        ),
+    )
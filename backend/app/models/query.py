@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Text, ARRAY
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Text, ARRAY, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -13,7 +13,7 @@ class Query(Base):
     __tablename__ = "queries"
     
     id = Column(String, primary_key=True)  # CUID
-    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     connection_id = Column(String, ForeignKey("database_connections.id", ondelete="SET NULL"), nullable=True)
     
     natural_language = Column(Text, nullable=False)
@@ -36,3 +36,12 @@ class Query(Base):
     user = relationship("User", back_populates="queries")
     connection = relationship("DatabaseConnection", back_populates="queries")
     feedback = relationship("Feedback", back_populates="query", uselist=False, cascade="all, delete-orphan")
+    
+    # History is read newest-first with keyset pagination on (created_at, id);
+    # these match that order so a page is an index range scan of `limit` rows.
+    # The user_id index also covers plain user_id lookups.
+    __table_args__ = (
+        Index("ix_queries_user_created_id", "user_id", created_at.desc(), id.desc()),
+        Index("ix_queries_user_status_created_id", "user_id", "status", created_at.desc(), id.desc()),
+        Index("ix_queries_connection_created_id", "connection_id", created_at.desc(), id.desc()),
+    )
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, String, Integer, BigInteger, Date, DateTime, ForeignKey, ARRAY
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class QueryDailyRollup(Base):
+    """
+    Per user, connection and day aggregates of the queries table.
+    Kept up to date incrementally as Query rows are written, so analytics
+    never scan query history. Rebuild with: python -m app.utils.backfill_rollups
+    """
+    __tablename__ = "query_daily_rollups"
+    
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # "" for queries without a connection; not a foreign key so analytics
+    # outlive deleted connections
+    connection_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day of Query.created_at
+    
+    # Counts per QueryStatus
+    total_count = Column(Integer, nullable=False, default=0)
+    success_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    warning_count = Column(Integer, nullable=False, default=0)
+    
+    # Execution stats (only queries that were executed have them)
+    executed_count = Column(Integer, nullable=False, default=0)
+    response_time_sum = Column(BigInteger, nullable=False, default=0)  # milliseconds
+    rows_returned_sum = Column(BigInteger, nullable=False, default=0)
+    # Count of response times per bucket of app.services.rollups.LATENCY_BUCKETS_MS
+    latency_histogram = Column(ARRAY(Integer), nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,195 @@
+"""
+Sampling profiler for individual requests.
+
+A fraction (PROFILER_SAMPLE_RATE) of requests is profiled. While any is in
+flight, a background thread wakes every PROFILER_INTERVAL_MS and records
+each profiled request's stack:
+- while the request's task is running, the event loop thread's stack from
+  the task's outermost coroutine up;
+- while it is suspended, its chain of awaiting coroutines, ending in a
+  "<suspended>" frame. Time spent waiting on the database or the LLM shows
+  up there, under the await that was waiting.
+Work the request hands to other tasks (streamed response bodies, queries
+run while watching for disconnects) shows up as the await on that task.
+
+Samples are written to PROFILER_OUTPUT_DIR when the request finishes, one
+file per request, as folded stacks ("outer;inner;leaf <count>" lines) that
+flamegraph.pl, speedscope and inferno read directly.
+
+Nothing runs while no request is being profiled. Sampling holds the GIL
+briefly, so every request in the worker slows down a little while a
+profile is in progress.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SUSPENDED = "<suspended>"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _await_chain(task: asyncio.Task) -> list:
+    """Frames of the task's coroutines, outermost first, down to what it awaits"""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = (
+            getattr(awaitable, "cr_frame", None)
+            or getattr(awaitable, "gi_frame", None)
+            or getattr(awaitable, "ag_frame", None)
+        )
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = (
+            getattr(awaitable, "cr_await", None)
+            or getattr(awaitable, "gi_yieldfrom", None)
+            or getattr(awaitable, "ag_await", None)
+        )
+    return frames
+
+
+class Profile:
+    """Samples of one request"""
+
+    def __init__(self, task: asyncio.Task, name: str):
+        self.task = task
+        self.name = name
+        self.started = time.time()
+        self.samples: Counter = Counter()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+
+class SamplingProfiler:
+    """
+    Usage:
+        profile = profiler.start("GET /api/v1/queries")  # None unless sampled
+        try:
+            ...
+        finally:
+            if profile is not None:
+                await profiler.finish(profile)
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = settings.PROFILER_SAMPLE_RATE,
+        interval_ms: float = settings.PROFILER_INTERVAL_MS,
+        output_dir: str = settings.PROFILER_OUTPUT_DIR,
+    ):
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self._active: Dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._counters = {"profiled": 0, "samples": 0, "written": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self, name: str) -> Optional[Profile]:
+        """Start profiling the current task, if this request is sampled"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        self._loop = task.get_loop()
+        self._loop_thread_id = threading.get_ident()
+        profile = Profile(task, name)
+        with self._lock:
+            self._active[id(profile)] = profile
+            self._counters["profiled"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    async def finish(self, profile: Profile) -> Optional[str]:
+        """Stop sampling the request and write its stacks; returns the file path"""
+        with self._lock:
+            self._active.pop(id(profile), None)
+        if not profile.samples:
+            return None
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", profile.name).strip("_")[:80]
+        path = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(profile.started))}"
+            f"-{os.getpid()}-{id(profile):x}-{slug}.folded",
+        )
+        try:
+            await asyncio.to_thread(self._write, path, profile.folded())
+        except OSError as e:
+            logger.warning("Could not write profile of %s: %s", profile.name, e)
+            return None
+        self._counters["written"] += 1
+        logger.info("Wrote profile of %s to %s", profile.name, path)
+        return path
+
+    @staticmethod
+    def _write(path: str, folded: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(folded)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            # Held while sampling, so finish() never sees a profile mid-update
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                self._sample(list(self._active.values()))
+
+    def _sample(self, profiles: List[Profile]) -> None:
+        top = sys._current_frames().get(self._loop_thread_id)
+        running = asyncio.current_task(self._loop)
+        for profile in profiles:
+            chain = _await_chain(profile.task)
+            if not chain:
+                continue
+            if profile.task is running and top is not None:
+                # Walk the loop thread's stack down to the task's outermost coroutine
+                frames = []
+                frame = top
+                while frame is not None and frame is not chain[0]:
+                    frames.append(frame)
+                    frame = frame.f_back
+                if frame is None:
+                    continue
+                frames.append(frame)
+                labels = [_frame_label(f) for f in reversed(frames)]
+            else:
+                labels = [_frame_label(f) for f in chain]
+                labels.append(SUSPENDED)
+            profile.samples[";".join(labels)] += 1
+            self._counters["samples"] += 1
+
+    def stats(self) -> dict:
+        return {**self._counters, "enabled": self.enabled, "active": len(self._active)}
+
+
+profiler = SamplingProfiler()
@@ -6,11 +6,21 @@ from app.schemas.connection import (
     DatabaseConnectionUpdate,
     DatabaseConnectionResponse,
     DatabaseConnectionTest,
+    DatabaseConnectionTestResult,
+    DatabaseConnectionBatchTestResult,
 )
 from app.schemas.query import (
     QueryCreate,
     QueryResponse,
+    QueryHistoryPage,
     QueryExecuteRequest,
     QueryExecuteResponse,
 )
-
+from app.schemas.feedback import FeedbackCreate, FeedbackResponse
+from app.schemas.analytics import UsageStats, DailyUsage, LatencyHistogram, UsageSummary
+from app.schemas.catalog import (
+    ColumnSchema,
+    ForeignKeySchema,
+    TableSchema,
+    SchemaCatalog,
+)
@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import date
+
+
+class UsageStats(BaseModel):
+    """Schema for aggregated query usage"""
+    total_queries: int
+    success_count: int
+    failed_count: int
+    warning_count: int
+    success_rate: Optional[float] = None  # None without queries
+    executed_count: int
+    avg_response_time_ms: Optional[float] = None  # None until something is executed
+    p50_response_time_ms: Optional[int] = None  # Histogram bucket upper bound
+    p95_response_time_ms: Optional[int] = None
+    rows_returned: int
+
+
+class DailyUsage(UsageStats):
+    """Schema for one day of query usage"""
+    day: date
+
+
+class LatencyHistogram(BaseModel):
+    """Schema for response time distribution"""
+    bucket_upper_bounds_ms: List[int]  # The last count is for slower queries
+    counts: List[int]
+
+
+class UsageSummary(UsageStats):
+    """Schema for query usage over a date range"""
+    start: date
+    end: date
+    connection_id: Optional[str] = None
+    latency_histogram: LatencyHistogram
@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from typing import Optional, List, Dict
+from datetime import datetime
+
+
+class ColumnSchema(BaseModel):
+    """A column of a target database table"""
+    name: str
+    data_type: str
+    nullable: bool
+    default: Optional[str] = None
+    comment: Optional[str] = None
+    is_primary_key: bool = False
+
+
+class ForeignKeySchema(BaseModel):
+    """A foreign key from one target table to another"""
+    columns: List[str]
+    referenced_table: str  # schema-qualified, e.g. public.customers
+    referenced_columns: List[str]
+
+
+class TableSchema(BaseModel):
+    """A table, view or materialized view in a target database"""
+    oid: int
+    schema_name: str
+    name: str
+    kind: str  # table, view, materialized_view, foreign_table
+    comment: Optional[str] = None
+    columns: List[ColumnSchema] = []
+    foreign_keys: List[ForeignKeySchema] = []
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.schema_name}.{self.name}"
+
+
+class SchemaCatalog(BaseModel):
+    """Introspected schema of a target database, as cached per connection"""
+    connection_id: str
+    fingerprint: str  # Changes only when table definitions change
+    tables: Dict[str, TableSchema]  # Keyed by qualified name
+    table_versions: Dict[int, str] = {}  # pg_class oid -> catalog row versions
+    introspected_at: datetime
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, List
 from datetime import datetime
 
 
@@ -11,6 +11,10 @@ class DatabaseConnectionBase(BaseModel):
     port: int
     database: str
     username: str
+    result_cache_ttl: Optional[int] = Field(None, ge=0)  # seconds; None = server default, 0 = off
+    max_query_cost: Optional[float] = Field(None, ge=0)  # planner cost; None = server default, 0 = no limit
+    max_query_rows: Optional[int] = Field(None, ge=0)  # estimated rows; None = server default, 0 = no limit
+    statement_timeout_ms: Optional[int] = Field(None, ge=0)  # None = server default, 0 = no limit
 
 
 class DatabaseConnectionCreate(DatabaseConnectionBase):
@@ -27,6 +31,10 @@ class DatabaseConnectionUpdate(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
     is_primary: Optional[bool] = None
+    result_cache_ttl: Optional[int] = Field(None, ge=0)
+    max_query_cost: Optional[float] = Field(None, ge=0)
+    max_query_rows: Optional[int] = Field(None, ge=0)
+    statement_timeout_ms: Optional[int] = Field(None, ge=0)
 
 
 class DatabaseConnectionResponse(DatabaseConnectionBase):
@@ -49,3 +57,24 @@ class DatabaseConnectionTest(BaseModel):
     database: str
     username: str
     password: str
+
+
+class DatabaseConnectionTestResult(BaseModel):
+    """Schema for the outcome of a connection test"""
+    connection_id: Optional[str] = None  # Set when testing a saved connection
+    success: bool
+    message: str
+    dialect: str
+    host: str
+    database: str
+    server_version: Optional[str] = None
+    connect_time_ms: Optional[float] = None
+    latency_ms: Optional[float] = None  # One round trip to the server
+
+
+class DatabaseConnectionBatchTestResult(BaseModel):
+    """Schema for testing all of a user's saved connections at once"""
+    results: List[DatabaseConnectionTestResult]
+    total: int
+    succeeded: int
+    elapsed_ms: float
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import Literal, Optional
+from datetime import datetime
+
+
+class FeedbackCreate(BaseModel):
+    """Schema for rating a generated query"""
+    query_id: str
+    rating: Literal[1, -1]  # 1 for helpful, -1 for not helpful
+    comment: Optional[str] = None
+
+
+class FeedbackResponse(BaseModel):
+    """Schema for feedback responses"""
+    id: str
+    query_id: str
+    user_id: str
+    rating: int
+    comment: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Any
+from typing import Optional, Any, List
 from datetime import datetime
 from app.models.query import QueryStatus
 
@@ -18,19 +18,29 @@ class QueryResponse(QueryBase):
     """Schema for query responses"""
     id: str
     user_id: str
-    connection_id: str
+    connection_id: Optional[str] = None  # None once the connection is deleted
     generated_sql: Optional[str] = None
+    query_type: Optional[str] = None  # SELECT, INSERT, ...
+    tables_used: Optional[List[str]] = None
     result_data: Optional[Any] = None
     status: QueryStatus
     error_message: Optional[str] = None
     execution_time_ms: Optional[int] = None
     rows_returned: Optional[int] = None
+    from_cache: bool = False  # SQL reused instead of generated by the LLM
     created_at: datetime
     
     class Config:
         from_attributes = True
 
 
+class QueryHistoryPage(BaseModel):
+    """Schema for one page of query history, newest first"""
+    items: List[QueryResponse]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to get the next page
+    has_more: bool
+
+
 class QueryExecuteRequest(BaseModel):
     """Schema for executing a query"""
     natural_language_query: str
@@ -46,3 +56,6 @@ class QueryExecuteResponse(BaseModel):
     error_message: Optional[str] = None
     execution_time_ms: int
     rows_returned: int
+    cached: bool = False  # Served from the result cache
+    cached_at: Optional[datetime] = None
+    cache_age_seconds: Optional[float] = None
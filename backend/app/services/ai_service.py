@@ -0,0 +1,110 @@
+"""
+AI service for natural language to SQL generation.
+Provider calls go through the LLM scheduler (see llm_scheduler.py).
+"""
+import asyncio
+import hashlib
+import re
+from typing import Iterable
+
+from app.schemas.catalog import SchemaCatalog, TableSchema
+from app.services.llm_providers import create_provider
+from app.services.llm_scheduler import INTERACTIVE, llm_scheduler
+from app.services.schema_retrieval import schema_retriever
+from app.services.sql_cache import normalize_question
+from app.tracing import span
+
+# Bump when the prompt template changes, so cached SQL from the old prompt
+# is not served for the new one
+PROMPT_VERSION = "1"
+
+SQL_PROMPT = """You are an expert PostgreSQL analyst.
+Convert the question into a single read-only PostgreSQL query.
+
+Database schema:
+{schema}
+
+Question: {question}
+
+Return ONLY the SQL query, no explanations."""
+
+_CODE_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+
+
+class AIServiceError(Exception):
+    """Raised when the LLM provider fails or returns no usable SQL"""
+
+
+def render_schema(tables: Iterable[TableSchema]) -> str:
+    """Render tables compactly for a prompt, one line per table"""
+    lines = []
+    for table in tables:
+        references = {
+            column: f"{fk.referenced_table}.{ref}"
+            for fk in table.foreign_keys
+            for column, ref in zip(fk.columns, fk.referenced_columns)
+        }
+        columns = []
+        for column in table.columns:
+            parts = [column.name, column.data_type]
+            if column.is_primary_key:
+                parts.append("PK")
+            if column.name in references:
+                parts.append(f"-> {references[column.name]}")
+            if column.comment:
+                parts.append(f"-- {column.comment}")
+            columns.append(" ".join(parts))
+        comment = f"  -- {table.comment}" if table.comment else ""
+        lines.append(f"{table.qualified_name}({', '.join(columns)}){comment}")
+    return "\n".join(lines)
+
+
+class AIService:
+    def __init__(self, provider=None):
+        self.provider = provider or create_provider()
+
+    @property
+    def model_name(self) -> str:
+        return self.provider.model_name
+
+    @property
+    def model_version(self) -> str:
+        """Identifies model and prompt, for keying generated-SQL caches"""
+        return f"{self.model_name}/p{PROMPT_VERSION}"
+
+    def build_prompt(self, natural_language: str, catalog: SchemaCatalog) -> str:
+        """The prompt, with only the tables relevant to the question"""
+        return SQL_PROMPT.format(
+            schema=render_schema(schema_retriever.select_tables(catalog, natural_language)),
+            question=natural_language,
+        )
+
+    def request_key(self, natural_language: str, catalog: SchemaCatalog) -> str:
+        """Requests with the same key share one provider call"""
+        question = hashlib.sha256(normalize_question(natural_language).encode()).hexdigest()[:32]
+        return f"{self.model_version}:{catalog.fingerprint}:{question}"
+
+    async def generate_sql(
+        self, natural_language: str, catalog: SchemaCatalog, priority: int = INTERACTIVE
+    ) -> str:
+        """Generate SQL for a question against the given schema"""
+        prompt = self.build_prompt(natural_language, catalog)
+        try:
+            with span("llm"):
+                text = await llm_scheduler.run(
+                    self.request_key(natural_language, catalog),
+                    lambda: self.provider.complete(prompt),
+                    priority=priority,
+                )
+        except asyncio.TimeoutError as e:
+            raise AIServiceError(f"SQL generation timed out: {e}") from e
+        except Exception as e:
+            raise AIServiceError(f"SQL generation failed: {e}") from e
+
+        sql = _CODE_FENCE.sub("", text.strip()).strip()
+        if not sql:
+            raise AIServiceError("The model returned an empty response")
+        return sql
+
+
+ai_service = AIService()
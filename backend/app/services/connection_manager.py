@@ -0,0 +1,286 @@
+"""
+Connection manager for user target databases.
+
+Keeps one bounded asyncpg pool per DatabaseConnection.id so that query
+execution does not pay a TCP + TLS + auth handshake on every request.
+Pools are created lazily, capped in number with LRU eviction, closed after
+sitting idle for a TTL, and rebuilt whenever the connection details change.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Set
+
+import asyncpg
+
+from app.config import settings
+from app.models.connection import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DIALECTS = {"postgresql"}
+
+
+class TargetConnectionError(Exception):
+    """Raised when a target database cannot be reached or is not supported"""
+
+
+class _PoolEntry:
+    """A live pool together with the bookkeeping needed for eviction"""
+
+    __slots__ = ("pool", "signature", "last_used", "borrowers")
+
+    def __init__(self, pool: asyncpg.Pool, signature: str):
+        self.pool = pool
+        self.signature = signature
+        self.last_used = time.monotonic()
+        # Callers of acquire() holding or waiting for a connection
+        self.borrowers = 0
+
+    def in_use(self) -> int:
+        return self.pool.get_size() - self.pool.get_idle_size()
+
+    def busy(self) -> bool:
+        return self.borrowers > 0 or self.in_use() > 0
+
+
+class ConnectionManager:
+    """
+    Registry of asyncpg pools keyed by DatabaseConnection.id.
+
+    Usage:
+        async with connection_manager.acquire(connection) as conn:
+            await conn.fetch("SELECT 1")
+    """
+
+    def __init__(
+        self,
+        max_pools: int = settings.TARGET_POOL_MAX_POOLS,
+        min_size: int = settings.TARGET_POOL_MIN_SIZE,
+        max_size: int = settings.TARGET_POOL_MAX_SIZE,
+        idle_ttl: float = settings.TARGET_POOL_IDLE_TTL_SECONDS,
+        connect_timeout: float = settings.TARGET_CONNECT_TIMEOUT_SECONDS,
+    ):
+        self.max_pools = max_pools
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.connect_timeout = connect_timeout
+
+        # Ordered from least to most recently used
+        self._pools: "OrderedDict[str, _PoolEntry]" = OrderedDict()
+        # In-flight pool creations, so concurrent first requests share one pool
+        self._creating: Dict[str, "asyncio.Future[_PoolEntry]"] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+        self._counters = {
+            "created": 0,
+            "acquisitions": 0,
+            "rebuilt": 0,
+            "evicted_lru": 0,
+            "evicted_idle": 0,
+            "eviction_deferred": 0,
+            "invalidated": 0,
+            "create_failures": 0,
+        }
+
+    @staticmethod
+    def signature(connection: DatabaseConnection) -> str:
+        """Digest of everything that requires a new pool when it changes"""
+        parts = (
+            connection.dialect,
+            connection.host,
+            str(connection.port),
+            connection.database,
+            connection.username,
+            connection.password,
+        )
+        return hashlib.sha256("\x00".join(parts).encode()).hexdigest()
+
+    async def get_pool(self, connection: DatabaseConnection) -> asyncpg.Pool:
+        """Return the pool for a connection, creating or rebuilding it if needed"""
+        if connection.dialect not in SUPPORTED_DIALECTS:
+            raise TargetConnectionError(
+                f"Dialect '{connection.dialect}' is not supported yet"
+            )
+
+        signature = self.signature(connection)
+        entry = self._pools.get(connection.id)
+        if entry is not None:
+            if entry.signature == signature:
+                self._pools.move_to_end(connection.id)
+                entry.last_used = time.monotonic()
+                return entry.pool
+            # Host, port or credentials changed since the pool was built
+            self._pools.pop(connection.id, None)
+            self._close_in_background(entry.pool)
+            self._counters["rebuilt"] += 1
+
+        pending = self._creating.get(connection.id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._create(connection, signature))
+            self._creating[connection.id] = pending
+        entry = await asyncio.shield(pending)
+        if entry.signature != signature:
+            # Another request built the pool from older details; rebuild it
+            return await self.get_pool(connection)
+        return entry.pool
+
+    @asynccontextmanager
+    async def acquire(
+        self, connection: DatabaseConnection
+    ) -> AsyncIterator[asyncpg.Connection]:
+        """Borrow a connection from the pool for the given DatabaseConnection"""
+        pool = await self.get_pool(connection)
+        entry = self._pools.get(connection.id)
+        if entry is not None:
+            # Counted before the connection is handed out, so eviction can't
+            # close the pool in between
+            entry.borrowers += 1
+        try:
+            try:
+                conn = await pool.acquire(timeout=self.connect_timeout)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+                raise TargetConnectionError(str(e) or e.__class__.__name__) from e
+
+            self._counters["acquisitions"] += 1
+            try:
+                yield conn
+            finally:
+                if entry is not None:
+                    entry.last_used = time.monotonic()
+                await pool.release(conn)
+        finally:
+            if entry is not None:
+                entry.borrowers -= 1
+
+    async def invalidate(self, connection_id: str) -> None:
+        """
+        Drop the pool for a connection.
+        Called when a connection is updated or deleted.
+        """
+        entry = self._pools.pop(connection_id, None)
+        if entry is not None:
+            self._counters["invalidated"] += 1
+            self._close_in_background(entry.pool)
+
+    async def start(self) -> None:
+        """Start the background task that closes idle pools"""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle_pools())
+
+    async def close(self) -> None:
+        """Stop the reaper and close every pool. Called on shutdown."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+
+        entries = list(self._pools.values())
+        self._pools.clear()
+        for entry in entries:
+            self._close_in_background(entry.pool)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """
+        Pool totals and lifecycle counters, for sizing and monitoring. No
+        per-connection breakdown: connection ids belong to their users.
+        """
+        pools = list(self._pools.values())
+        return {
+            "pools": len(pools),
+            "max_pools": self.max_pools,
+            "connections": sum(entry.pool.get_size() for entry in pools),
+            "in_use": sum(entry.in_use() for entry in pools),
+            **self._counters,
+        }
+
+    async def _create(
+        self, connection: DatabaseConnection, signature: str
+    ) -> _PoolEntry:
+        try:
+            pool = await asyncpg.create_pool(
+                host=connection.host,
+                port=connection.port,
+                database=connection.database,
+                user=connection.username,
+                password=connection.password,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                timeout=self.connect_timeout,
+                max_inactive_connection_lifetime=self.idle_ttl,
+            )
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            self._counters["create_failures"] += 1
+            raise TargetConnectionError(str(e) or e.__class__.__name__) from e
+        finally:
+            if self._creating.get(connection.id) is asyncio.current_task():
+                del self._creating[connection.id]
+
+        entry = _PoolEntry(pool, signature)
+        self._pools[connection.id] = entry
+        self._pools.move_to_end(connection.id)
+        self._counters["created"] += 1
+
+        self._evict_lru(keep=connection.id)
+        return entry
+
+    def _evict_lru(self, keep: Optional[str] = None) -> None:
+        """
+        Close least recently used pools beyond max_pools. Pools with borrowed
+        connections are skipped: closing them would terminate running queries
+        on other users' connections. Until they are released the cap may be
+        exceeded; the reaper applies it again. keep: a pool just created for
+        a caller that is about to use it.
+        """
+        excess = len(self._pools) - self.max_pools
+        if excess <= 0:
+            return
+        for connection_id, entry in list(self._pools.items()):
+            if excess <= 0:
+                break
+            if connection_id == keep or entry.busy():
+                continue
+            del self._pools[connection_id]
+            logger.info("Evicting least recently used pool for %s", connection_id)
+            self._counters["evicted_lru"] += 1
+            self._close_in_background(entry.pool)
+            excess -= 1
+        if excess > 0:
+            self._counters["eviction_deferred"] += 1
+
+    async def _reap_idle_pools(self) -> None:
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.idle_ttl
+            for connection_id, entry in list(self._pools.items()):
+                if entry.last_used < cutoff and not entry.busy():
+                    self._pools.pop(connection_id, None)
+                    self._counters["evicted_idle"] += 1
+                    self._close_in_background(entry.pool)
+            self._evict_lru()
+
+    def _close_in_background(self, pool: asyncpg.Pool) -> None:
+        task = asyncio.ensure_future(self._close_pool(pool))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_pool(self, pool: asyncpg.Pool) -> None:
+        # Let borrowed connections finish, but never hang shutdown on them
+        try:
+            await asyncio.wait_for(pool.close(), timeout=self.connect_timeout)
+        except Exception:
+            pool.terminate()
+
+
+connection_manager = ConnectionManager()
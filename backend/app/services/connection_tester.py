@@ -0,0 +1,120 @@
+"""
+Connection testing for user target databases.
+
+Opens a fresh (unpooled) connection so that a test really exercises the
+network path and credentials, then measures one round trip to the server.
+"""
+import asyncio
+import time
+from typing import Iterable, List, Optional
+
+import asyncpg
+
+from app.config import settings
+from app.services.connection_manager import SUPPORTED_DIALECTS
+
+
+async def probe_connection(
+    dialect: str,
+    host: str,
+    port: int,
+    database: str,
+    username: str,
+    password: str,
+    connection_id: Optional[str] = None,
+    connect_timeout: float = settings.CONNECTION_TEST_CONNECT_TIMEOUT_SECONDS,
+    query_timeout: float = settings.CONNECTION_TEST_QUERY_TIMEOUT_SECONDS,
+) -> dict:
+    """
+    Connect to a target database and report reachability, latency and version.
+    Never raises for connection problems; failures are reported in the result.
+    """
+    result = {
+        "connection_id": connection_id,
+        "success": False,
+        "message": "",
+        "dialect": dialect,
+        "host": host,
+        "database": database,
+        "server_version": None,
+        "connect_time_ms": None,
+        "latency_ms": None,
+    }
+
+    if dialect not in SUPPORTED_DIALECTS:
+        result["message"] = f"Dialect '{dialect}' is not supported yet"
+        return result
+
+    started = time.perf_counter()
+    try:
+        # The connect timeout covers TCP connect, TLS and authentication
+        conn = await asyncpg.connect(
+            host=host,
+            port=port,
+            database=database,
+            user=username,
+            password=password,
+            timeout=connect_timeout,
+        )
+    except asyncio.TimeoutError:
+        result["message"] = f"Connection timed out after {connect_timeout:g}s"
+        return result
+    except (
+        asyncpg.InvalidPasswordError,
+        asyncpg.InvalidAuthorizationSpecificationError,
+    ):
+        result["message"] = "Authentication failed"
+        return result
+    except asyncpg.InvalidCatalogNameError:
+        result["message"] = f"Database '{database}' does not exist"
+        return result
+    except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        result["message"] = f"Connection failed: {e}"
+        return result
+    result["connect_time_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    try:
+        round_trip_started = time.perf_counter()
+        version = await conn.fetchval("SHOW server_version", timeout=query_timeout)
+        result["latency_ms"] = round(
+            (time.perf_counter() - round_trip_started) * 1000, 2
+        )
+        result["server_version"] = version
+        result["success"] = True
+        result["message"] = "Connection test successful"
+    except asyncio.TimeoutError:
+        result["message"] = f"Server did not respond within {query_timeout:g}s"
+    except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        result["message"] = f"Connection failed: {e}"
+    finally:
+        try:
+            await conn.close(timeout=query_timeout)
+        except Exception:
+            conn.terminate()
+
+    return result
+
+
+async def probe_connections(
+    connections: Iterable,
+    concurrency: int = settings.CONNECTION_TEST_CONCURRENCY,
+) -> List[dict]:
+    """
+    Probe many saved connections at once with bounded concurrency.
+    Results are returned in the same order as the input.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(connection) -> dict:
+        async with semaphore:
+            return await probe_connection(
+                dialect=connection.dialect,
+                host=connection.host,
+                port=connection.port,
+                database=connection.database,
+                username=connection.username,
+                password=connection.password,
+                connection_id=connection.id,
+            )
+
+    return list(await asyncio.gather(*(probe(c) for c in connections)))
@@ -0,0 +1,161 @@
+"""
+Pre-execution cost guard for generated SQL.
+
+Before a query reads any rows from a target database:
+- statement_timeout and lock_timeout are set for its transaction
+  (SET LOCAL), so a runaway statement, or one stuck behind another
+  session's lock, is cut off by the server. Exports get their own
+  statement timeout (EXPORT_STATEMENT_TIMEOUT_MS): a download runs as long
+  as the client takes to read it;
+- interactive previews are wrapped in a LIMIT, so the database stops
+  producing rows the response would drop anyway;
+- the planner's estimate (EXPLAIN (FORMAT JSON), without ANALYZE, so
+  nothing runs) is compared with the connection's cost and row
+  thresholds, and the query is refused when it exceeds them. Exports are
+  only held to the cost threshold, since returning every row is their point.
+
+Estimates are remembered per connection and SQL for
+COST_GUARD_CACHE_TTL_SECONDS, so re-running a query skips the EXPLAIN.
+"""
+import json
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import asyncpg
+
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.services.sql_analysis import sql_analyzer
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CostEstimate:
+    total_cost: float  # planner cost units of the whole statement
+    rows: int  # rows the statement returns, after any LIMIT
+
+
+class CostLimitExceeded(Exception):
+    """Raised when the planner's estimate is over the connection's thresholds"""
+
+
+class CostGuard:
+    """
+    Usage:
+        sql = await cost_guard.preview_sql(sql, cost_guard.row_cap(connection, limit))
+        async with conn.transaction(readonly=True):
+            await cost_guard.check(conn, connection, sql, rows_capped=True)  # raises CostLimitExceeded
+            ...
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.COST_GUARD_ENABLED,
+        max_cost: float = settings.COST_GUARD_MAX_COST,
+        max_rows: int = settings.COST_GUARD_MAX_ROWS,
+        statement_timeout_ms: int = settings.EXECUTION_STATEMENT_TIMEOUT_MS,
+        export_statement_timeout_ms: int = settings.EXPORT_STATEMENT_TIMEOUT_MS,
+        lock_timeout_ms: int = settings.EXECUTION_LOCK_TIMEOUT_MS,
+        cache_size: int = settings.COST_GUARD_CACHE_SIZE,
+        cache_ttl: float = settings.COST_GUARD_CACHE_TTL_SECONDS,
+    ):
+        self.enabled = enabled
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.statement_timeout_ms = statement_timeout_ms
+        self.export_statement_timeout_ms = export_statement_timeout_ms
+        self.lock_timeout_ms = lock_timeout_ms
+        self._estimates = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._counters = {"checks": 0, "explains": 0, "rejected": 0, "limited": 0}
+
+    def limits_for(self, connection: DatabaseConnection) -> Tuple[float, int]:
+        """(max cost, max rows) for a connection; 0 means no limit"""
+        max_cost = self.max_cost if connection.max_query_cost is None else connection.max_query_cost
+        max_rows = self.max_rows if connection.max_query_rows is None else connection.max_query_rows
+        return max(max_cost, 0), max(max_rows, 0)
+
+    def row_cap(self, connection: DatabaseConnection, default: int) -> int:
+        """Rows an interactive preview may return: default, tightened by max rows"""
+        _, max_rows = self.limits_for(connection)
+        return min(default, max_rows) if max_rows else default
+
+    def timeout_for(self, connection: DatabaseConnection, export: bool = False) -> int:
+        if export:
+            return max(self.export_statement_timeout_ms, 0)
+        if connection.statement_timeout_ms is not None:
+            return max(connection.statement_timeout_ms, 0)
+        return max(self.statement_timeout_ms, 0)
+
+    async def preview_sql(self, sql: str, limit: int) -> str:
+        """
+        SQL returning at most limit rows of a single SELECT. A LIMIT already
+        in the query is kept, so the tighter of the two applies.
+        """
+        analysis = await sql_analyzer.analyze_async(sql)
+        if analysis.query_type != "SELECT" or not analysis.is_read_only:
+            return sql
+        self._counters["limited"] += 1
+        # The newline keeps a trailing -- comment from swallowing the wrapper
+        return f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n) AS preview LIMIT {int(limit)}"
+
+    async def check(
+        self,
+        conn: asyncpg.Connection,
+        connection: DatabaseConnection,
+        sql: str,
+        rows_capped: bool = False,
+        export: bool = False,
+    ) -> Optional[CostEstimate]:
+        """
+        Apply the connection's timeouts to the current transaction, then
+        compare the planner's estimate for sql with its thresholds. Pass
+        rows_capped for previews, whose LIMIT already bounds the rows, and
+        export for full downloads, which skip the row threshold and use the
+        export statement timeout.
+        Returns the estimate, or None when the guard is disabled.
+        """
+        await conn.execute(
+            f"SET LOCAL statement_timeout = {self.timeout_for(connection, export)};"
+            f"SET LOCAL lock_timeout = {max(self.lock_timeout_ms, 0)}"
+        )
+        if not self.enabled:
+            return None
+
+        self._counters["checks"] += 1
+        key = (connection.id, sql)
+        estimate: Optional[CostEstimate] = self._estimates.get(key)
+        if estimate is None:
+            self._counters["explains"] += 1
+            plan = await conn.fetchval(
+                f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}", column=0
+            )
+            top = json.loads(plan)[0]["Plan"]
+            estimate = CostEstimate(total_cost=float(top["Total Cost"]), rows=int(top["Plan Rows"]))
+            self._estimates.set(key, estimate)
+
+        max_cost, max_rows = self.limits_for(connection)
+        reason = None
+        if max_cost and estimate.total_cost > max_cost:
+            reason = (
+                f"Estimated cost {estimate.total_cost:,.0f} exceeds this connection's "
+                f"limit of {max_cost:,.0f}"
+            )
+        elif max_rows and not (rows_capped or export) and estimate.rows > max_rows:
+            reason = (
+                f"Estimated {estimate.rows:,} rows exceeds this connection's "
+                f"limit of {max_rows:,}"
+            )
+        if reason is not None:
+            self._counters["rejected"] += 1
+            logger.info("Cost guard refused a query on %s: %s", connection.id, reason)
+            raise CostLimitExceeded(reason)
+        return estimate
+
+    def stats(self) -> dict:
+        return {**self._counters, "enabled": self.enabled, "cached_estimates": len(self._estimates)}
+
+
+cost_guard = CostGuard()
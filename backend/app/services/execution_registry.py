@@ -0,0 +1,106 @@
+"""
+Registry of query executions running on target databases, for cancellation.
+
+While a QueryStream holds a target connection, the connection's backend
+pid is registered under the query id, in this worker and in Redis, so a
+cancel request reaching any worker can find it. Cancelling sends
+pg_cancel_backend() for each registered pid from another pooled
+connection; the running statement then fails with "canceling statement
+due to user request" and the execution ends like any other failed query.
+
+Entries are removed before the connection goes back to its pool, so a
+cancel can't reach a later, unrelated statement on the same backend.
+Redis entries also expire after EXECUTION_REGISTRY_TTL_SECONDS, in case a
+worker dies mid-query.
+"""
+import logging
+import secrets
+from typing import Dict, List
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.services.connection_manager import connection_manager
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionRegistry:
+    """
+    Usage:
+        token = await execution_registry.register(query_id, conn.get_server_pid())
+        try:
+            ...
+        finally:
+            await execution_registry.unregister(query_id, token)
+
+        cancelled = await execution_registry.cancel(query_id, connection)
+    """
+
+    def __init__(self, ttl: int = settings.EXECUTION_REGISTRY_TTL_SECONDS):
+        self.ttl = ttl
+        # query id -> {token: backend pid}
+        self._local: Dict[str, Dict[str, int]] = {}
+        self._counters = {"registered": 0, "cancel_requests": 0, "cancelled": 0}
+
+    @staticmethod
+    def _key(query_id: str) -> str:
+        return redis_key("executions", query_id)
+
+    async def register(self, query_id: str, pid: int) -> str:
+        """Record a running execution; returns the token to unregister it with"""
+        token = secrets.token_hex(8)
+        self._local.setdefault(query_id, {})[token] = pid
+        self._counters["registered"] += 1
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(self._key(query_id), token, pid)
+            pipe.expire(self._key(query_id), self.ttl)
+            await pipe.execute()
+        except REDIS_ERRORS as e:
+            logger.warning("Could not register execution of %s: %s", query_id, e)
+        return token
+
+    async def unregister(self, query_id: str, token: str) -> None:
+        executions = self._local.get(query_id, {})
+        executions.pop(token, None)
+        if not executions:
+            self._local.pop(query_id, None)
+        try:
+            await redis_client.hdel(self._key(query_id), token)
+        except REDIS_ERRORS as e:
+            logger.warning("Could not unregister execution of %s: %s", query_id, e)
+
+    async def running(self, query_id: str) -> List[int]:
+        """Backend pids of the query's executions, across workers"""
+        pids = set(self._local.get(query_id, {}).values())
+        try:
+            pids.update(int(pid) for pid in (await redis_client.hgetall(self._key(query_id))).values())
+        except REDIS_ERRORS as e:
+            logger.warning("Could not look up executions of %s: %s", query_id, e)
+        return sorted(pids)
+
+    async def cancel(self, query_id: str, connection: DatabaseConnection) -> int:
+        """
+        Cancel the query's running executions on the target database.
+        Returns how many were signalled; raises TargetConnectionError if the
+        target can't be reached.
+        """
+        self._counters["cancel_requests"] += 1
+        pids = await self.running(query_id)
+        if not pids:
+            return 0
+        async with connection_manager.acquire(connection) as conn:
+            cancelled = await conn.fetchval(
+                "SELECT count(*) FILTER (WHERE pg_cancel_backend(pid)) FROM unnest($1::int[]) AS pid",
+                pids,
+            )
+        self._counters["cancelled"] += cancelled
+        logger.info("Cancelled %d execution(s) of %s", cancelled, query_id)
+        return cancelled
+
+    def stats(self) -> dict:
+        return {**self._counters, "running": sum(len(e) for e in self._local.values())}
+
+
+execution_registry = ExecutionRegistry()
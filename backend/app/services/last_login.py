@@ -0,0 +1,120 @@
+"""
+Throttled, batched last_login tracking.
+
+The frontend polls GET /users/me, and writing users.last_login on every
+call turns a read into a row-contending write. Instead, a login is
+recorded at most once per user per LAST_LOGIN_UPDATE_INTERVAL_SECONDS
+(per worker in memory, and across workers through a Redis SET NX when
+Redis is available), and recorded logins are written by a background task
+in one bulk UPDATE every LAST_LOGIN_FLUSH_INTERVAL_SECONDS.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import case, or_, update
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.user import User
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginTracker:
+    """
+    Usage:
+        await last_login.start()      # app startup
+        await last_login.touch(user_id)
+        await last_login.close()      # app shutdown; flushes what's pending
+    """
+
+    def __init__(
+        self,
+        update_interval: float = settings.LAST_LOGIN_UPDATE_INTERVAL_SECONDS,
+        flush_interval: float = settings.LAST_LOGIN_FLUSH_INTERVAL_SECONDS,
+        max_tracked_users: int = settings.LAST_LOGIN_MAX_TRACKED_USERS,
+    ):
+        self.update_interval = update_interval
+        self.flush_interval = flush_interval
+        # user_id -> True while this worker has recorded a login within the interval
+        self._recent = LRUCache(maxsize=max_tracked_users, ttl=update_interval)
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"touches": 0, "recorded": 0, "written": 0, "flushes": 0, "failed_flushes": 0}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def touch(self, user_id: str) -> None:
+        """Note that the user is active; cheap enough to call on every request"""
+        self._counters["touches"] += 1
+        if self._recent.get(user_id):
+            return
+        self._recent.set(user_id, True)
+        try:
+            # Another worker may already have recorded this login
+            first = await redis_client.set(
+                redis_key("last_login", user_id), 1, nx=True, ex=int(self.update_interval) or 1
+            )
+            if not first:
+                return
+        except REDIS_ERRORS as e:
+            logger.debug("last_login throttle unavailable, recording locally: %s", e)
+        self._pending[user_id] = datetime.now(timezone.utc)
+        self._counters["recorded"] += 1
+
+    async def flush(self) -> None:
+        """Write all recorded logins with a single UPDATE"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        logged_in_at = case(pending, value=User.id)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(User)
+                    .where(User.id.in_(list(pending)))
+                    # Never move last_login backwards
+                    .where(or_(User.last_login.is_(None), User.last_login < logged_in_at))
+                    .values(last_login=logged_in_at)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+        except Exception as e:
+            # Not only SQLAlchemyError: with the database down, asyncpg
+            # raises OSError or a timeout straight through
+            self._counters["failed_flushes"] += 1
+            logger.warning("last_login flush failed, will retry: %s", e)
+            # Keep the newest timestamp per user for the next attempt
+            for user_id, when in pending.items():
+                if user_id not in self._pending:
+                    self._pending[user_id] = when
+            return
+        self._counters["flushes"] += 1
+        self._counters["written"] += len(pending)
+
+    def stats(self) -> dict:
+        return {**self._counters, "pending": len(self._pending)}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Keep flushing: logins recorded later would never be written
+                logger.exception("last_login flush failed")
+
+
+last_login = LastLoginTracker()
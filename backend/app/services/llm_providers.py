@@ -0,0 +1,99 @@
+"""
+LLM providers: the calls the scheduler makes to turn a prompt into text.
+
+LLM_PROVIDER selects one:
+- "gemini": Google Gemini (GEMINI_MODEL).
+- "stub": an offline stand-in for development, tests and benchmarks. It
+  answers after LLM_STUB_LATENCY_SECONDS with a query over the first table
+  in the prompt's schema.
+- "http": a completion server at LLM_HTTP_URL that takes {"prompt": ...}
+  and answers {"text": ...} (optionally with "usage": {"prompt_tokens",
+  "completion_tokens"}), such as benchmarks/llm_stub.py, so the provider
+  call crosses a real network hop.
+
+Providers count the tokens of each call (reported, or estimated) in the
+LLM token metrics.
+"""
+import asyncio
+import re
+
+import google.generativeai as genai
+import httpx
+
+from app.config import settings
+from app.metrics import LLM_TOKENS
+
+genai.configure(api_key=settings.GEMINI_API_KEY)
+
+# First relation in the prompt's "Database schema:" section
+_SCHEMA_TABLE = re.compile(r"^Database schema:\n([^\s(]+)\(", re.MULTILINE)
+
+_PROMPT_TOKENS = LLM_TOKENS.labels("prompt")
+_COMPLETION_TOKENS = LLM_TOKENS.labels("completion")
+
+
+def estimate_tokens(text: str) -> int:
+    """For providers that don't report usage: roughly 4 characters a token"""
+    return len(text) // 4 + 1
+
+
+def count_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    _PROMPT_TOKENS.inc(prompt_tokens)
+    _COMPLETION_TOKENS.inc(completion_tokens)
+
+
+class GeminiProvider:
+    def __init__(self, model_name: str = settings.GEMINI_MODEL):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        usage = response.usage_metadata
+        count_tokens(usage.prompt_token_count, usage.candidates_token_count)
+        return response.text
+
+
+class StubProvider:
+    model_name = "stub"
+
+    def __init__(self, latency: float = settings.LLM_STUB_LATENCY_SECONDS):
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        match = _SCHEMA_TABLE.search(prompt)
+        text = "SELECT 1" if match is None else f"SELECT * FROM {match.group(1)} LIMIT 100"
+        count_tokens(estimate_tokens(prompt), estimate_tokens(text))
+        return text
+
+
+class HTTPProvider:
+    model_name = "http"
+
+    def __init__(self, url: str = settings.LLM_HTTP_URL, timeout: float = settings.LLM_TIMEOUT_SECONDS):
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self._client.post(self.url, json={"prompt": prompt})
+        response.raise_for_status()
+        body = response.json()
+        usage = body.get("usage") or {}
+        count_tokens(
+            usage.get("prompt_tokens", estimate_tokens(prompt)),
+            usage.get("completion_tokens", estimate_tokens(body["text"])),
+        )
+        return body["text"]
+
+
+def create_provider(name: str = settings.LLM_PROVIDER):
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "stub":
+        return StubProvider()
+    if name == "http":
+        return HTTPProvider()
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -0,0 +1,235 @@
+"""
+Scheduler for LLM provider calls.
+
+- Single flight: concurrent requests with the same key (model, schema
+  fingerprint and normalized question) share one provider call. The call
+  runs in its own task, so a caller that goes away doesn't cancel it for
+  the others.
+- Concurrency: at most LLM_MAX_CONCURRENCY provider calls per worker. Freed
+  slots go to interactive requests before background ones, and background
+  work never holds more than LLM_BACKGROUND_MAX_CONCURRENCY slots.
+- Deadline: a request fails after LLM_TIMEOUT_SECONDS, queueing included.
+- Hedging: if a call hasn't answered after LLM_HEDGE_DELAY_SECONDS and a
+  slot is free, a second identical call is started and the first answer
+  wins. A failed call is retried while attempts (LLM_MAX_ATTEMPTS) and time
+  remain.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.metrics import LLM_CALL_DURATION
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_CALL_DURATION = {outcome: LLM_CALL_DURATION.labels(outcome) for outcome in ("ok", "error", "cancelled")}
+
+
+class LLMScheduler:
+    """
+    Usage:
+        text = await llm_scheduler.run(key, lambda: provider.complete(prompt))
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = settings.LLM_MAX_CONCURRENCY,
+        background_max_concurrency: int = settings.LLM_BACKGROUND_MAX_CONCURRENCY,
+        timeout: float = settings.LLM_TIMEOUT_SECONDS,
+        hedge_delay: float = settings.LLM_HEDGE_DELAY_SECONDS,
+        max_attempts: int = settings.LLM_MAX_ATTEMPTS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.background_max_concurrency = min(background_max_concurrency, max_concurrency)
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.max_attempts = max(1, max_attempts)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._active = 0
+        self._active_background = 0
+        # (priority, arrival, future) of requests waiting for a slot
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._counters = {
+            "requests": 0,
+            "coalesced": 0,
+            "calls": 0,
+            "hedges": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "failures": 0,
+        }
+
+    async def run(
+        self, key: str, call: Callable[[], Awaitable[str]], priority: int = INTERACTIVE
+    ) -> str:
+        """
+        Run call() under the scheduler's limits, or join an identical
+        request already in flight. call may be invoked more than once
+        (hedges and retries). Raises asyncio.TimeoutError past the deadline,
+        or the last call's exception.
+        """
+        self._counters["requests"] += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._execute(call, priority))
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self._counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "in_flight": len(self._in_flight),
+            "active_calls": self._active,
+            "active_background_calls": self._active_background,
+            "waiting": sum(1 for _, _, waiter in self._waiters if not waiter.done()),
+            "max_concurrency": self.max_concurrency,
+        }
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieve the exception even if every caller has gone away
+        if not task.cancelled() and task.exception() is not None:
+            self._counters["failures"] += 1
+
+    async def _execute(self, call: Callable[[], Awaitable[str]], priority: int) -> str:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        attempts: Set[asyncio.Task] = set()
+        error: Optional[BaseException] = None
+        try:
+            await self._acquire_before(priority, deadline)
+            attempts.add(self._launch(call, priority))
+            launched = 1
+            hedge_at = loop.time() + self.hedge_delay if self.hedge_delay > 0 else None
+
+            while attempts:
+                wait = deadline - loop.time()
+                if hedge_at is not None and launched < self.max_attempts:
+                    wait = min(wait, hedge_at - loop.time())
+                done, _ = await asyncio.wait(
+                    attempts, timeout=max(wait, 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt in done:
+                    attempts.discard(attempt)
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = attempt.exception()
+                    logger.warning("LLM call failed: %s", error)
+
+                if loop.time() >= deadline:
+                    raise asyncio.TimeoutError(f"No LLM response within {self.timeout:g}s")
+                if launched >= self.max_attempts:
+                    continue
+                if not attempts:
+                    # Every call so far failed: retry
+                    self._counters["retries"] += 1
+                    await self._acquire_before(priority, deadline)
+                elif hedge_at is not None and loop.time() >= hedge_at:
+                    # Slow answer: race a second call against it, if there's room
+                    hedge_at = None
+                    if not self._try_acquire(priority):
+                        continue
+                    self._counters["hedges"] += 1
+                else:
+                    continue
+                attempts.add(self._launch(call, priority))
+                launched += 1
+
+            raise error
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            raise
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def _launch(self, call: Callable[[], Awaitable[str]], priority: int) -> asyncio.Task:
+        """Start a provider call in a slot already acquired; the slot is freed when it ends"""
+        self._counters["calls"] += 1
+        started = time.perf_counter()
+        attempt = asyncio.ensure_future(call())
+        attempt.add_done_callback(lambda done: self._call_done(done, priority, started))
+        return attempt
+
+    def _call_done(self, attempt: asyncio.Task, priority: int, started: float) -> None:
+        if attempt.cancelled():
+            outcome = "cancelled"  # lost a hedge race, or the deadline passed
+        else:
+            outcome = "ok" if attempt.exception() is None else "error"
+        _CALL_DURATION[outcome].observe(time.perf_counter() - started)
+        self._release(priority)
+
+    def _can_start(self, priority: int) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        return priority == INTERACTIVE or self._active_background < self.background_max_concurrency
+
+    def _take(self, priority: int) -> None:
+        self._active += 1
+        if priority == BACKGROUND:
+            self._active_background += 1
+
+    def _try_acquire(self, priority: int) -> bool:
+        """Take a slot only if one is free and nobody of equal or higher priority is queued for it"""
+        self._prune()
+        if self._waiters and self._waiters[0][0] <= priority:
+            return False
+        if not self._can_start(priority):
+            return False
+        self._take(priority)
+        return True
+
+    async def _acquire_before(self, priority: int, deadline: float) -> None:
+        if self._try_acquire(priority):
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), waiter))
+        timeout = deadline - asyncio.get_running_loop().time()
+        try:
+            # The slot is taken on our behalf before the waiter is woken
+            await asyncio.wait_for(asyncio.shield(waiter), max(timeout, 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if waiter.done() and not waiter.cancelled():
+                # Woken just as we gave up: hand the slot back
+                self._release(priority)
+            else:
+                waiter.cancel()
+                self._prune()
+            raise
+
+    def _release(self, priority: int) -> None:
+        self._active -= 1
+        if priority == BACKGROUND:
+            self._active_background -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand free slots to waiters, interactive first"""
+        self._prune()
+        while self._waiters:
+            priority, _, waiter = self._waiters[0]
+            # Interactive waiters sort first, so if the head can't start, nobody can
+            if not self._can_start(priority):
+                break
+            heapq.heappop(self._waiters)
+            self._take(priority)
+            waiter.set_result(None)
+            self._prune()
+
+    def _prune(self) -> None:
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,184 @@
+"""
+Query execution against user target databases.
+
+Results are read through a server-side cursor in fixed-size batches inside
+a read-only transaction, so a large result set is never held in memory as a
+whole. The caller pulls batches at its own pace; when it streams them to an
+HTTP client, a slow client therefore slows the cursor down instead of
+buffering rows in the worker.
+
+While it runs, the query's backend pid is in the execution registry, so it
+can be cancelled from any worker. Each query first passes the cost guard (timeouts, then the planner's
+estimate against the connection's thresholds) in the same transaction.
+"""
+import asyncio
+import time
+from contextlib import AsyncExitStack, suppress
+from typing import AsyncIterator, List, Optional
+
+import asyncpg
+
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.services.connection_manager import connection_manager
+from app.services.cost_guard import CostEstimate, cost_guard
+from app.services.execution_registry import execution_registry
+from app.tracing import record, span
+
+
+class QueryExecutionError(Exception):
+    """Raised when the target database rejects or fails a query"""
+
+
+class QueryStream:
+    """
+    Batches of a query result, read through a server-side cursor.
+
+    Usage:
+        stream = QueryStream(connection, sql, query_id)  # preview_rows=n: at most n rows, via LIMIT
+        await stream.open()  # errors surface here, before any output
+        try:
+            async for rows in stream:
+                ...
+        finally:
+            await stream.close()
+    """
+
+    def __init__(
+        self,
+        connection: DatabaseConnection,
+        sql: str,
+        query_id: Optional[str] = None,  # registered for cancellation when set
+        batch_size: int = settings.EXECUTION_BATCH_SIZE,
+        preview_rows: Optional[int] = None,
+        export: bool = False,  # full download: no row threshold, export statement timeout
+    ):
+        self.connection = connection
+        self.sql = sql
+        self.query_id = query_id
+        self.preview_rows = preview_rows
+        self.export = export
+        self.batch_size = batch_size
+        self.columns: List[dict] = []
+        self.estimate: Optional[CostEstimate] = None
+        self.rows_returned = 0
+        self.started_at: Optional[float] = None
+        self._stack = AsyncExitStack()
+        self._conn = None
+        self._cursor = None
+
+    @property
+    def elapsed_ms(self) -> int:
+        if self.started_at is None:
+            return 0
+        return int((time.perf_counter() - self.started_at) * 1000)
+
+    async def open(self, cursor: bool = True) -> None:
+        """
+        Borrow a pooled connection, check the SQL with the cost guard,
+        validate it and open the cursor. Raises CostLimitExceeded when the
+        guard refuses the query. Pass cursor=False when the result will be
+        read with copy_csv().
+        """
+        self.started_at = time.perf_counter()
+        if self.preview_rows is not None:
+            self.sql = await cost_guard.preview_sql(self.sql, self.preview_rows)
+        try:
+            conn = self._conn = await self._stack.enter_async_context(
+                connection_manager.acquire(self.connection)
+            )
+            if self.query_id is not None:
+                # Unregistered before the connection goes back to the pool
+                token = await execution_registry.register(self.query_id, conn.get_server_pid())
+                self._stack.push_async_callback(execution_registry.unregister, self.query_id, token)
+            await self._stack.enter_async_context(conn.transaction(readonly=True))
+            self.estimate = await cost_guard.check(
+                conn,
+                self.connection,
+                self.sql,
+                rows_capped=self.preview_rows is not None,
+                export=self.export,
+            )
+            statement = await conn.prepare(self.sql)
+            self.columns = [
+                {"name": attribute.name, "type": attribute.type.name}
+                for attribute in statement.get_attributes()
+            ]
+            if cursor:
+                self._cursor = await statement.cursor()
+        except asyncpg.PostgresError as e:
+            await self.close()
+            raise QueryExecutionError(str(e)) from e
+        except BaseException:
+            await self.close()
+            raise
+        finally:
+            record("target", time.perf_counter() - self.started_at)
+
+    async def __aiter__(self) -> AsyncIterator[List[asyncpg.Record]]:
+        while True:
+            try:
+                with span("target"):
+                    rows = await self._cursor.fetch(self.batch_size)
+            except asyncpg.PostgresError as e:
+                raise QueryExecutionError(str(e)) from e
+            if not rows:
+                return
+            self.rows_returned += len(rows)
+            yield rows
+
+    async def copy_csv(
+        self, max_buffered_chunks: int = settings.EXPORT_MAX_BUFFERED_CHUNKS
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream the result as CSV produced by the server with COPY ... TO STDOUT.
+        At most max_buffered_chunks chunks are held in memory; the COPY is
+        throttled while the consumer catches up.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_chunks)
+
+        async def produce():
+            result = await self._conn.copy_from_query(
+                self.sql.strip().rstrip(";"),
+                output=queue.put,
+                format="csv",
+                header=True,
+            )
+            # Status is "COPY <rows>"
+            self.rows_returned = int(result.split()[-1])
+
+        # The end of the COPY is the producer finishing, not a marker in the
+        # queue: if the consumer stops early the queue stays full, and a
+        # blocking put of a marker would never return
+        task = asyncio.ensure_future(produce())
+        getter = None
+        try:
+            while True:
+                if queue.empty():
+                    if task.done():
+                        break
+                    getter = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        continue
+                    chunk = getter.result()
+                else:
+                    chunk = queue.get_nowait()
+                yield chunk
+            await task
+        except asyncpg.PostgresError as e:
+            raise QueryExecutionError(str(e)) from e
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError, Exception):
+                    await task
+
+    async def close(self) -> None:
+        """End the transaction and return the connection to its pool"""
+        self._cursor = None
+        self._conn = None
+        await self._stack.aclose()
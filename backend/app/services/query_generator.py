@@ -0,0 +1,68 @@
+"""
+SQL generation pipeline:
+schema catalog -> generated-SQL cache -> similar past questions -> LLM.
+"""
+from dataclasses import dataclass
+
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.schemas.catalog import SchemaCatalog
+from app.services.ai_service import ai_service
+from app.services.schema_catalog import schema_catalog
+from app.services.similarity import similarity_index
+from app.services.sql_analysis import sql_analyzer
+from app.services.sql_cache import sql_cache
+
+
+@dataclass(frozen=True)
+class GeneratedSQL:
+    sql: str
+    source: str  # "cache", "similar" or "llm"
+    fingerprint: str
+
+    @property
+    def from_cache(self) -> bool:
+        return self.source != "llm"
+
+
+async def references_known_tables(sql: str, catalog: SchemaCatalog) -> bool:
+    """
+    Check that every relation the SQL reads from exists in the catalog.
+    Guards against reusing SQL written before a schema change.
+    """
+    known = set()
+    for table in catalog.tables.values():
+        known.add(table.name.lower())
+        known.add(table.qualified_name.lower())
+    analysis = await sql_analyzer.analyze_async(sql)
+    return all(name in known for name in analysis.tables)
+
+
+async def generate_sql(connection: DatabaseConnection, natural_language: str) -> GeneratedSQL:
+    """
+    Generate SQL for a question, reusing cached or similar SQL where possible.
+    Raises TargetConnectionError if the schema cannot be read and
+    AIServiceError if generation fails.
+    """
+    catalog = await schema_catalog.get(connection)
+    model_version = ai_service.model_version
+
+    sql = await sql_cache.get(
+        connection.id, catalog.fingerprint, model_version, natural_language
+    )
+    if sql is not None:
+        return GeneratedSQL(sql=sql, source="cache", fingerprint=catalog.fingerprint)
+
+    if settings.SIMILARITY_ENABLED:
+        match = similarity_index.lookup(connection.id, natural_language)
+        if match is not None and await references_known_tables(match.sql, catalog):
+            await sql_cache.set(
+                connection.id, catalog.fingerprint, model_version, natural_language, match.sql
+            )
+            return GeneratedSQL(sql=match.sql, source="similar", fingerprint=catalog.fingerprint)
+
+    sql = await ai_service.generate_sql(natural_language, catalog)
+    await sql_cache.set(
+        connection.id, catalog.fingerprint, model_version, natural_language, sql
+    )
+    return GeneratedSQL(sql=sql, source="llm", fingerprint=catalog.fingerprint)
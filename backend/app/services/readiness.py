@@ -0,0 +1,171 @@
+"""
+Startup warm-up and the liveness/readiness probes.
+
+- Liveness (/livez): the worker is up and its event loop answers. It never
+  touches the database, so a database outage doesn't get healthy workers
+  restarted; it reports the outcome of the last readiness check instead.
+- Readiness (/readyz): the worker can serve requests now. It fails until
+  warm-up has finished, during shutdown, and while the metadata database
+  is unreachable (Redis too, with READINESS_REQUIRES_REDIS; otherwise Redis
+  only degrades caching and shared rate limits, so it's reported but not
+  required).
+
+Warm-up runs in the background once the application has started, so the
+worker binds its port right away. It opens STARTUP_WARM_CONNECTIONS
+metadata pool connections concurrently, which also runs SQLAlchemy's
+first-connect dialect initialization. It pings Redis at the same time, so
+the first requests don't pay for connecting. If the database can't be
+reached, warm-up retries every STARTUP_WARM_RETRY_SECONDS.
+
+Checks are shared: probes arriving within READINESS_CACHE_SECONDS of the
+last check, or while one is running, get its result.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.cache import redis_client
+from app.config import settings
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+STOPPING = "stopping"
+
+
+class Readiness:
+    """
+    Usage:
+        await readiness.start()  # after startup; warm-up runs in the background
+        ready, checks = await readiness.check()
+        await readiness.close()  # first thing on shutdown
+    """
+
+    def __init__(
+        self,
+        warm_connections: int = settings.STARTUP_WARM_CONNECTIONS,
+        retry_interval: float = settings.STARTUP_WARM_RETRY_SECONDS,
+        timeout: float = settings.READINESS_CHECK_TIMEOUT_SECONDS,
+        cache_seconds: float = settings.READINESS_CACHE_SECONDS,
+        requires_redis: bool = settings.READINESS_REQUIRES_REDIS,
+    ):
+        self.warm_connections = warm_connections
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.cache_seconds = cache_seconds
+        self.requires_redis = requires_redis
+        self.state = STARTING
+        self.warm_up_seconds: Optional[float] = None
+        self._warm_up: Optional[asyncio.Task] = None
+        self._checking: Optional[asyncio.Task] = None
+        self._last_checks: Dict[str, bool] = {}
+        self._checked_at = 0.0
+        self._counters = {"checks": 0, "failed_checks": 0, "warm_up_attempts": 0}
+
+    async def start(self) -> None:
+        """Start warming up in the background; readiness passes once it's done"""
+        if self._warm_up is None or self._warm_up.done():
+            self.state = STARTING
+            self._warm_up = asyncio.create_task(self._warm_up_until_done())
+
+    async def close(self) -> None:
+        """Fail readiness from now on, so load balancers stop sending requests"""
+        self.state = STOPPING
+        if self._warm_up is not None:
+            self._warm_up.cancel()
+            try:
+                await self._warm_up
+            except asyncio.CancelledError:
+                pass
+            self._warm_up = None
+
+    async def _warm_up_until_done(self) -> None:
+        started = time.perf_counter()
+        while True:
+            self._counters["warm_up_attempts"] += 1
+            warmed, redis = await asyncio.gather(
+                self._warm_pool(), self._reachable("Redis", redis_client.ping), return_exceptions=True
+            )
+            if not isinstance(warmed, BaseException):
+                break
+            logger.warning(
+                "Warm-up could not reach the database, retrying in %.1fs: %r",
+                self.retry_interval, warmed,
+            )
+            await asyncio.sleep(self.retry_interval)
+        self._last_checks, self._checked_at = {"database": True, "redis": redis is True}, time.monotonic()
+        self.warm_up_seconds = time.perf_counter() - started
+        self.state = READY
+        logger.info("Warm-up finished in %.2fs", self.warm_up_seconds)
+
+    async def _warm_pool(self) -> None:
+        # Connections past the pool size would be discarded on return
+        count = min(self.warm_connections, engine.pool.size())
+        if count <= 0:
+            return
+        connections = [engine.connect() for _ in range(count)]
+        try:
+            # All held at once, so each is a separate pooled connection
+            await asyncio.wait_for(
+                asyncio.gather(*(connection.start() for connection in connections)),
+                self.timeout * count,
+            )
+        finally:
+            await asyncio.gather(
+                *(connection.close() for connection in connections), return_exceptions=True
+            )
+
+    @staticmethod
+    async def _ping_database() -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def _reachable(self, name: str, ping: Callable[[], Awaitable]) -> bool:
+        try:
+            await asyncio.wait_for(ping(), self.timeout)
+            return True
+        except Exception as e:  # whatever the failure, it can't be used
+            logger.warning("Readiness check could not reach %s: %r", name, e)
+            return False
+
+    async def _run_checks(self) -> None:
+        database, redis = await asyncio.gather(
+            self._reachable("the database", self._ping_database),
+            self._reachable("Redis", redis_client.ping),
+        )
+        self._last_checks, self._checked_at = {"database": database, "redis": redis}, time.monotonic()
+        self._counters["checks"] += 1
+        if not self._passes(self._last_checks):
+            self._counters["failed_checks"] += 1
+
+    async def check(self) -> Tuple[bool, Dict[str, bool]]:
+        """(ready, {"database": reachable, "redis": reachable})"""
+        if self.state == READY and time.monotonic() - self._checked_at > self.cache_seconds:
+            if self._checking is None or self._checking.done():
+                self._checking = asyncio.create_task(self._run_checks())
+            # Shielded: a probe that gives up doesn't cancel the check others wait on
+            await asyncio.shield(self._checking)
+        checks = dict(self._last_checks)
+        return self.state == READY and self._passes(checks), checks
+
+    def _passes(self, checks: Dict[str, bool]) -> bool:
+        return checks.get("database", False) and (checks.get("redis", False) or not self.requires_redis)
+
+    def last_checks(self) -> Dict[str, bool]:
+        """Outcome of the last readiness check, without checking again"""
+        return dict(self._last_checks)
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "ready": self.state == READY,
+            "warm_up_seconds": self.warm_up_seconds,
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,199 @@
+"""
+Result-set cache for query execution.
+
+Dashboards re-run the same saved SQL against the same connection many times
+a minute. Buffered results are cached in Redis, keyed by:
+
+- the connection,
+- a per-connection generation number, bumped whenever the connection is
+  updated or deleted, so results computed before the change are never
+  served (even when a write from an execution that was already in flight
+  lands after the invalidation),
+- the normalized SQL and its parameters.
+
+TTL comes from the connection's result_cache_ttl (0 disables caching), or
+RESULT_CACHE_DEFAULT_TTL_SECONDS. Payloads above RESULT_CACHE_MAX_BYTES are
+not cached, and those above RESULT_CACHE_COMPRESS_MIN_BYTES are stored
+zlib-compressed.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.utils.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Quoted literals/identifiers and -- comments (with the newline ending them)
+# are kept verbatim; whitespace elsewhere is folded
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*\n?)|(\s+)""")
+
+_RAW = b"j"
+_COMPRESSED = b"z"
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form of a statement: whitespace outside literals and comments folded, trailing ';' dropped"""
+    def fold(match: re.Match) -> str:
+        return match.group(1) or " "
+
+    return _SQL_TOKENS.sub(fold, sql).strip().rstrip(";").rstrip()
+
+
+@dataclass
+class CachedResult:
+    """A cached execution result, in columnar form"""
+    columns: List[dict]
+    data: List[list]  # one value list per column
+    status: str
+    error_message: Optional[str]
+    execution_time_ms: int
+    rows_returned: int
+    cached_at: float  # epoch seconds
+
+    @property
+    def cached_at_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.cached_at, tz=timezone.utc)
+
+    @property
+    def age_seconds(self) -> float:
+        return round(max(time.time() - self.cached_at, 0.0), 3)
+
+    def rows(self) -> List[dict]:
+        names = [column["name"] for column in self.columns]
+        return [dict(zip(names, values)) for values in zip(*self.data)]
+
+
+class ResultCache:
+    """
+    Redis cache for buffered query results.
+
+    Usage:
+        key = await result_cache.key(connection.id, sql)
+        cached = await result_cache.get(key)
+        ...
+        await result_cache.set(key, result, ttl=result_cache.ttl_for(connection))
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = settings.RESULT_CACHE_MAX_BYTES,
+        compress_min_bytes: int = settings.RESULT_CACHE_COMPRESS_MIN_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "too_large": 0,
+            "evictions": 0,
+            "bytes_stored": 0,
+        }
+
+    @staticmethod
+    def ttl_for(connection: DatabaseConnection) -> int:
+        """Seconds to keep results for this connection; 0 means don't cache"""
+        if connection.result_cache_ttl is not None:
+            return max(connection.result_cache_ttl, 0)
+        return settings.RESULT_CACHE_DEFAULT_TTL_SECONDS
+
+    async def key(
+        self, connection_id: str, sql: str, params: Sequence = ()
+    ) -> Optional[str]:
+        """
+        Cache key for a statement under the connection's current generation.
+        None when Redis is unavailable, in which case the result isn't cached.
+        """
+        try:
+            generation = await redis_client.get(self._generation_key(connection_id))
+        except REDIS_ERRORS as e:
+            logger.warning("Result cache read failed: %s", e)
+            return None
+        generation = generation.decode() if generation else "0"
+        digest = hashlib.sha256(
+            dumps([normalize_sql(sql), list(params)]).encode()
+        ).hexdigest()[:32]
+        return redis_key("result", connection_id, generation, digest)
+
+    async def get(self, key: Optional[str]) -> Optional[CachedResult]:
+        if key is None:
+            return None
+        try:
+            raw = await redis_client.get(key)
+        except REDIS_ERRORS as e:
+            logger.warning("Result cache read failed: %s", e)
+            raw = None
+        if raw is None:
+            self._counters["misses"] += 1
+            return None
+
+        body = raw[1:]
+        if raw[:1] == _COMPRESSED:
+            body = zlib.decompress(body)
+        self._counters["hits"] += 1
+        return CachedResult(**json.loads(body))
+
+    async def set(self, key: Optional[str], result: CachedResult, ttl: int) -> None:
+        if key is None or ttl <= 0:
+            return
+        body = dumps(result.__dict__).encode()
+        if len(body) > self.max_bytes:
+            self._counters["too_large"] += 1
+            return
+        if len(body) >= self.compress_min_bytes:
+            # Level 1: most of the size win for a fraction of the CPU
+            raw = _COMPRESSED + zlib.compress(body, 1)
+        else:
+            raw = _RAW + body
+        try:
+            await redis_client.set(key, raw, ex=ttl)
+        except REDIS_ERRORS as e:
+            logger.warning("Result cache write failed: %s", e)
+            return
+        self._counters["sets"] += 1
+        self._counters["bytes_stored"] += len(raw)
+
+    async def evict_connection(self, connection_id: str) -> None:
+        """
+        Drop cached results for a connection.
+        Called when the connection is updated or deleted.
+        """
+        prefix = redis_key("result", connection_id) + ":"
+        generation_key = self._generation_key(connection_id)
+        try:
+            # Bump first, so in-flight executions write into a dead generation
+            await redis_client.incr(generation_key)
+            stale = [
+                key
+                async for key in redis_client.scan_iter(match=f"{prefix}*", count=500)
+                if key.decode() != generation_key
+            ]
+            if stale:
+                await redis_client.unlink(*stale)
+                self._counters["evictions"] += len(stale)
+        except REDIS_ERRORS as e:
+            logger.warning("Result cache eviction failed for %s: %s", connection_id, e)
+
+    def stats(self) -> dict:
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _generation_key(connection_id: str) -> str:
+        return redis_key("result", connection_id, "generation")
+
+
+result_cache = ResultCache()
@@ -0,0 +1,178 @@
+"""
+Wire formats for query results.
+
+Buffered formats (POST /queries/{id}/execute, chosen by the Accept header):
+- application/json: QueryExecuteResponse with one dict per row (default).
+- application/vnd.queryforge.columnar+json: column names and types once,
+  then one value array per column.
+- application/vnd.apache.arrow.stream: Arrow IPC stream with typed columns,
+  one record batch per cursor batch (streamed, not buffered).
+
+Streaming formats:
+- NDJSON (application/x-ndjson): a {"columns": [...]} header line, one JSON
+  array per row, then a {"rows_returned": ..., "execution_time_ms": ...}
+  trailer, or {"error": ...} if execution fails midway.
+- Server-Sent Events (text/event-stream): "columns", "rows" (one event per
+  batch), "end" and "error" events with JSON data.
+"""
+from typing import List, Optional, Sequence
+
+import pyarrow as pa
+
+from app.utils.serialization import dumps
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.queryforge.columnar+json"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# PostgreSQL type name -> Arrow type. Anything else is sent as text.
+ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "oid": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "bpchar": pa.string(),
+    "name": pa.string(),
+    "char": pa.string(),
+    "date": pa.date32(),
+    "time": pa.time64("us"),
+    "timestamp": pa.timestamp("us"),
+    "timestamptz": pa.timestamp("us", tz="UTC"),
+    "interval": pa.duration("us"),
+    "bytea": pa.binary(),
+}
+# Types asyncpg returns as str already (or that must stay exact, like numeric)
+_NATIVE_STRING_TYPES = {"text", "varchar", "bpchar", "name", "char", "json", "jsonb"}
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """Pick a buffered result media type from an Accept header"""
+    accept = (accept or "").lower()
+    if ARROW_STREAM_MEDIA_TYPE in accept:
+        return ARROW_STREAM_MEDIA_TYPE
+    if COLUMNAR_JSON_MEDIA_TYPE in accept:
+        return COLUMNAR_JSON_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def columnar_append(data: List[list], rows: Sequence) -> None:
+    """Append a batch of rows to per-column value lists, without per-row dicts"""
+    for values, column in zip(data, zip(*rows)):
+        values.extend(column)
+
+
+class _ChunkSink:
+    """File-like sink that hands back whatever the Arrow writer wrote so far"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ArrowStreamEncoder:
+    """
+    Incrementally encodes cursor batches as an Arrow IPC stream.
+
+    Usage:
+        encoder = ArrowStreamEncoder(stream.columns)
+        yield encoder.header()
+        async for rows in stream:
+            yield encoder.encode(rows)
+        yield encoder.finish()
+    """
+
+    def __init__(self, columns: List[dict]):
+        self.types = [ARROW_TYPES.get(c["type"], pa.string()) for c in columns]
+        self.type_names = [c["type"] for c in columns]
+        self.schema = pa.schema(
+            [
+                pa.field(c["name"], t, metadata={"pg_type": c["type"]})
+                for c, t in zip(columns, self.types)
+            ]
+        )
+        self._sink = _ChunkSink()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: Sequence) -> bytes:
+        arrays = [
+            self._array(values, arrow_type, type_name)
+            for values, arrow_type, type_name in zip(zip(*rows), self.types, self.type_names)
+        ]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+    @staticmethod
+    def _array(values, arrow_type, type_name: str) -> pa.Array:
+        if arrow_type == pa.string() and type_name not in _NATIVE_STRING_TYPES:
+            values = [None if v is None else str(v) for v in values]
+        return pa.array(values, type=arrow_type)
+
+
+def ndjson_header(columns: List[dict]) -> bytes:
+    return (dumps({"columns": columns}) + "\n").encode()
+
+
+def ndjson_rows(rows: Sequence) -> bytes:
+    return "".join([dumps(list(row)) + "\n" for row in rows]).encode()
+
+
+def ndjson_trailer(rows_returned: int, execution_time_ms: int) -> bytes:
+    return (
+        dumps({"rows_returned": rows_returned, "execution_time_ms": execution_time_ms})
+        + "\n"
+    ).encode()
+
+
+def ndjson_error(message: str) -> bytes:
+    return (dumps({"error": message}) + "\n").encode()
+
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {dumps(data)}\n\n".encode()
+
+
+def sse_header(columns: List[dict]) -> bytes:
+    return sse_event("columns", columns)
+
+
+def sse_rows(rows: Sequence) -> bytes:
+    return sse_event("rows", [list(row) for row in rows])
+
+
+def sse_trailer(rows_returned: int, execution_time_ms: int) -> bytes:
+    return sse_event(
+        "end", {"rows_returned": rows_returned, "execution_time_ms": execution_time_ms}
+    )
+
+
+def sse_error(message: str) -> bytes:
+    return sse_event("error", {"error": message})
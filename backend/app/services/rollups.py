@@ -0,0 +1,207 @@
+"""
+Incrementally maintained usage rollups.
+
+Every write to a Query row changes its contribution to one
+(user, connection, day) rollup row: counts per status, execution stats and
+a latency histogram. The write-behind flusher computes the difference
+between a row's old and new contribution and applies it with one additive
+upsert in the same transaction, so the rollups always equal what a GROUP BY
+over the queries table would return, without ever running that GROUP BY.
+
+rebuild_rollups() recomputes them from history (the backfill command).
+"""
+from bisect import bisect_left
+from datetime import date, datetime, timezone
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, func, literal, literal_column, select, text
+from sqlalchemy.dialects.postgresql import array, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.query import Query, QueryStatus
+from app.models.rollup import QueryDailyRollup
+
+# Upper bounds (ms) of the latency histogram buckets; one more bucket
+# counts everything slower than the last bound
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+HISTOGRAM_SIZE = len(LATENCY_BUCKETS_MS) + 1
+
+STATUS_COLUMNS = {
+    QueryStatus.SUCCESS: "success_count",
+    QueryStatus.FAILED: "failed_count",
+    QueryStatus.WARNING: "warning_count",
+}
+COUNTER_COLUMNS = (
+    "total_count",
+    *STATUS_COLUMNS.values(),
+    "executed_count",
+    "response_time_sum",
+    "rows_returned_sum",
+)
+NO_CONNECTION = ""
+
+RollupKey = Tuple[str, str, date]
+
+
+def latency_bucket(response_time_ms: int) -> int:
+    return bisect_left(LATENCY_BUCKETS_MS, response_time_ms)
+
+
+def _status(value) -> QueryStatus:
+    if isinstance(value, QueryStatus):
+        return value
+    try:
+        return QueryStatus(value)
+    except ValueError:
+        return QueryStatus[value]
+
+
+def _day(created_at: datetime) -> date:
+    return created_at.astimezone(timezone.utc).date()
+
+
+class RollupDeltas:
+    """
+    Accumulates rollup changes for a batch of Query writes.
+
+    Usage:
+        deltas = RollupDeltas()
+        deltas.add(old_row, sign=-1)
+        deltas.add(new_row)
+        await apply_rollup_deltas(session, deltas)
+    """
+
+    def __init__(self):
+        self._rows: Dict[RollupKey, dict] = {}
+
+    def add(self, row: Mapping, sign: int = 1) -> None:
+        """Add (or with sign=-1, remove) one Query row's contribution"""
+        key = (row["user_id"], row.get("connection_id") or NO_CONNECTION, _day(row["created_at"]))
+        delta = self._rows.get(key)
+        if delta is None:
+            delta = self._rows[key] = {column: 0 for column in COUNTER_COLUMNS}
+            delta["latency_histogram"] = [0] * HISTOGRAM_SIZE
+
+        delta["total_count"] += sign
+        delta[STATUS_COLUMNS[_status(row.get("status") or QueryStatus.SUCCESS)]] += sign
+        delta["rows_returned_sum"] += sign * (row.get("rows_returned") or 0)
+        response_time = row.get("response_time")
+        if response_time is not None:
+            delta["executed_count"] += sign
+            delta["response_time_sum"] += sign * response_time
+            delta["latency_histogram"][latency_bucket(response_time)] += sign
+
+    def rows(self) -> List[dict]:
+        """Non-empty deltas as rollup rows"""
+        return [
+            {"user_id": user_id, "connection_id": connection_id, "day": day, **delta}
+            for (user_id, connection_id, day), delta in self._rows.items()
+            if any(delta[column] for column in COUNTER_COLUMNS) or any(delta["latency_histogram"])
+        ]
+
+
+async def apply_rollup_deltas(session: AsyncSession, deltas: RollupDeltas) -> None:
+    """Add deltas to the rollups with one multi-row upsert"""
+    rows = deltas.rows()
+    if not rows:
+        return
+    table = QueryDailyRollup.__table__
+    statement = insert(table).values(rows)
+    set_ = {column: table.c[column] + statement.excluded[column] for column in COUNTER_COLUMNS}
+    set_["latency_histogram"] = literal_column(
+        "ARRAY(SELECT a + b FROM unnest("
+        "query_daily_rollups.latency_histogram, excluded.latency_histogram) AS t(a, b))"
+    )
+    set_["updated_at"] = func.now()
+    await session.execute(
+        statement.on_conflict_do_update(index_elements=["user_id", "connection_id", "day"], set_=set_)
+    )
+
+
+def merge_histograms(histograms: Sequence[Sequence[int]]) -> List[int]:
+    merged = [0] * HISTOGRAM_SIZE
+    for histogram in histograms:
+        for i, count in enumerate(histogram):
+            merged[i] += count
+    return merged
+
+
+def histogram_percentile(histogram: Sequence[int], percentile: float) -> Optional[int]:
+    """
+    Upper bound (ms) of the bucket holding the given percentile, or None
+    without data. Slower than the last bound reports the last bound.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    target = total * percentile / 100
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[min(i, len(LATENCY_BUCKETS_MS) - 1)]
+    return LATENCY_BUCKETS_MS[-1]
+
+
+async def rebuild_rollups(session: AsyncSession, user_id: Optional[str] = None) -> int:
+    """
+    Recompute rollups from the queries table, for one user or everyone.
+    Blocks Query writes until the caller commits, so nothing is counted
+    twice or missed. Returns the number of rollup rows written.
+    """
+    await session.execute(text("LOCK TABLE queries IN SHARE MODE"))
+
+    cleanup = delete(QueryDailyRollup)
+    if user_id:
+        cleanup = cleanup.where(QueryDailyRollup.user_id == user_id)
+    await session.execute(cleanup)
+
+    day = func.date(func.timezone("UTC", Query.created_at))
+    connection_id = func.coalesce(Query.connection_id, literal(NO_CONNECTION))
+    bucket_filters = [Query.response_time <= LATENCY_BUCKETS_MS[0]]
+    bucket_filters += [
+        and_(Query.response_time > low, Query.response_time <= high)
+        for low, high in zip(LATENCY_BUCKETS_MS, LATENCY_BUCKETS_MS[1:])
+    ]
+    bucket_filters.append(Query.response_time > LATENCY_BUCKETS_MS[-1])
+
+    aggregate = select(
+        Query.user_id,
+        connection_id,
+        day,
+        func.count(),
+        *[func.count().filter(Query.status == status) for status in STATUS_COLUMNS],
+        func.count(Query.response_time),
+        func.coalesce(func.sum(Query.response_time), 0),
+        func.coalesce(func.sum(Query.rows_returned), 0),
+        array([func.count().filter(condition) for condition in bucket_filters]),
+    ).group_by(Query.user_id, connection_id, day)
+    if user_id:
+        aggregate = aggregate.where(Query.user_id == user_id)
+
+    result = await session.execute(
+        insert(QueryDailyRollup).from_select(
+            ["user_id", "connection_id", "day", *COUNTER_COLUMNS, "latency_histogram"],
+            aggregate,
+        )
+    )
+    return result.rowcount
+
+
+def usage_stats(rollups: Sequence[QueryDailyRollup]) -> dict:
+    """Combine rollup rows into UsageStats fields"""
+    totals = {column: sum(getattr(r, column) for r in rollups) for column in COUNTER_COLUMNS}
+    histogram = merge_histograms([r.latency_histogram for r in rollups])
+    total, executed = totals["total_count"], totals["executed_count"]
+    return {
+        "total_queries": total,
+        "success_count": totals["success_count"],
+        "failed_count": totals["failed_count"],
+        "warning_count": totals["warning_count"],
+        "success_rate": round(totals["success_count"] / total, 4) if total else None,
+        "executed_count": executed,
+        "avg_response_time_ms": round(totals["response_time_sum"] / executed, 2) if executed else None,
+        "p50_response_time_ms": histogram_percentile(histogram, 50),
+        "p95_response_time_ms": histogram_percentile(histogram, 95),
+        "rows_returned": totals["rows_returned_sum"],
+    }
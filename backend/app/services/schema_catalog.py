@@ -0,0 +1,345 @@
+"""
+Schema catalog for user target databases.
+
+NL-to-SQL generation needs the tables, columns, types and foreign keys of
+the target database on every request. Introspecting them each time is slow
+on large schemas, so catalogs are cached per DatabaseConnection.id in
+process and in Redis, and revalidated cheaply:
+
+- Every relation gets a version string built from the xmin (last modifying
+  transaction) of its pg_class, pg_attribute, pg_constraint and
+  pg_description rows. Reading these is a single catalog-only query.
+- Only relations whose version changed (or that appeared) are
+  re-introspected; dropped relations are removed from the cached catalog.
+- The catalog fingerprint is a hash of the introspected table definitions,
+  so it only changes when a definition really changes. Downstream caches
+  key on it.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.models.connection import DatabaseConnection
+from app.schemas.catalog import (
+    ColumnSchema,
+    ForeignKeySchema,
+    SchemaCatalog,
+    TableSchema,
+)
+from app.services.connection_manager import connection_manager
+
+logger = logging.getLogger(__name__)
+
+RELATION_KINDS = {
+    "r": "table",
+    "p": "table",
+    "v": "view",
+    "m": "materialized_view",
+    "f": "foreign_table",
+}
+
+VERSIONS_SQL = """
+SELECT c.oid::int8 AS oid,
+       md5(
+           c.xmin::text
+           || '|' || coalesce((
+               SELECT string_agg(a.xmin::text, ',' ORDER BY a.attnum)
+               FROM pg_attribute a
+               WHERE a.attrelid = c.oid AND a.attnum > 0
+           ), '')
+           || '|' || coalesce((
+               SELECT string_agg(k.xmin::text, ',' ORDER BY k.oid)
+               FROM pg_constraint k
+               WHERE k.conrelid = c.oid
+           ), '')
+           || '|' || coalesce((
+               SELECT string_agg(d.xmin::text, ',' ORDER BY d.objsubid)
+               FROM pg_description d
+               WHERE d.objoid = c.oid AND d.classoid = 'pg_class'::regclass
+           ), '')
+       ) AS version
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+  AND NOT c.relispartition
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg_toast%'
+  AND n.nspname NOT LIKE 'pg_temp%'
+"""
+
+RELATIONS_SQL = """
+SELECT c.oid::int8 AS oid, n.nspname AS schema_name, c.relname AS name,
+       c.relkind::text AS relkind, obj_description(c.oid, 'pg_class') AS comment
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.oid = ANY($1::oid[])
+"""
+
+COLUMNS_SQL = """
+SELECT a.attrelid::int8 AS oid, a.attname AS name,
+       format_type(a.atttypid, a.atttypmod) AS data_type,
+       NOT a.attnotnull AS nullable,
+       pg_get_expr(d.adbin, d.adrelid) AS default,
+       col_description(a.attrelid, a.attnum) AS comment
+FROM pg_attribute a
+LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE a.attrelid = ANY($1::oid[]) AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY a.attrelid, a.attnum
+"""
+
+CONSTRAINTS_SQL = """
+SELECT k.conrelid::int8 AS oid, k.contype::text AS contype,
+       ARRAY(
+           SELECT a.attname FROM unnest(k.conkey) WITH ORDINALITY u(attnum, ord)
+           JOIN pg_attribute a ON a.attrelid = k.conrelid AND a.attnum = u.attnum
+           ORDER BY u.ord
+       ) AS columns,
+       rn.nspname AS referenced_schema, rc.relname AS referenced_name,
+       ARRAY(
+           SELECT a.attname FROM unnest(k.confkey) WITH ORDINALITY u(attnum, ord)
+           JOIN pg_attribute a ON a.attrelid = k.confrelid AND a.attnum = u.attnum
+           ORDER BY u.ord
+       ) AS referenced_columns
+FROM pg_constraint k
+LEFT JOIN pg_class rc ON rc.oid = k.confrelid
+LEFT JOIN pg_namespace rn ON rn.oid = rc.relnamespace
+WHERE k.conrelid = ANY($1::oid[]) AND k.contype IN ('p', 'f')
+ORDER BY k.conrelid, k.conname
+"""
+
+
+class _CatalogEntry:
+    __slots__ = ("catalog", "checked_at")
+
+    def __init__(self, catalog: SchemaCatalog):
+        self.catalog = catalog
+        self.checked_at = time.monotonic()
+
+
+class SchemaCatalogService:
+    """
+    Per-connection cache of target database schemas.
+
+    Usage:
+        catalog = await schema_catalog.get(connection)
+        catalog.fingerprint, catalog.tables["public.orders"].columns
+    """
+
+    def __init__(
+        self,
+        revalidate_after: float = settings.SCHEMA_CACHE_REVALIDATE_SECONDS,
+        redis_ttl: int = settings.SCHEMA_CACHE_TTL_SECONDS,
+    ):
+        self.revalidate_after = revalidate_after
+        self.redis_ttl = redis_ttl
+        self._entries: Dict[str, _CatalogEntry] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._counters = {
+            "hits": 0,
+            "redis_loads": 0,
+            "revalidations": 0,
+            "unchanged": 0,
+            "refreshes": 0,
+            "tables_introspected": 0,
+        }
+
+    async def get(
+        self, connection: DatabaseConnection, force: bool = False
+    ) -> SchemaCatalog:
+        """Return the schema catalog for a connection, revalidating if stale"""
+        entry = self._entries.get(connection.id)
+        if entry is not None and not force and self._is_fresh(entry):
+            self._counters["hits"] += 1
+            return entry.catalog
+
+        lock = self._locks.setdefault(connection.id, asyncio.Lock())
+        async with lock:
+            # Another request may have revalidated while we waited
+            entry = self._entries.get(connection.id)
+            if entry is not None and not force and self._is_fresh(entry):
+                self._counters["hits"] += 1
+                return entry.catalog
+
+            cached = entry.catalog if entry is not None else None
+            if cached is None:
+                cached = await self._load_from_redis(connection.id)
+            catalog = await self._revalidate(connection, cached)
+            self._entries[connection.id] = _CatalogEntry(catalog)
+            return catalog
+
+    async def get_fingerprint(self, connection: DatabaseConnection) -> str:
+        """Shortcut for caches that key on the schema fingerprint"""
+        return (await self.get(connection)).fingerprint
+
+    async def invalidate(self, connection_id: str) -> None:
+        """
+        Forget the cached catalog for a connection.
+        Called when a connection is updated or deleted.
+        """
+        self._entries.pop(connection_id, None)
+        self._locks.pop(connection_id, None)
+        try:
+            await redis_client.delete(redis_key("schema", connection_id))
+        except REDIS_ERRORS as e:
+            logger.warning("Could not delete cached schema for %s: %s", connection_id, e)
+
+    def stats(self) -> dict:
+        return {"cached_connections": len(self._entries), **self._counters}
+
+    def _is_fresh(self, entry: _CatalogEntry) -> bool:
+        return time.monotonic() - entry.checked_at < self.revalidate_after
+
+    async def _revalidate(
+        self, connection: DatabaseConnection, cached: Optional[SchemaCatalog]
+    ) -> SchemaCatalog:
+        self._counters["revalidations"] += 1
+        async with connection_manager.acquire(connection) as conn:
+            rows = await conn.fetch(VERSIONS_SQL)
+            versions = {row["oid"]: row["version"] for row in rows}
+
+            if cached is not None and cached.table_versions == versions:
+                self._counters["unchanged"] += 1
+                return cached
+
+            previous = cached.tables if cached is not None else {}
+            previous_versions = cached.table_versions if cached is not None else {}
+            changed = {
+                oid
+                for oid, version in versions.items()
+                if previous_versions.get(oid) != version
+            }
+            introspected = await self._introspect(conn, changed)
+
+            # Foreign keys store referenced tables by name, so tables pointing
+            # at a renamed or dropped table are stale even if unchanged
+            kept = {
+                table.qualified_name
+                for table in previous.values()
+                if table.oid in versions and table.oid not in changed
+            }
+            current_names = kept | {table.qualified_name for table in introspected}
+            gone = {
+                table.qualified_name
+                for table in previous.values()
+                if table.qualified_name not in current_names
+            }
+            dependents = {
+                table.oid
+                for table in previous.values()
+                if table.qualified_name in kept
+                and any(fk.referenced_table in gone for fk in table.foreign_keys)
+            }
+            if dependents:
+                introspected += await self._introspect(conn, dependents)
+                changed |= dependents
+
+        tables = {
+            name: table
+            for name, table in previous.items()
+            if table.oid in versions and table.oid not in changed
+        }
+        for table in introspected:
+            tables[table.qualified_name] = table
+        # Keep versions only for tables we actually introspected, so a table
+        # that vanished mid-refresh is picked up again next time
+        introspected_oids = {table.oid for table in tables.values()}
+        versions = {oid: v for oid, v in versions.items() if oid in introspected_oids}
+
+        catalog = SchemaCatalog(
+            connection_id=connection.id,
+            fingerprint=self._fingerprint(tables.values()),
+            tables=dict(sorted(tables.items())),
+            table_versions=versions,
+            introspected_at=datetime.now(timezone.utc),
+        )
+        self._counters["refreshes"] += 1
+        self._counters["tables_introspected"] += len(introspected)
+        await self._save_to_redis(catalog)
+        return catalog
+
+    async def _introspect(self, conn, oids: Set[int]) -> List[TableSchema]:
+        if not oids:
+            return []
+        oid_list = list(oids)
+        relations = await conn.fetch(RELATIONS_SQL, oid_list)
+        columns = await conn.fetch(COLUMNS_SQL, oid_list)
+        constraints = await conn.fetch(CONSTRAINTS_SQL, oid_list)
+
+        tables = {
+            row["oid"]: TableSchema(
+                oid=row["oid"],
+                schema_name=row["schema_name"],
+                name=row["name"],
+                kind=RELATION_KINDS.get(row["relkind"], "table"),
+                comment=row["comment"],
+            )
+            for row in relations
+        }
+        primary_keys: Dict[int, Set[str]] = {}
+        for row in constraints:
+            table = tables.get(row["oid"])
+            if table is None:
+                continue
+            if row["contype"] == "p":
+                primary_keys[row["oid"]] = set(row["columns"])
+            else:
+                table.foreign_keys.append(
+                    ForeignKeySchema(
+                        columns=list(row["columns"]),
+                        referenced_table=f"{row['referenced_schema']}.{row['referenced_name']}",
+                        referenced_columns=list(row["referenced_columns"]),
+                    )
+                )
+        for row in columns:
+            table = tables.get(row["oid"])
+            if table is None:
+                continue
+            table.columns.append(
+                ColumnSchema(
+                    name=row["name"],
+                    data_type=row["data_type"],
+                    nullable=row["nullable"],
+                    default=row["default"],
+                    comment=row["comment"],
+                    is_primary_key=row["name"] in primary_keys.get(row["oid"], ()),
+                )
+            )
+        return list(tables.values())
+
+    @staticmethod
+    def _fingerprint(tables: Iterable[TableSchema]) -> str:
+        digest = hashlib.sha256()
+        for table in sorted(tables, key=lambda t: t.qualified_name):
+            digest.update(table.model_dump_json(exclude={"oid"}).encode())
+        return digest.hexdigest()[:32]
+
+    async def _load_from_redis(self, connection_id: str) -> Optional[SchemaCatalog]:
+        try:
+            raw = await redis_client.get(redis_key("schema", connection_id))
+        except REDIS_ERRORS as e:
+            logger.warning("Could not load cached schema for %s: %s", connection_id, e)
+            return None
+        if raw is None:
+            return None
+        self._counters["redis_loads"] += 1
+        return SchemaCatalog.model_validate_json(raw)
+
+    async def _save_to_redis(self, catalog: SchemaCatalog) -> None:
+        try:
+            await redis_client.set(
+                redis_key("schema", catalog.connection_id),
+                catalog.model_dump_json(),
+                ex=self.redis_ttl,
+            )
+        except REDIS_ERRORS as e:
+            logger.warning(
+                "Could not cache schema for %s: %s", catalog.connection_id, e
+            )
+
+
+schema_catalog = SchemaCatalogService()
@@ -0,0 +1,195 @@
+"""
+Relevance-based schema pruning for generation prompts.
+
+Sending every table of a large warehouse in each prompt is slow and
+expensive, so only the tables relevant to the question go in:
+
+- Per connection, an inverted index maps tokens of table names, column
+  names and comments to tables, weighted by where the token appears and
+  by how rare it is (IDF). It is rebuilt only when the schema fingerprint
+  changes.
+- A question's tokens score tables through the index; the top
+  SCHEMA_RETRIEVAL_TOP_K are taken in score order, then tables joined to
+  them by foreign keys (either direction), until the prompt's schema
+  section reaches SCHEMA_PROMPT_TOKEN_BUDGET.
+- Schemas that fit the budget whole are sent whole.
+"""
+import heapq
+import logging
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.schemas.catalog import SchemaCatalog, TableSchema
+from app.services.similarity import tokenize
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Where a token appears, and how much that says about the table
+NAME_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.5
+COMMENT_WEIGHT = 1.0
+# Roughly how many characters make an LLM token
+CHARS_PER_TOKEN = 4
+# Tokens shared by very many tables carry little signal; only their
+# strongest postings are kept, which bounds the work per lookup
+MAX_POSTINGS = 256
+# Selections remembered per index, by question tokens
+SELECTION_CACHE_SIZE = 1024
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_SEPARATORS = re.compile(r"[^A-Za-z0-9]+")
+
+
+def identifier_tokens(name: str) -> frozenset:
+    """Tokens of an identifier: order_items, orderItems -> {order, item}"""
+    return tokenize(_SEPARATORS.sub(" ", _CAMEL_BOUNDARY.sub(" ", name)))
+
+
+def estimate_tokens(table: TableSchema) -> int:
+    """Approximate prompt tokens of a table's line in the rendered schema"""
+    chars = len(table.qualified_name) + len(table.comment or "") + 8
+    for column in table.columns:
+        chars += len(column.name) + len(column.data_type) + len(column.comment or "") + 8
+    chars += sum(len(fk.referenced_table) + 16 for fk in table.foreign_keys)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+class SchemaIndex:
+    """Inverted index over one schema catalog"""
+
+    def __init__(self, catalog: SchemaCatalog):
+        self.fingerprint = catalog.fingerprint
+        self.tables: List[TableSchema] = list(catalog.tables.values())
+        positions = {table.qualified_name: i for i, table in enumerate(self.tables)}
+        self.costs = [estimate_tokens(table) for table in self.tables]
+        self.total_cost = sum(self.costs)
+
+        weights: Dict[str, Dict[int, float]] = {}
+        self.neighbours: List[set] = [set() for _ in self.tables]
+        for i, table in enumerate(self.tables):
+            fields = [(identifier_tokens(table.name), NAME_WEIGHT)]
+            fields += [(identifier_tokens(column.name), COLUMN_WEIGHT) for column in table.columns]
+            comments = [table.comment] + [column.comment for column in table.columns]
+            fields += [(tokenize(comment), COMMENT_WEIGHT) for comment in comments if comment]
+            for tokens, weight in fields:
+                for token in tokens:
+                    postings = weights.setdefault(token, {})
+                    # A token counts once per table, at its strongest position
+                    postings[i] = max(postings.get(i, 0.0), weight)
+            for fk in table.foreign_keys:
+                j = positions.get(fk.referenced_table)
+                if j is not None and j != i:
+                    self.neighbours[i].add(j)
+                    self.neighbours[j].add(i)
+
+        count = len(self.tables)
+        self.postings: Dict[str, Tuple[Tuple[int, float], ...]] = {}
+        for token, postings in weights.items():
+            idf = math.log(1 + count / len(postings))
+            strongest = heapq.nlargest(
+                MAX_POSTINGS, postings.items(), key=lambda p: (p[1], -self.costs[p[0]])
+            )
+            self.postings[token] = tuple((i, weight * idf) for i, weight in strongest)
+        self._selections = LRUCache(maxsize=SELECTION_CACHE_SIZE)
+
+    def score(self, tokens: frozenset) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for token in tokens:
+            for i, weight in self.postings.get(token, ()):
+                scores[i] = scores.get(i, 0.0) + weight
+        return scores
+
+    def select(self, question: str, top_k: int, budget: int) -> List[TableSchema]:
+        """Relevant tables for a question, within a prompt token budget"""
+        if self.total_cost <= budget:
+            return self.tables
+
+        tokens = tokenize(question)
+        key = (tokens, top_k, budget)
+        selection = self._selections.get(key)
+        if selection is None:
+            selection = self._select(tokens, top_k, budget)
+            self._selections.set(key, selection)
+        return selection
+
+    def _select(self, tokens: frozenset, top_k: int, budget: int) -> List[TableSchema]:
+        scores = self.score(tokens)
+        if scores:
+            seeds = heapq.nlargest(top_k, scores, key=scores.get)
+        else:
+            # Nothing matched: the best-connected tables are the likeliest to help
+            seeds = heapq.nlargest(top_k, range(len(self.tables)), key=lambda i: len(self.neighbours[i]))
+
+        selected: Dict[int, None] = {}
+        spent = 0
+        for i in seeds:
+            if spent + self.costs[i] <= budget:
+                selected[i] = None
+                spent += self.costs[i]
+
+        # Then the tables they join to, most relevant first
+        frontier = sorted(
+            {j for i in selected for j in self.neighbours[i]} - selected.keys(),
+            key=lambda j: (-scores.get(j, 0.0), self.costs[j]),
+        )
+        for j in frontier:
+            if spent + self.costs[j] <= budget:
+                selected[j] = None
+                spent += self.costs[j]
+
+        return [self.tables[i] for i in selected]
+
+
+class SchemaRetriever:
+    """
+    Per-connection SchemaIndex, rebuilt when the schema fingerprint changes.
+
+    Usage:
+        tables = schema_retriever.select_tables(catalog, question)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.SCHEMA_RETRIEVAL_ENABLED,
+        top_k: int = settings.SCHEMA_RETRIEVAL_TOP_K,
+        token_budget: int = settings.SCHEMA_PROMPT_TOKEN_BUDGET,
+        max_indexes: int = settings.SCHEMA_RETRIEVAL_MAX_INDEXES,
+    ):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self._indexes = LRUCache(maxsize=max_indexes)
+        self._counters = {"lookups": 0, "builds": 0, "pruned": 0}
+
+    def select_tables(self, catalog: SchemaCatalog, question: str) -> Sequence[TableSchema]:
+        if not self.enabled:
+            return list(catalog.tables.values())
+        self._counters["lookups"] += 1
+        tables = self._get_index(catalog).select(question, self.top_k, self.token_budget)
+        if len(tables) < len(catalog.tables):
+            self._counters["pruned"] += 1
+        return tables
+
+    def invalidate(self, connection_id: str) -> None:
+        self._indexes.pop(connection_id)
+
+    def stats(self) -> dict:
+        return {**self._counters, "indexes": len(self._indexes)}
+
+    def _get_index(self, catalog: SchemaCatalog) -> SchemaIndex:
+        index: Optional[SchemaIndex] = self._indexes.get(catalog.connection_id)
+        if index is None or index.fingerprint != catalog.fingerprint:
+            index = SchemaIndex(catalog)
+            self._indexes.set(catalog.connection_id, index)
+            self._counters["builds"] += 1
+            logger.debug(
+                "Built schema index for %s: %d tables, %d tokens",
+                catalog.connection_id, len(index.tables), len(index.postings),
+            )
+        return index
+
+
+schema_retriever = SchemaRetriever()
@@ -0,0 +1,399 @@
+"""
+Near-duplicate question matching over past queries.
+
+Exact-match caching misses rephrasings like "top 10 customers by revenue"
+vs "show the 10 biggest customers by revenue". This index finds previously
+answered questions on the same connection that mean the same thing, so
+their generated SQL can be reused without an LLM call. It runs entirely in
+process:
+
+- Questions are reduced to a set of canonical tokens (stopwords dropped,
+  common synonyms and plurals folded).
+- Each token set gets a MinHash signature, split into LSH bands. A lookup
+  only compares against entries sharing at least one band bucket.
+- Candidates are verified with exact Jaccard similarity and must mention
+  the same numbers ("top 10" never matches "top 5") and the same
+  qualifiers: quantifiers, directions, conjunctions and words like
+  "this" or "each" ("this month" never matches "each month").
+
+History is loaded per connection in the background on first use, and
+entries with negative feedback are never served.
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.feedback import Feedback
+from app.models.query import Query, QueryStatus
+from app.services.sql_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+# Buckets shared by very many entries carry little signal; cap the work
+MAX_CANDIDATES = 256
+
+_MASK64 = (1 << 64) - 1
+_rng = random.Random(0x51A1)
+_PERMUTATIONS = [
+    (_rng.getrandbits(64) | 1, _rng.getrandbits(64)) for _ in range(NUM_PERMUTATIONS)
+]
+
+_TOKEN = re.compile(r"[a-z0-9_]+")
+
+STOPWORDS = frozenset(
+    """
+    a an the of for in on at by with is are was were be been
+    me my our we us you your i it its there their
+    show list give get find display return tell who whom whose
+    please can could would should do does did
+    """.split()
+)
+
+# Words that change what a question asks for; matching questions must
+# contain exactly the same ones, like numbers
+QUALIFIERS = frozenset(
+    """
+    which how many much from to and or not no without
+    this that these those all each every per
+    """.split()
+)
+
+SYNONYMS = {
+    "biggest": "top", "largest": "top", "highest": "top", "greatest": "top",
+    "best": "top", "most": "top", "smallest": "bottom", "lowest": "bottom",
+    "least": "bottom", "worst": "bottom", "rev": "revenue", "sales": "revenue",
+    "client": "customer", "clients": "customer", "users": "user",
+    "avg": "average", "mean": "average", "qty": "quantity", "amt": "amount",
+    "num": "count", "number": "count", "yr": "year", "mo": "month",
+    "what": "which",
+}
+
+
+def tokenize(question: str) -> FrozenSet[str]:
+    """Canonical token set of a question, used for similarity"""
+    tokens = set()
+    for token in _TOKEN.findall(normalize_question(question)):
+        token = SYNONYMS.get(token, token)
+        if token in STOPWORDS:
+            continue
+        # Fold simple plurals so "customers" matches "customer"
+        if len(token) > 3 and not token.isdigit() and token not in QUALIFIERS:
+            if token.endswith("ies"):
+                token = token[:-3] + "y"
+            elif token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+        tokens.add(SYNONYMS.get(token, token))
+    return frozenset(tokens)
+
+
+def required_tokens(tokens: FrozenSet[str]) -> FrozenSet[str]:
+    """Tokens another question must share exactly to match: numbers and qualifiers"""
+    return frozenset(t for t in tokens if t.isdigit() or t in QUALIFIERS)
+
+
+@lru_cache(maxsize=65536)
+def _token_hashes(token: str) -> Tuple[int, ...]:
+    # Question vocabularies are small, so each token is hashed once
+    h = zlib.crc32(token.encode())
+    return tuple((h * a + b) & _MASK64 for a, b in _PERMUTATIONS)
+
+
+def minhash(tokens: FrozenSet[str]) -> Tuple[int, ...]:
+    return tuple(map(min, zip(*map(_token_hashes, tokens))))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class SimilarMatch:
+    query_id: Optional[str]
+    natural_language: str
+    sql: str
+    similarity: float
+    rating: Optional[int]
+
+
+class _Entry:
+    __slots__ = ("query_id", "natural_language", "sql", "tokens", "required", "rating")
+
+    def __init__(self, query_id, natural_language, sql, tokens, rating):
+        self.query_id = query_id
+        self.natural_language = natural_language
+        self.sql = sql
+        self.tokens = tokens
+        self.required = required_tokens(tokens)
+        self.rating = rating
+
+
+class _ConnectionIndex:
+    """MinHash LSH index over one connection's question history"""
+
+    def __init__(self):
+        self.entries: List[Optional[_Entry]] = []
+        # Normalized question -> entry position, so repeats are stored once
+        self.by_question: Dict[str, int] = {}
+        # SQL -> positions that have served it; may include replaced entries
+        self.by_sql: Dict[str, List[int]] = {}
+        self.buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(BANDS)]
+        self.ready = False
+
+    def add(self, entry: _Entry) -> None:
+        normalized = normalize_question(entry.natural_language)
+        position = self.by_question.get(normalized)
+        if position is not None:
+            existing = self.entries[position]
+            # Keep the better-rated answer; otherwise the most recent one
+            if existing is not None and (existing.rating or 0) > (entry.rating or 0):
+                return
+            self.entries[position] = entry
+            self._track_sql(entry.sql, position)
+            return
+
+        position = len(self.entries)
+        self.entries.append(entry)
+        self.by_question[normalized] = position
+        self._track_sql(entry.sql, position)
+        signature = minhash(entry.tokens)
+        for band in range(BANDS):
+            key = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+            self.buckets[band].setdefault(key, []).append(position)
+
+    def _track_sql(self, sql: str, position: int) -> None:
+        positions = self.by_sql.setdefault(sql, [])
+        if position not in positions:
+            positions.append(position)
+
+    def remove_sql(self, sql: str) -> List[str]:
+        """Drop every entry answering with this SQL; returns their questions"""
+        removed = []
+        for position in self.by_sql.pop(sql, ()):
+            entry = self.entries[position]
+            if entry is None or entry.sql != sql:
+                continue
+            self.entries[position] = None
+            self.by_question.pop(normalize_question(entry.natural_language), None)
+            removed.append(entry.natural_language)
+        return removed
+
+    def candidates(self, tokens: FrozenSet[str]) -> Set[int]:
+        signature = minhash(tokens)
+        found: Set[int] = set()
+        for band in range(BANDS):
+            key = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+            found.update(self.buckets[band].get(key, ()))
+            if len(found) >= MAX_CANDIDATES:
+                break
+        return found
+
+
+class SimilarityIndex:
+    """
+    Per-connection near-duplicate index over past questions.
+
+    Usage:
+        match = similarity_index.lookup(connection_id, question)
+        similarity_index.add(connection_id, query_id, question, sql)
+    """
+
+    def __init__(
+        self,
+        threshold: float = settings.SIMILARITY_THRESHOLD,
+        max_entries: int = settings.SIMILARITY_MAX_ENTRIES,
+        max_connections: int = settings.SIMILARITY_MAX_CONNECTIONS,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_connections = max_connections
+        self._indexes: "OrderedDict[str, _ConnectionIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._counters = {"lookups": 0, "matches": 0, "not_ready": 0, "loads": 0}
+
+    def lookup(self, connection_id: str, question: str) -> Optional[SimilarMatch]:
+        """
+        Find a previously answered question that means the same thing.
+        Returns None until the connection's history has been loaded.
+        """
+        self._counters["lookups"] += 1
+        index = self._get_index(connection_id)
+        if not index.ready:
+            self._counters["not_ready"] += 1
+            return None
+
+        tokens = tokenize(question)
+        if not tokens:
+            return None
+        required = required_tokens(tokens)
+
+        best: Optional[_Entry] = None
+        best_key = None
+        for position in index.candidates(tokens):
+            entry = index.entries[position]
+            if entry is None or entry.required != required:
+                continue
+            similarity = jaccard(tokens, entry.tokens)
+            if similarity < self.threshold:
+                continue
+            # Prefer answers users rated helpful, then closer matches
+            key = ((entry.rating or 0) > 0, similarity, position)
+            if best_key is None or key > best_key:
+                best, best_key = entry, key
+
+        if best is None:
+            return None
+        self._counters["matches"] += 1
+        return SimilarMatch(
+            query_id=best.query_id,
+            natural_language=best.natural_language,
+            sql=best.sql,
+            similarity=round(best_key[1], 4),
+            rating=best.rating,
+        )
+
+    def add(
+        self,
+        connection_id: str,
+        query_id: Optional[str],
+        question: str,
+        sql: str,
+        rating: Optional[int] = None,
+    ) -> None:
+        """Index a newly answered question"""
+        index = self._indexes.get(connection_id)
+        if index is None or (rating is not None and rating < 0):
+            return
+        tokens = tokenize(question)
+        if tokens:
+            index.add(_Entry(query_id, question, sql, tokens, rating))
+
+    def record_feedback(
+        self, connection_id: str, question: str, sql: Optional[str], rating: int
+    ) -> List[str]:
+        """
+        Apply a feedback rating to the answer for a question. A negative
+        rating stops its SQL being served for any question, including the
+        one it was first generated for when the rated query reused it.
+        Returns the questions whose answer was dropped.
+        """
+        index = self._indexes.get(connection_id)
+        if index is None:
+            return []
+        if rating < 0:
+            return index.remove_sql(sql) if sql else []
+        position = index.by_question.get(normalize_question(question))
+        if position is not None and index.entries[position] is not None:
+            index.entries[position].rating = rating
+        return []
+
+    def invalidate(self, connection_id: str) -> None:
+        """Drop a connection's index, e.g. after its schema or details change"""
+        self._indexes.pop(connection_id, None)
+        task = self._loading.pop(connection_id, None)
+        if task is not None:
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self._indexes),
+            "entries": sum(len(i.by_question) for i in self._indexes.values()),
+            **self._counters,
+        }
+
+    def _get_index(self, connection_id: str) -> _ConnectionIndex:
+        index = self._indexes.get(connection_id)
+        if index is not None:
+            self._indexes.move_to_end(connection_id)
+            return index
+
+        index = _ConnectionIndex()
+        self._indexes[connection_id] = index
+        while len(self._indexes) > self.max_connections:
+            evicted_id, _ = self._indexes.popitem(last=False)
+            task = self._loading.pop(evicted_id, None)
+            if task is not None:
+                task.cancel()
+        self._loading[connection_id] = asyncio.create_task(
+            self._load(connection_id, index)
+        )
+        return index
+
+    async def _load(self, connection_id: str, index: _ConnectionIndex) -> None:
+        started = time.perf_counter()
+        # SQL rated unhelpful on any query, including ones that reused it
+        rated_query, rated_feedback = aliased(Query), aliased(Feedback)
+        unhelpful_sql = (
+            select(rated_query.generated_sql)
+            .join(rated_feedback, rated_feedback.query_id == rated_query.id)
+            .where(
+                rated_query.connection_id == connection_id,
+                rated_query.generated_sql.is_not(None),
+                rated_feedback.rating < 0,
+            )
+        )
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(
+                        Query.id,
+                        Query.natural_language,
+                        Query.generated_sql,
+                        Feedback.rating,
+                    )
+                    .outerjoin(Feedback, Feedback.query_id == Query.id)
+                    .where(
+                        Query.connection_id == connection_id,
+                        Query.status == QueryStatus.SUCCESS,
+                        or_(Feedback.rating.is_(None), Feedback.rating > 0),
+                        Query.generated_sql.not_in(unhelpful_sql),
+                    )
+                    .order_by(Query.created_at.desc())
+                    .limit(self.max_entries)
+                )
+                rows = result.all()
+
+            # Oldest first, so newer answers replace older ones; yield to
+            # the event loop between chunks so loading never stalls requests
+            rows.reverse()
+            for start in range(0, len(rows), 1000):
+                for row in rows[start:start + 1000]:
+                    tokens = tokenize(row.natural_language)
+                    if tokens:
+                        index.add(
+                            _Entry(row.id, row.natural_language, row.generated_sql, tokens, row.rating)
+                        )
+                await asyncio.sleep(0)
+            index.ready = True
+            self._counters["loads"] += 1
+            logger.info(
+                "Loaded %d past questions for %s in %.0f ms",
+                len(rows), connection_id, (time.perf_counter() - started) * 1000,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Could not load question history for %s: %s", connection_id, e)
+            # Forget the empty index so the next lookup retries the load
+            if self._indexes.get(connection_id) is index:
+                del self._indexes[connection_id]
+        finally:
+            if self._loading.get(connection_id) is asyncio.current_task():
+                del self._loading[connection_id]
+
+
+similarity_index = SimilarityIndex()
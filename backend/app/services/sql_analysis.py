@@ -0,0 +1,187 @@
+"""
+Analysis of generated SQL: statement type, referenced tables and CTEs,
+multi-statement and mutating SQL.
+
+Each statement is parsed once (sqlglot, PostgreSQL dialect) and the result
+is memoized by SQL hash in a bounded LRU, since the same SQL recurs
+constantly (cache hits, similar-question reuse, re-execution). Statements
+longer than SQL_ANALYSIS_INLINE_MAX_CHARS are parsed in a worker thread so
+they never stall the event loop. SQL that doesn't parse falls back to a
+regex scan, so analysis is best-effort rather than an error.
+"""
+import asyncio
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from app.config import settings
+from app.utils.lru import LRUCache
+
+READ_ONLY_TYPES = frozenset({"SELECT", "EXPLAIN", "SHOW", "DESCRIBE"})
+# Data-modifying statements, also inside CTEs
+DML_NODES = (exp.Insert, exp.Update, exp.Delete, exp.Merge)
+
+# Regex fallback for SQL sqlglot can't parse.
+# Relations named after FROM/JOIN, optionally schema-qualified and quoted
+_RELATION_REFERENCE = re.compile(
+    r'\b(?:from|join)\s+((?:"[^"]+"|\w+)(?:\s*\.\s*(?:"[^"]+"|\w+))?)',
+    re.IGNORECASE,
+)
+_CTE_NAME = re.compile(r'(?:\bwith(?:\s+recursive)?|,)\s*("[^"]+"|\w+)\s+as\s*\(', re.IGNORECASE)
+_FIRST_KEYWORD = re.compile(r"^\s*(\w+)")
+_DML_KEYWORD = re.compile(r"\b(insert|update|delete|merge)\b", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class SQLAnalysis:
+    query_type: str  # of the first statement: SELECT, INSERT, ...
+    tables: Tuple[str, ...]  # relations read or written, lowercased, CTEs excluded
+    ctes: Tuple[str, ...]
+    statement_count: int
+    is_mutating: bool
+    parse_error: Optional[str] = None  # set when the regex fallback was used
+
+    @property
+    def is_multi_statement(self) -> bool:
+        return self.statement_count > 1
+
+    @property
+    def is_read_only(self) -> bool:
+        return not self.is_mutating and not self.is_multi_statement
+
+
+def _relation_name(*parts: Optional[str]) -> str:
+    return ".".join(part for part in parts if part).lower()
+
+
+def _statement_type(statement: exp.Expression) -> str:
+    if isinstance(statement, exp.Command):
+        return str(statement.this).upper()
+    if isinstance(statement, (exp.Union, exp.Intersect, exp.Except)):
+        return "SELECT"
+    return statement.key.upper()
+
+
+def _analyze(sql: str) -> SQLAnalysis:
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except SqlglotError as e:
+        return _analyze_with_regex(sql, str(e))
+    if not statements:
+        return SQLAnalysis(query_type="", tables=(), ctes=(), statement_count=0, is_mutating=False)
+
+    tables, ctes = {}, {}
+    is_mutating = False
+    for statement in statements:
+        names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        ctes.update(dict.fromkeys(sorted(names)))
+        for table in statement.find_all(exp.Table):
+            # Table functions (generate_series(...)) aren't relations
+            if not isinstance(table.this, exp.Identifier):
+                continue
+            name = _relation_name(table.catalog, table.db, table.name)
+            if name not in names:
+                tables[name] = None
+        is_mutating = is_mutating or (
+            _statement_type(statement) not in READ_ONLY_TYPES
+            or statement.find(*DML_NODES) is not None
+            or statement.find(exp.Into) is not None  # SELECT ... INTO creates a table
+        )
+
+    return SQLAnalysis(
+        query_type=_statement_type(statements[0]),
+        tables=tuple(tables),
+        ctes=tuple(ctes),
+        statement_count=len(statements),
+        is_mutating=is_mutating,
+    )
+
+
+def _analyze_with_regex(sql: str, error: str) -> SQLAnalysis:
+    ctes = {name.strip('"').lower() for name in _CTE_NAME.findall(sql)}
+    tables = {}
+    for reference in _RELATION_REFERENCE.findall(sql):
+        name = ".".join(part.strip().strip('"') for part in reference.split(".")).lower()
+        if name not in ctes:
+            tables[name] = None
+    first = _FIRST_KEYWORD.match(sql)
+    query_type = first.group(1).upper() if first else ""
+    if query_type == "WITH":
+        query_type = "SELECT"
+    return SQLAnalysis(
+        query_type=query_type,
+        tables=tuple(tables),
+        ctes=tuple(sorted(ctes)),
+        statement_count=len([part for part in sql.split(";") if part.strip()]),
+        is_mutating=query_type not in READ_ONLY_TYPES or bool(_DML_KEYWORD.search(sql)),
+        parse_error=error,
+    )
+
+
+class SQLAnalyzer:
+    """
+    Memoizing front end to the parser.
+
+    Usage:
+        analysis = await sql_analyzer.analyze_async(sql)  # from request handlers
+        analysis = sql_analyzer.analyze(sql)              # short SQL, or outside the event loop
+    """
+
+    def __init__(
+        self,
+        cache_size: int = settings.SQL_ANALYSIS_CACHE_SIZE,
+        inline_max_chars: int = settings.SQL_ANALYSIS_INLINE_MAX_CHARS,
+        threads: int = settings.SQL_ANALYSIS_THREADS,
+    ):
+        self.inline_max_chars = inline_max_chars
+        self._cache = LRUCache(maxsize=cache_size)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="sql-analysis")
+        self._counters = {"hits": 0, "misses": 0, "threaded": 0, "parse_errors": 0}
+
+    def analyze(self, sql: str) -> SQLAnalysis:
+        key = self._key(sql)
+        analysis = self._lookup(key)
+        if analysis is None:
+            analysis = self._store(key, _analyze(sql))
+        return analysis
+
+    async def analyze_async(self, sql: str) -> SQLAnalysis:
+        key = self._key(sql)
+        analysis = self._lookup(key)
+        if analysis is not None:
+            return analysis
+        if len(sql) <= self.inline_max_chars:
+            return self._store(key, _analyze(sql))
+        self._counters["threaded"] += 1
+        analysis = await asyncio.get_running_loop().run_in_executor(self._executor, _analyze, sql)
+        return self._store(key, analysis)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {**self._counters, "entries": len(self._cache)}
+
+    @staticmethod
+    def _key(sql: str) -> bytes:
+        return hashlib.blake2b(sql.encode(), digest_size=16).digest()
+
+    def _lookup(self, key: bytes) -> Optional[SQLAnalysis]:
+        analysis = self._cache.get(key)
+        self._counters["hits" if analysis is not None else "misses"] += 1
+        return analysis
+
+    def _store(self, key: bytes, analysis: SQLAnalysis) -> SQLAnalysis:
+        if analysis.parse_error:
+            self._counters["parse_errors"] += 1
+        self._cache.set(key, analysis)
+        return analysis
+
+
+sql_analyzer = SQLAnalyzer()
@@ -0,0 +1,189 @@
+"""
+Two-tier cache for generated SQL.
+
+Repeated questions (dashboards, teammates asking the same thing) would each
+cost an LLM round trip of one to several seconds. Generated SQL is cached
+in an in-process LRU in front of a shared Redis tier, keyed by:
+
+- the normalized question text,
+- the connection's schema fingerprint, so a schema change never serves SQL
+  written for the old schema,
+- the model version (model name + prompt version).
+
+When a connection's fingerprint changes, its entries for older fingerprints
+are evicted from both tiers.
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+from typing import Dict, Iterable, Optional
+
+from app.cache import REDIS_ERRORS, redis_client, redis_key
+from app.config import settings
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!;]+$")
+
+
+def normalize_question(text: str) -> str:
+    """Canonical form of a question: case, width, spacing and trailing punctuation folded"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class SQLCache:
+    """
+    In-process LRU in front of Redis for generated SQL.
+
+    Usage:
+        sql = await sql_cache.get(connection_id, fingerprint, model_version, question)
+        await sql_cache.set(connection_id, fingerprint, model_version, question, sql)
+    """
+
+    def __init__(
+        self,
+        local_max_entries: int = settings.SQL_CACHE_LOCAL_MAX_ENTRIES,
+        ttl: int = settings.SQL_CACHE_TTL_SECONDS,
+    ):
+        self.ttl = ttl
+        self._local = LRUCache(maxsize=local_max_entries, ttl=ttl)
+        # Last fingerprint seen per connection, to detect schema changes
+        self._fingerprints: Dict[str, str] = {}
+        self._counters = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def _digest(question: str) -> str:
+        return hashlib.sha256(normalize_question(question).encode()).hexdigest()[:32]
+
+    @classmethod
+    def _key(cls, connection_id: str, fingerprint: str, model_version: str, question: str) -> str:
+        return redis_key("sql", connection_id, fingerprint, model_version, cls._digest(question))
+
+    async def get(
+        self, connection_id: str, fingerprint: str, model_version: str, question: str
+    ) -> Optional[str]:
+        await self._track_fingerprint(connection_id, fingerprint)
+        key = self._key(connection_id, fingerprint, model_version, question)
+
+        sql = self._local.get(key)
+        if sql is not None:
+            self._counters["local_hits"] += 1
+            return sql
+
+        try:
+            raw = await redis_client.get(key)
+        except REDIS_ERRORS as e:
+            logger.warning("SQL cache read failed: %s", e)
+            raw = None
+        if raw is not None:
+            sql = raw.decode()
+            self._local.set(key, sql)
+            self._counters["redis_hits"] += 1
+            return sql
+
+        self._counters["misses"] += 1
+        return None
+
+    async def set(
+        self,
+        connection_id: str,
+        fingerprint: str,
+        model_version: str,
+        question: str,
+        sql: str,
+    ) -> None:
+        key = self._key(connection_id, fingerprint, model_version, question)
+        self._local.set(key, sql)
+        self._counters["sets"] += 1
+        try:
+            await redis_client.set(key, sql, ex=self.ttl)
+        except REDIS_ERRORS as e:
+            logger.warning("SQL cache write failed: %s", e)
+
+    async def evict_questions(
+        self, connection_id: str, model_version: str, questions: Iterable[str]
+    ) -> None:
+        """
+        Drop cached SQL for these questions, e.g. after it was rated unhelpful.
+        Looks the keys up by scanning when this worker hasn't seen the
+        connection's fingerprint yet.
+        """
+        questions = list(questions)
+        fingerprint = self._fingerprints.get(connection_id)
+        if fingerprint is not None:
+            keys = {self._key(connection_id, fingerprint, model_version, q) for q in questions}
+            for key in keys:
+                if self._local.pop(key) is not None:
+                    self._counters["evictions"] += 1
+
+        try:
+            if fingerprint is None:
+                prefix = redis_key("sql", connection_id) + ":"
+                suffixes = tuple(f":{model_version}:{self._digest(q)}" for q in questions)
+                keys = {
+                    key
+                    async for key in redis_client.scan_iter(match=f"{prefix}*", count=500)
+                    if key.decode().endswith(suffixes)
+                }
+            if keys:
+                self._counters["evictions"] += await redis_client.unlink(*keys)
+        except REDIS_ERRORS as e:
+            logger.warning("SQL cache eviction failed for %s: %s", connection_id, e)
+
+    async def evict_connection(
+        self, connection_id: str, keep_fingerprint: Optional[str] = None
+    ) -> None:
+        """
+        Drop cached SQL for a connection, optionally keeping one fingerprint.
+        Called when the schema changes or the connection is updated or deleted.
+        """
+        prefix = redis_key("sql", connection_id) + ":"
+        keep = f"{prefix}{keep_fingerprint}:" if keep_fingerprint else None
+
+        for key in self._local.keys():
+            if key.startswith(prefix) and not (keep and key.startswith(keep)):
+                self._local.pop(key)
+                self._counters["evictions"] += 1
+        if keep_fingerprint is None:
+            self._fingerprints.pop(connection_id, None)
+
+        try:
+            stale = [
+                key
+                async for key in redis_client.scan_iter(match=f"{prefix}*", count=500)
+                if not (keep and key.decode().startswith(keep))
+            ]
+            if stale:
+                await redis_client.unlink(*stale)
+                self._counters["evictions"] += len(stale)
+        except REDIS_ERRORS as e:
+            logger.warning("SQL cache eviction failed for %s: %s", connection_id, e)
+
+    def stats(self) -> dict:
+        hits = self._counters["local_hits"] + self._counters["redis_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self._local),
+        }
+
+    async def _track_fingerprint(self, connection_id: str, fingerprint: str) -> None:
+        previous = self._fingerprints.get(connection_id)
+        self._fingerprints[connection_id] = fingerprint
+        if previous is not None and previous != fingerprint:
+            await self.evict_connection(connection_id, keep_fingerprint=fingerprint)
+
+
+sql_cache = SQLCache()
@@ -0,0 +1,319 @@
+"""
+Write-behind pipeline for query history and feedback.
+
+Request handlers enqueue Query inserts, execution-stat updates and Feedback
+upserts instead of committing them inline, so answering the user never
+waits on the metadata database. A background task flushes the queue in
+bulk, one transaction per batch:
+
+- a batch closes at WRITE_BEHIND_BATCH_SIZE writes or
+  WRITE_BEHIND_FLUSH_INTERVAL_SECONDS after its first write, whichever
+  comes first;
+- Query rows go in as one multi-row INSERT, then execution-stat updates
+  as one executemany, then feedback as one multi-row upsert;
+- the queue is bounded: when it is full, enqueueing waits for the flusher
+  (backpressure) rather than growing without limit;
+- on shutdown the queue is drained before the engine is disposed;
+- usage rollups are updated in the same transaction (see rollups.py).
+
+Queries that are queued but not yet committed stay visible through
+pending_query(), so a client can execute a query right after creating it.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.feedback import Feedback
+from app.models.query import Query
+from app.services.rollups import RollupDeltas, apply_rollup_deltas
+
+logger = logging.getLogger(__name__)
+
+QUERY_COLUMNS = [column.name for column in Query.__table__.columns]
+# What a Query row contributes to the usage rollups depends on these
+ROLLUP_SOURCE_COLUMNS = (
+    "id", "user_id", "connection_id", "created_at", "status", "response_time", "rows_returned",
+)
+
+
+@dataclass
+class _Write:
+    kind: str  # "query", "update" or "feedback"
+    values: dict
+
+
+_STOP = _Write("stop", {})
+
+
+class WriteBehind:
+    """
+    Bounded queue of metadata writes, flushed in bulk by a background task.
+
+    Usage:
+        await write_behind.start()   # app startup
+        await write_behind.add_query({...})
+        await write_behind.close()   # app shutdown; drains the queue
+    """
+
+    def __init__(
+        self,
+        max_queue: int = settings.WRITE_BEHIND_MAX_QUEUE,
+        batch_size: int = settings.WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = settings.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+        max_retries: int = settings.WRITE_BEHIND_MAX_RETRIES,
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        # Inserted-but-uncommitted queries, for read-your-writes lookups
+        self._pending_queries: Dict[str, dict] = {}
+        # The subset still in the queue; updates are merged into these directly
+        self._queued_queries: Dict[str, dict] = {}
+        self._counters = {
+            "enqueued": 0,
+            "written": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "dropped": 0,
+            "backpressure_waits": 0,
+        }
+        self._flush_seconds_total = 0.0
+        self._flush_seconds_max = 0.0
+        self._last_flush_ms = 0.0
+        self._last_batch_size = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Flush everything queued so far and stop the flusher"""
+        if not self.running:
+            return
+        task, self._task = self._task, None  # later writes go straight to the database
+        await self._queue.put(_STOP)
+        await task
+
+    async def add_query(self, values: dict) -> Query:
+        """Queue a new Query row; values must include id. Returns it as a transient object."""
+        values = {"created_at": datetime.now(timezone.utc), **values}
+        query = Query(**values)
+        self._pending_queries[values["id"]] = values
+        if self.running:
+            self._queued_queries[values["id"]] = values
+        await self._enqueue(_Write("query", values))
+        return query
+
+    async def update_query(self, query_id: str, values: dict) -> None:
+        """Queue new column values for an existing (or still queued) Query row"""
+        queued = self._queued_queries.get(query_id)
+        if queued is not None:
+            # Not picked up by the flusher yet: fold into the pending INSERT
+            queued.update(values)
+            return
+        pending = self._pending_queries.get(query_id)
+        if pending is not None:
+            pending.update(values)
+        await self._enqueue(_Write("update", {"id": query_id, **values}))
+
+    async def add_feedback(self, values: dict) -> None:
+        """Queue a Feedback upsert; a newer rating for the same query replaces the old one"""
+        values = {"created_at": datetime.now(timezone.utc), **values}
+        await self._enqueue(_Write("feedback", values))
+
+    def pending_query(self, query_id: str) -> Optional[Query]:
+        """A queued Query that isn't committed yet, as a transient object"""
+        values = self._pending_queries.get(query_id)
+        return Query(**values) if values is not None else None
+
+    def stats(self) -> dict:
+        flushes = self._counters["flushes"]
+        return {
+            **self._counters,
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "pending_queries": len(self._pending_queries),
+            "last_batch_size": self._last_batch_size,
+            "last_flush_ms": self._last_flush_ms,
+            "avg_flush_ms": round(self._flush_seconds_total / flushes * 1000, 2) if flushes else 0.0,
+            "max_flush_ms": round(self._flush_seconds_max * 1000, 2),
+        }
+
+    async def _enqueue(self, write: _Write) -> None:
+        self._counters["enqueued"] += 1
+        if not self.running:
+            # No flusher (e.g. scripts, or after shutdown began): write inline
+            await self._flush([write])
+            return
+        if self._queue.full():
+            self._counters["backpressure_waits"] += 1
+        await self._queue.put(write)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        write = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if write is _STOP:
+                    stopping = True
+                    break
+                batch.append(write)
+            try:
+                await self._flush(batch)
+            except Exception:
+                # Keep flushing: everything still queued would be lost with this task
+                self._counters["failed_flushes"] += 1
+                logger.exception("Write-behind flush of %d writes failed", len(batch))
+
+    async def _flush(self, batch: List[_Write]) -> None:
+        # From here on, updates to these queries must be queued separately
+        for write in batch:
+            if write.kind == "query":
+                self._queued_queries.pop(write.values["id"], None)
+
+        started = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self._write(batch)
+                    self._counters["written"] += len(batch)
+                    break
+                except Exception as e:
+                    # Not only SQLAlchemyError: with the database down, asyncpg
+                    # raises OSError or a timeout straight through
+                    if attempt < self.max_retries:
+                        logger.warning("Write-behind flush failed, retrying: %s", e)
+                        await asyncio.sleep(0.1 * 2 ** attempt)
+                        continue
+                    self._counters["failed_flushes"] += 1
+                    if len(batch) > 1:
+                        # Isolate the bad write(s) so the rest of the batch still lands
+                        for write in batch:
+                            await self._write_single(write)
+                    else:
+                        self._counters["dropped"] += 1
+                        logger.error("Write-behind dropped a %s write: %s", batch[0].kind, e)
+        finally:
+            for write in batch:
+                if write.kind == "query":
+                    self._pending_queries.pop(write.values["id"], None)
+            elapsed = time.perf_counter() - started
+            self._counters["flushes"] += 1
+            self._flush_seconds_total += elapsed
+            self._flush_seconds_max = max(self._flush_seconds_max, elapsed)
+            self._last_flush_ms = round(elapsed * 1000, 2)
+            self._last_batch_size = len(batch)
+
+    async def _write_single(self, write: _Write) -> None:
+        try:
+            await self._write([write])
+            self._counters["written"] += 1
+        except Exception as e:
+            self._counters["dropped"] += 1
+            logger.error("Write-behind dropped a %s write: %s", write.kind, e)
+
+    async def _write(self, batch: List[_Write]) -> None:
+        inserts: Dict[str, dict] = {}
+        updates: Dict[str, dict] = {}
+        feedback: Dict[str, dict] = {}
+        for write in batch:
+            if write.kind == "query":
+                inserts[write.values["id"]] = dict(write.values)
+            elif write.kind == "update":
+                query_id = write.values["id"]
+                target = inserts.get(query_id)
+                if target is None:
+                    target = updates.setdefault(query_id, {})
+                target.update(write.values)
+            elif write.kind == "feedback":
+                # One row per query; an upsert can't touch the same row twice
+                feedback[write.values["query_id"]] = write.values
+
+        deltas = RollupDeltas()
+        async with AsyncSessionLocal() as session:
+            if inserts:
+                # Multi-row VALUES needs the same keys in every row
+                keys = [c for c in QUERY_COLUMNS if any(c in row for row in inserts.values())]
+                rows = [{key: row.get(key) for key in keys} for row in inserts.values()]
+                result = await session.execute(
+                    insert(Query)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=["id"])
+                    .returning(Query.id)
+                )
+                # Rows already written by an earlier, retried attempt are skipped
+                for query_id in result.scalars():
+                    deltas.add(inserts[query_id])
+            if updates:
+                # Lock the rows so concurrent flushes can't compute deltas from the same old state
+                result = await session.execute(
+                    select(*[Query.__table__.c[c] for c in ROLLUP_SOURCE_COLUMNS])
+                    .where(Query.id.in_(list(updates)))
+                    .with_for_update()
+                )
+                for old in result.mappings():
+                    deltas.add(old, sign=-1)
+                    deltas.add({**old, **updates[old["id"]]})
+            for keys, rows in _group_by_keys(updates.values()).items():
+                table = Query.__table__
+                await session.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("_id"))
+                    .values({key: bindparam(key) for key in keys if key != "id"}),
+                    [{"_id": row["id"], **{k: v for k, v in row.items() if k != "id"}} for row in rows],
+                )
+            if feedback:
+                statement = insert(Feedback).values(list(feedback.values()))
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=["query_id"],
+                        set_={
+                            "rating": statement.excluded.rating,
+                            "comment": statement.excluded.comment,
+                        },
+                    )
+                )
+            await apply_rollup_deltas(session, deltas)
+            await session.commit()
+
+
+def _group_by_keys(rows) -> Dict[tuple, List[dict]]:
+    """executemany needs one parameter shape per statement"""
+    groups: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return groups
+
+
+write_behind = WriteBehind()
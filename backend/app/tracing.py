@@ -0,0 +1,169 @@
+"""
+Per-request timing breakdown.
+
+TimingMiddleware starts a RequestTimings for every HTTP request and keeps
+it in a context variable, so code anywhere below it can add to the current
+request's spans without passing anything around:
+
+    with span("llm"):
+        text = await ...
+
+Spans with the same name are summed, and counted:
+- db: statements on the metadata database (SQLAlchemy cursor events)
+- db_pool: waiting to check out a metadata database connection
+- db_session: how long the request's get_db session was open
+- llm: waiting for SQL generation
+- target: opening the cursor and fetching rows on the target database
+- encode: turning the endpoint's result into response bytes
+
+The middleware returns them in a Server-Timing header, so browser dev tools
+show the breakdown next to each request. Spans recorded after the response
+started (streamed bodies) only reach the trace log.
+
+Outside a request (background tasks, scripts) there are no timings and
+span() records nothing.
+"""
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class RequestTimings:
+    """Spans of one request: name -> [total seconds, count]"""
+
+    __slots__ = ("started", "spans", "endpoint_returned")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}
+        self.endpoint_returned: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        totals = self.spans.get(name)
+        if totals is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            totals[0] += seconds
+            totals[1] += 1
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, with a total for the request so far"""
+        entries = [
+            f'{name};dur={seconds * 1000:.2f};desc="{count}x"'
+            for name, (seconds, count) in self.spans.items()
+        ]
+        entries.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ", ".join(entries)
+
+    def as_dict(self) -> dict:
+        return {
+            name: {"ms": round(seconds * 1000, 2), "count": int(count)}
+            for name, (seconds, count) in self.spans.items()
+        }
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add an already measured span to the current request, if any"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the block as a span of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+# SQLAlchemy engine events. The async engine runs them in a greenlet that
+# shares the request's context, so the current request's timings are visible.
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._timing_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, "_timing_started", None)
+    if started is not None:
+        record("db", time.perf_counter() - started)
+
+
+def handle_error(exception_context) -> None:
+    started = getattr(exception_context.execution_context, "_timing_started", None)
+    if started is not None:
+        record("db", time.perf_counter() - started)
+
+
+def _mark_return(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    async def endpoint_with_mark(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        timings = _current.get()
+        if timings is not None and not isinstance(result, Response):
+            timings.endpoint_returned = time.perf_counter()
+        return result
+
+    # FastAPI reads the signature through __wrapped__
+    functools.update_wrapper(endpoint_with_mark, endpoint)
+    endpoint_with_mark.marks_return = True
+    return endpoint_with_mark
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute recording the encode span: from the endpoint returning until
+    FastAPI has validated and serialized its result into a response.
+    Endpoints that build their own Response record encode themselves.
+
+    Usage:
+        router = APIRouter(route_class=TimedRoute)
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        if inspect.iscoroutinefunction(endpoint) and not getattr(endpoint, "marks_return", False):
+            endpoint = _mark_return(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], Awaitable[Response]]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            response = await handler(request)
+            timings = _current.get()
+            if timings is not None and timings.endpoint_returned is not None:
+                timings.add("encode", time.perf_counter() - timings.endpoint_returned)
+                timings.endpoint_returned = None
+            return response
+
+        return timed_handler
@@ -0,0 +1,33 @@
+"""
+Rebuild usage rollups from query history.
+
+Usage:
+    python -m app.utils.backfill_rollups              # everyone
+    python -m app.utils.backfill_rollups --user-id X  # one user
+
+Query writes wait while this runs (the write-behind flusher retries), so
+run it off-peak on large histories.
+"""
+import argparse
+import asyncio
+import time
+
+from app.database import AsyncSessionLocal, engine
+from app.services.rollups import rebuild_rollups
+
+
+async def backfill(user_id=None) -> None:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        rows = await rebuild_rollups(session, user_id=user_id)
+        await session.commit()
+    await engine.dispose()
+    scope = f"user {user_id}" if user_id else "all users"
+    print(f"Rebuilt {rows} rollup rows for {scope} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild query usage rollups from history")
+    parser.add_argument("--user-id", help="only rebuild this user's rollups")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.user_id))
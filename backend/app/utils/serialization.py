@@ -0,0 +1,46 @@
+"""
+JSON helpers for values coming back from target databases.
+"""
+import base64
+import json
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, List
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps default= hook for database types json can't encode natively"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # Keep exact precision; clients parse if they need numbers
+        return str(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value: Any) -> str:
+    """Compact JSON encoding that understands database value types"""
+    return json.dumps(value, default=json_default, separators=(",", ":"))
+
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def json_column(values: List[Any]) -> List[Any]:
+    """
+    A column of database values as a JSON round trip through dumps() returns
+    them, so results read fresh and from the cache look the same. Columns
+    of plain JSON scalars are returned as they are.
+    """
+    if all(isinstance(value, _JSON_SCALARS) for value in values):
+        return values
+    return json.loads(dumps(values))
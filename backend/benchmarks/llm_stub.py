@@ -0,0 +1,54 @@
+"""
+Stub LLM completion server for benchmarks (LLM_PROVIDER=http).
+
+Answers POST /complete {"prompt": ...} with {"text": ...} after a
+configurable latency, with the same SQL as the in-process stub provider: a
+query over the first table in the prompt's schema.
+
+Usage (from backend/):
+    python -m benchmarks.llm_stub --port 8100 --latency 0.5 --jitter 0.2
+"""
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from app.services.llm_providers import StubProvider
+
+
+class Completion(BaseModel):
+    prompt: str
+
+
+def create_app(latency: float, jitter: float = 0.0, error_rate: float = 0.0) -> FastAPI:
+    """latency +- jitter seconds per answer; error_rate of requests fail with 503"""
+    app = FastAPI(title="LLM stub")
+    provider = StubProvider(latency=0)
+
+    @app.post("/complete")
+    async def complete(completion: Completion):
+        await asyncio.sleep(max(latency + random.uniform(-jitter, jitter), 0))
+        if error_rate and random.random() < error_rate:
+            raise HTTPException(status_code=503, detail="Stub overloaded")
+        return {"text": await provider.complete(completion.prompt)}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds, uniformly distributed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.latency, args.jitter, args.error_rate),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
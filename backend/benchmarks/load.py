@@ -0,0 +1,497 @@
+"""
+Benchmark: HTTP load on the whole API, with local stand-ins for its services.
+
+Starts the app under uvicorn against a scratch PostgreSQL database, a Redis
+server (or, with --fake-redis, an in-process fakeredis TCP server) and the
+stub LLM server in benchmarks/llm_stub.py. It then drives a weighted mix of
+requests at each concurrency level: profile reads, connection CRUD, query
+generation, execution and history. Each level gets a short unmeasured
+warm-up. The report gives latency percentiles and requests per second per
+route, as a table or as JSON for comparing runs.
+
+Each concurrent client is a virtual user with its own account and primary
+connection, pointing at two seeded tables (bench_customers, bench_orders)
+in --target-url. A --novel-questions fraction of generations ask something
+not asked before, so they miss the SQL caches and reach the LLM stub.
+
+Usage (from backend/):
+    python -m benchmarks.load \\
+        --database-url postgresql+asyncpg://postgres@localhost/queryforge_bench \\
+        --fake-redis --concurrency 1,10,50 --duration 30 --json > run.json
+
+The tables in the --database-url database are dropped and recreated. The
+target defaults to that same database. Rate limits are off unless
+--rate-limits is given, so that the mix measures the work rather than 429s.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import Base
+import app.models  # noqa: F401  (registers the tables on Base.metadata)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Operation -> relative weight in the default mix
+DEFAULT_MIX = {
+    "me": 30,
+    "list_connections": 10,
+    "get_connection": 10,
+    "create_connection": 3,
+    "update_connection": 3,
+    "delete_connection": 3,
+    "generate": 15,
+    "execute": 20,
+    "history": 6,
+}
+
+QUESTIONS = [
+    "How many customers are there in each country?",
+    "Top 10 customers by total order amount",
+    "Average order amount per customer",
+    "Orders placed in the last 7 days",
+    "Customers who have never placed an order",
+    "Total revenue per month",
+    "Number of orders by status",
+    "Largest orders this year",
+    "Customers who signed up this month",
+    "Average number of orders per customer by country",
+]
+
+TARGET_TABLES = """
+CREATE TABLE IF NOT EXISTS bench_customers (
+    id serial PRIMARY KEY,
+    name text NOT NULL,
+    country text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS bench_orders (
+    id serial PRIMARY KEY,
+    customer_id int NOT NULL REFERENCES bench_customers(id),
+    amount numeric(10, 2) NOT NULL,
+    status text NOT NULL,
+    ordered_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+@contextmanager
+def serve(name: str, args: List[str], env: Dict[str, str], health_url: str) -> Iterator[None]:
+    """Run a server in a subprocess until the block exits; waits for health_url to answer"""
+    # Its output goes to stderr, keeping stdout for the report
+    process = subprocess.Popen(
+        [sys.executable, *args], cwd=BACKEND_DIR, env={**os.environ, **env}, stdout=sys.stderr
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with status {process.returncode}")
+            try:
+                if httpx.get(health_url, timeout=1).status_code < 500:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{name} did not start within 60s")
+            time.sleep(0.2)
+        yield
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@contextmanager
+def fake_redis_server() -> Iterator[str]:
+    """An in-process fakeredis server on a free port; yields its URL"""
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        sys.exit("--fake-redis needs fakeredis: pip install fakeredis")
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"redis://127.0.0.1:{port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+async def reset_database(database_url: str) -> None:
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+async def seed_target(target_url: str, customers: int) -> None:
+    engine = create_async_engine(target_url)
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP TABLE IF EXISTS bench_orders, bench_customers"))
+        for statement in TARGET_TABLES.split(";"):
+            await conn.execute(text(statement))
+        await conn.execute(text(
+            "INSERT INTO bench_customers (name, country, created_at) "
+            "SELECT 'customer ' || g, (ARRAY['DE', 'FR', 'GB', 'PK', 'US'])[g % 5 + 1], "
+            "now() - g * interval '1 hour' FROM generate_series(1, :n) AS g"
+        ), {"n": customers})
+        await conn.execute(text(
+            "INSERT INTO bench_orders (customer_id, amount, status, ordered_at) "
+            "SELECT g % :n + 1, (g % 997) * 1.25, (ARRAY['new', 'paid', 'shipped'])[g % 3 + 1], "
+            "now() - g * interval '7 minutes' FROM generate_series(1, :n * 10) AS g"
+        ), {"n": customers})
+        await conn.execute(text("ANALYZE bench_customers"))
+        await conn.execute(text("ANALYZE bench_orders"))
+    await engine.dispose()
+
+
+def target_connection_fields(target_url: str) -> dict:
+    """Connection fields for the API, from a SQLAlchemy URL"""
+    url = make_url(target_url)
+    return {
+        "dialect": "postgresql",
+        # A Unix socket directory may be given as ?host=/path
+        "host": url.host or url.query.get("host") or "localhost",
+        "port": url.port or 5432,
+        "database": url.database,
+        "username": url.username or "postgres",
+        "password": url.password or "",
+    }
+
+
+class Recorder:
+    """Latencies and status codes per route, while recording is on"""
+
+    def __init__(self):
+        self.recording = False
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Counter] = {}
+
+    def reset(self) -> None:
+        self.latencies.clear()
+        self.statuses.clear()
+
+    def add(self, route: str, seconds: float, status_code: int) -> None:
+        if self.recording:
+            self.latencies.setdefault(route, []).append(seconds)
+            self.statuses.setdefault(route, Counter())[status_code] += 1
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route in sorted(self.latencies):
+            latencies = sorted(self.latencies[route])
+            statuses = self.statuses[route]
+            routes[route] = {
+                "requests": len(latencies),
+                "errors": sum(n for code, n in statuses.items() if code >= 400),
+                "requests_per_second": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+                "max_ms": round(latencies[-1] * 1000, 2),
+                "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {
+            "requests": total,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "requests_per_second": round(total / elapsed, 1),
+            "routes": routes,
+        }
+
+
+class VirtualUser:
+    """One client: an account with a primary connection, issuing the mix"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        recorder: Recorder,
+        rng: random.Random,
+        connection_fields: dict,
+        novel_questions: float,
+    ):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.connection_fields = connection_fields
+        self.novel_questions = novel_questions
+        self.clerk_id = f"bench_{secrets.token_hex(6)}"
+        self.user_id: Optional[str] = None
+        self.connection_id: Optional[str] = None
+        self.scratch_connections: List[str] = []
+        self.query_ids: List[str] = []
+
+    async def request(self, route: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.recorder.add(route, time.perf_counter() - started, response.status_code)
+        return response
+
+    async def setup(self) -> None:
+        response = await self.client.post(
+            "/api/v1/users/", json={"clerk_id": self.clerk_id, "email": f"{self.clerk_id}@example.com"}
+        )
+        response.raise_for_status()
+        self.user_id = response.json()["id"]
+        response = await self.client.post(
+            "/api/v1/connections/",
+            params={"user_id": self.user_id},
+            json={"name": "primary", **self.connection_fields},
+        )
+        response.raise_for_status()
+        self.connection_id = response.json()["id"]
+        await self.generate()
+        if not self.query_ids:
+            raise RuntimeError("Query generation failed during setup; is the LLM stub reachable?")
+
+    async def me(self) -> None:
+        await self.request("GET /api/v1/users/me", "GET", "/api/v1/users/me", params={"clerk_id": self.clerk_id})
+
+    async def list_connections(self) -> None:
+        await self.request(
+            "GET /api/v1/connections/", "GET", "/api/v1/connections/", params={"user_id": self.user_id}
+        )
+
+    async def get_connection(self) -> None:
+        await self.request(
+            "GET /api/v1/connections/{id}", "GET", f"/api/v1/connections/{self.connection_id}",
+            params={"user_id": self.user_id},
+        )
+
+    async def create_connection(self) -> None:
+        response = await self.request(
+            "POST /api/v1/connections/", "POST", "/api/v1/connections/",
+            params={"user_id": self.user_id},
+            json={"name": f"scratch-{secrets.token_hex(4)}", **self.connection_fields},
+        )
+        if response.status_code == 201:
+            self.scratch_connections.append(response.json()["id"])
+
+    async def update_connection(self) -> None:
+        if not self.scratch_connections:
+            return await self.create_connection()
+        await self.request(
+            "PUT /api/v1/connections/{id}", "PUT",
+            f"/api/v1/connections/{self.rng.choice(self.scratch_connections)}",
+            params={"user_id": self.user_id},
+            json={"result_cache_ttl": self.rng.choice([0, 30, 60])},
+        )
+
+    async def delete_connection(self) -> None:
+        if not self.scratch_connections:
+            return await self.create_connection()
+        await self.request(
+            "DELETE /api/v1/connections/{id}", "DELETE",
+            f"/api/v1/connections/{self.scratch_connections.pop(0)}",
+            params={"user_id": self.user_id},
+        )
+
+    async def generate(self) -> None:
+        question = self.rng.choice(QUESTIONS)
+        if self.rng.random() < self.novel_questions:
+            question = f"{question} for segment {secrets.token_hex(3)} cohort {secrets.token_hex(3)}"
+        response = await self.request(
+            "POST /api/v1/queries/", "POST", "/api/v1/queries/",
+            params={"user_id": self.user_id},
+            json={"natural_language_query": question, "connection_id": self.connection_id},
+        )
+        if response.status_code == 201:
+            self.query_ids = (self.query_ids + [response.json()["id"]])[-50:]
+
+    async def execute(self) -> None:
+        await self.request(
+            "POST /api/v1/queries/{id}/execute", "POST",
+            f"/api/v1/queries/{self.rng.choice(self.query_ids)}/execute",
+            params={"user_id": self.user_id},
+        )
+
+    async def history(self) -> None:
+        await self.request(
+            "GET /api/v1/queries/", "GET", "/api/v1/queries/", params={"user_id": self.user_id}
+        )
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    users: List[VirtualUser],
+    recorder: Recorder,
+    mix: Dict[str, int],
+    warmup: float,
+    duration: float,
+) -> dict:
+    """Drive the mix with one worker per user: warmup seconds unrecorded, then duration recorded"""
+    operations, weights = list(mix), list(mix.values())
+    stop_at = time.monotonic() + warmup + duration
+
+    async def worker(user: VirtualUser):
+        while time.monotonic() < stop_at:
+            operation = user.rng.choices(operations, weights)[0]
+            try:
+                await getattr(user, operation)()
+            except httpx.HTTPError as e:
+                recorder.add(f"{operation} (transport error)", 0.0, 599)
+                if not recorder.recording:
+                    print(f"warm-up {operation}: {e!r}", file=sys.stderr)
+
+    recorder.reset()
+    recorder.recording = False
+    workers = [asyncio.ensure_future(worker(user)) for user in users]
+    await asyncio.sleep(warmup)
+    recorder.reset()
+    recorder.recording = True
+    started = time.perf_counter()
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - started
+    recorder.recording = False
+
+    report = {"concurrency": len(users), "duration_seconds": round(elapsed, 2), **recorder.report(elapsed)}
+    report["server"] = (await client.get("/health")).json()
+    return report
+
+
+async def drive(args, base_url: str, mix: Dict[str, int]) -> List[dict]:
+    levels = [int(level) for level in args.concurrency.split(",")]
+    recorder = Recorder()
+    fields = target_connection_fields(args.target_url or args.database_url)
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        users = []
+        for i in range(max(levels)):
+            user = VirtualUser(client, recorder, random.Random(args.seed + i), fields, args.novel_questions)
+            await user.setup()
+            users.append(user)
+        results = []
+        for level in levels:
+            results.append(await run_level(client, users[:level], recorder, mix, args.warmup, args.duration))
+        return results
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, value.split(",")):
+        operation, _, weight = part.partition("=")
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}; one of {', '.join(DEFAULT_MIX)}")
+        mix[operation] = int(weight)
+    return {operation: weight for operation, weight in mix.items() if weight > 0}
+
+
+def main(args) -> None:
+    mix = args.mix
+    target_url = args.target_url or args.database_url
+    asyncio.run(reset_database(args.database_url))
+    asyncio.run(seed_target(target_url, args.target_customers))
+
+    llm_port, app_port = free_port(), free_port()
+    with fake_redis_server() if args.fake_redis else nullcontext(args.redis_url) as redis_url:
+        env = {
+            "DATABASE_URL": args.database_url,
+            "REDIS_URL": redis_url,
+            "LLM_PROVIDER": "http",
+            "LLM_HTTP_URL": f"http://127.0.0.1:{llm_port}/complete",
+            "AUTH_REQUIRED": "false",
+            "CLERK_JWKS_URL": "",
+            "RATE_LIMIT_ENABLED": "true" if args.rate_limits else "false",
+            "DEBUG": "false",
+        }
+        llm_stub = [
+            "-m", "benchmarks.llm_stub", "--port", str(llm_port),
+            "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter),
+        ]
+        app_server = [
+            "-m", "uvicorn", "app.main:app", "--port", str(app_port),
+            "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+        ]
+        with serve("LLM stub", llm_stub, env, f"http://127.0.0.1:{llm_port}/docs"), \
+                serve("API", app_server, env, f"http://127.0.0.1:{app_port}/readyz"):
+            runs = asyncio.run(drive(args, f"http://127.0.0.1:{app_port}", mix))
+
+    report = {
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "workers": args.workers,
+            "redis": "fakeredis" if args.fake_redis else args.redis_url,
+            "llm_latency_seconds": args.llm_latency,
+            "llm_jitter_seconds": args.llm_jitter,
+            "novel_questions": args.novel_questions,
+            "target_customers": args.target_customers,
+            "mix": mix,
+        },
+        "runs": runs,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for run in runs:
+        print(
+            f"\nconcurrency {run['concurrency']}: {run['requests']} requests, "
+            f"{run['requests_per_second']} req/s, {run['errors']} errors"
+        )
+        print(f"{'route':<40}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for route, r in run["routes"].items():
+            print(
+                f"{route:<40}{r['requests_per_second']:>9}{r['p50_ms']:>10}"
+                f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="scratch database for the app; its tables are dropped")
+    parser.add_argument("--target-url", help="database the queries run on (default: --database-url)")
+    parser.add_argument("--target-customers", type=int, default=10000, help="bench_orders gets 10x as many rows")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379")
+    parser.add_argument("--fake-redis", action="store_true", help="serve Redis from fakeredis in this process")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per LLM stub answer")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--novel-questions", type=float, default=0.3, help="fraction of generations that miss the caches")
+    parser.add_argument("--concurrency", default="1,10,50", help="comma-separated levels, each run in turn")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before each level")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help=f"operation weights overriding the default, e.g. execute=40,generate=0; "
+                             f"operations: {', '.join(DEFAULT_MIX)}")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per request, seconds")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the app's rate limits on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    main(parser.parse_args())
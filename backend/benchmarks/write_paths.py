@@ -0,0 +1,273 @@
+"""
+Benchmark: user and connection write paths, before and after moving them to
+single-statement writes.
+
+Runs each write both ways against a scratch PostgreSQL database at a fixed
+concurrency: "legacy" replays the old SELECT-then-write endpoint logic,
+"current" calls the endpoint functions in app/api/v1. Reports throughput,
+latency percentiles and SQL statements per write.
+
+Usage (from backend/):
+    python -m benchmarks.write_paths \\
+        --database-url postgresql+asyncpg://postgres@localhost/queryforge_bench
+
+The tables in that database are dropped and recreated.
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.api.v1 import connections, users
+from app.database import Base
+from app.models import DatabaseConnection, User
+from app.schemas.connection import DatabaseConnectionCreate
+from app.schemas.user import UserCreate
+
+CONNECTION_FIELDS = {
+    "dialect": "postgresql",
+    "host": "localhost",
+    "port": 5432,
+    "database": "app",
+    "username": "app",
+    "password": "secret",
+}
+
+
+# The endpoint logic these writes replaced
+
+async def legacy_create_user(db: AsyncSession, data: UserCreate) -> User:
+    result = await db.execute(select(User).where(User.clerk_id == data.clerk_id))
+    if result.scalar_one_or_none():
+        raise ValueError("User with this Clerk ID already exists")
+    result = await db.execute(select(User).where(User.email == data.email))
+    if result.scalar_one_or_none():
+        raise ValueError("User with this email already exists")
+    user = User(
+        id=users.generate_user_id(),
+        clerk_id=data.clerk_id,
+        email=data.email,
+        full_name=data.full_name,
+        avatar_url=data.avatar_url,
+    )
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+
+async def legacy_create_connection(
+    db: AsyncSession, user_id: str, data: DatabaseConnectionCreate
+) -> DatabaseConnection:
+    result = await db.execute(
+        select(DatabaseConnection).where(
+            DatabaseConnection.user_id == user_id,
+            DatabaseConnection.name == data.name,
+        )
+    )
+    if result.scalar_one_or_none():
+        raise ValueError("A connection with this name already exists")
+    result = await db.execute(
+        select(DatabaseConnection).where(DatabaseConnection.user_id == user_id)
+    )
+    is_first_connection = result.first() is None
+    connection = DatabaseConnection(
+        id=connections.generate_connection_id(),
+        user_id=user_id,
+        is_primary=is_first_connection,
+        **data.model_dump(),
+    )
+    db.add(connection)
+    await db.commit()
+    await db.refresh(connection)
+    return connection
+
+
+async def legacy_set_primary(db: AsyncSession, user_id: str, connection_id: str) -> DatabaseConnection:
+    result = await db.execute(
+        select(DatabaseConnection).where(
+            DatabaseConnection.id == connection_id,
+            DatabaseConnection.user_id == user_id,
+        )
+    )
+    connection = result.scalar_one()
+    result = await db.execute(
+        select(DatabaseConnection).where(
+            DatabaseConnection.user_id == user_id,
+            DatabaseConnection.is_primary == True,
+        )
+    )
+    for other in result.scalars().all():
+        other.is_primary = False
+    connection.is_primary = True
+    await db.commit()
+    await db.refresh(connection)
+    return connection
+
+
+class Bench:
+    def __init__(self, database_url: str, operations: int, concurrency: int):
+        self.engine = create_async_engine(database_url, pool_size=concurrency, max_overflow=0)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False, autoflush=False)
+        self.operations = operations
+        self.concurrency = concurrency
+        self.statements = 0
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args) -> None:
+        self.statements += 1
+
+    async def reset(self, legacy: bool = False) -> None:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            if legacy:
+                # The old schema: the legacy set-primary flips rows in separate
+                # statements, which the one-primary constraint rejects
+                await conn.execute(text(
+                    "ALTER TABLE database_connections DROP CONSTRAINT ex_database_connections_one_primary"
+                ))
+                await conn.execute(text("DROP INDEX uq_database_connections_user_id_name"))
+
+    async def run(self, name: str, operation: Callable[[AsyncSession, int], Awaitable]) -> dict:
+        """Run `operations` calls of operation(session, i), `concurrency` at a time"""
+        latencies: List[float] = []
+        counter = iter(range(self.operations))
+
+        async def worker():
+            for i in counter:
+                async with self.sessions() as session:
+                    started = time.perf_counter()
+                    await operation(session, i)
+                    latencies.append(time.perf_counter() - started)
+
+        self.statements = 0
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "case": name,
+            "operations": self.operations,
+            "ops_per_second": round(self.operations / elapsed, 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+            "statements_per_op": round(self.statements / self.operations, 2),
+        }
+
+    async def seed_users(self, count: int) -> List[str]:
+        async with self.sessions() as session:
+            ids = [users.generate_user_id() for _ in range(count)]
+            session.add_all(
+                User(id=user_id, clerk_id=user_id, email=f"{user_id}@example.com") for user_id in ids
+            )
+            await session.commit()
+        return ids
+
+    async def seed_connections(self, user_ids: List[str], per_user: int) -> Dict[str, List[str]]:
+        owned: Dict[str, List[str]] = {}
+        async with self.sessions() as session:
+            for user_id in user_ids:
+                owned[user_id] = [connections.generate_connection_id() for _ in range(per_user)]
+                session.add_all(
+                    DatabaseConnection(
+                        id=connection_id,
+                        user_id=user_id,
+                        name=f"db{n}",
+                        is_primary=n == 0,
+                        **CONNECTION_FIELDS,
+                    )
+                    for n, connection_id in enumerate(owned[user_id])
+                )
+            await session.commit()
+        return owned
+
+
+async def main(args) -> None:
+    bench = Bench(args.database_url, args.operations, args.concurrency)
+    tag = secrets.token_hex(4)
+    results = []
+
+    def new_user(i: int) -> UserCreate:
+        return UserCreate(clerk_id=f"clerk_{tag}_{i}", email=f"{tag}_{i}@example.com")
+
+    # create_user
+    await bench.reset(legacy=True)
+    results.append(await bench.run(
+        "create_user/legacy", lambda db, i: legacy_create_user(db, new_user(i))
+    ))
+    await bench.reset()
+    results.append(await bench.run(
+        "create_user/current",
+        lambda db, i: users.create_user(new_user(i), identity=None, db=db),
+    ))
+
+    # create_connection: spread over users, so some are first connections
+    def new_connection(i: int) -> DatabaseConnectionCreate:
+        return DatabaseConnectionCreate(name=f"db{i}", **CONNECTION_FIELDS)
+
+    for name, create in (
+        ("create_connection/legacy", legacy_create_connection),
+        ("create_connection/current", lambda db, user_id, data: connections.create_connection(
+            data, user_id=user_id, db=db
+        )),
+    ):
+        await bench.reset(legacy=name.endswith("/legacy"))
+        user_ids = await bench.seed_users(args.users)
+        results.append(await bench.run(
+            name,
+            lambda db, i, create=create, user_ids=user_ids: create(
+                db, user_ids[i % len(user_ids)], new_connection(i)
+            ),
+        ))
+
+    # set_primary: each user has --connections-per-user connections
+    for name, set_primary in (
+        ("set_primary/legacy", legacy_set_primary),
+        ("set_primary/current", lambda db, user_id, connection_id: connections.set_primary_connection(
+            connection_id, user_id=user_id, db=db
+        )),
+    ):
+        await bench.reset(legacy=name.endswith("/legacy"))
+        owned = await bench.seed_connections(await bench.seed_users(args.users), args.connections_per_user)
+        user_ids = list(owned)
+
+        def pick(i: int, owned=owned, user_ids=user_ids):
+            # Consecutive operations hit different users, so workers don't just queue on one row lock
+            user_id = user_ids[i % len(user_ids)]
+            return user_id, owned[user_id][(i // len(user_ids)) % args.connections_per_user]
+
+        results.append(await bench.run(
+            name, lambda db, i, set_primary=set_primary, pick=pick: set_primary(db, *pick(i))
+        ))
+
+    await bench.engine.dispose()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'case':<28}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'stmts/op':>10}")
+    for r in results:
+        print(
+            f"{r['case']:<28}{r['ops_per_second']:>10}{r['p50_ms']:>10}"
+            f"{r['p95_ms']:>10}{r['mean_ms']:>10}{r['statements_per_op']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="scratch database; its tables are dropped")
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--connections-per-user", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,159 @@
+"""
+Token verification against a local JWKS stand-in: no Clerk, no database.
+"""
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.config import settings
+from app.middleware import auth
+from app.middleware.auth import AuthMiddleware, IdentityCache, JWKSCache
+from app.models.user import UserRole
+
+KID = "test-key"
+AZP = "https://app.example.com"
+
+
+@pytest.fixture(scope="module")
+def private_pem() -> bytes:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+
+
+@pytest.fixture
+def jwks(private_pem, monkeypatch):
+    """Serves the test key through the fetcher, counting fetches"""
+    public_jwk = {**jwk.construct(private_pem, "RS256").public_key().to_dict(), "kid": KID, "use": "sig"}
+    fetches = []
+
+    async def local_jwks():
+        fetches.append(time.monotonic())
+        return {"keys": [public_jwk]}
+
+    cache = JWKSCache(min_refetch_interval=60, fetcher=local_jwks)
+    monkeypatch.setattr(auth, "jwks_cache", cache)
+    return SimpleNamespace(cache=cache, fetches=fetches)
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Stands in for the users table: clerk_id -> one row"""
+    calls = []
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+        async def execute(self, statement):
+            calls.append(statement)
+            return SimpleNamespace(first=lambda: SimpleNamespace(id="user_1", role=UserRole.ADMIN))
+
+    monkeypatch.setattr(auth, "AsyncSessionLocal", Session)
+    monkeypatch.setattr(auth, "identity_cache", IdentityCache())
+    return calls
+
+
+@pytest.fixture
+def client(jwks, lookups, monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_REQUIRED", True)
+    monkeypatch.setattr(settings, "CLERK_ISSUER", "")
+    monkeypatch.setattr(settings, "AUTH_AUTHORIZED_PARTIES", [AZP])
+
+    async def whoami(request: Request):
+        identity = request.state.identity
+        return JSONResponse({"clerk_id": identity.clerk_id, "user_id": identity.user_id, "role": identity.role})
+
+    app = AuthMiddleware(Starlette(routes=[Route("/whoami", whoami)]))
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def make_token(private_pem: bytes, kid: str = KID, **claims) -> str:
+    now = int(time.time())
+    claims = {"sub": "clerk_1", "azp": AZP, "iat": now, "exp": now + 60, **claims}
+    return jwt.encode(claims, private_pem, algorithm="RS256", headers={"kid": kid})
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.asyncio
+async def test_valid_token_resolves_identity(client, jwks, lookups, private_pem):
+    async with client:
+        for _ in range(2):
+            response = await client.get("/whoami", headers=bearer(make_token(private_pem)))
+            assert response.status_code == 200
+            assert response.json() == {"clerk_id": "clerk_1", "user_id": "user_1", "role": "admin"}
+
+    # One JWKS fetch and one users lookup; the second request is served from memory
+    assert len(jwks.fetches) == 1
+    assert len(lookups) == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_kid_refetches_at_most_once(client, jwks, private_pem):
+    await jwks.cache.refresh()  # as start() does
+    async with client:
+        assert (await client.get("/whoami", headers=bearer(make_token(private_pem)))).status_code == 200
+        # Well past the refetch interval: a rotated key may be fetched again, once
+        jwks.cache._fetched_at -= 120
+        for _ in range(3):
+            response = await client.get("/whoami", headers=bearer(make_token(private_pem, kid="rotated")))
+            assert response.status_code == 401
+            assert response.json()["detail"] == "Invalid token: Unknown signing key"
+
+    assert len(jwks.fetches) == 2
+    assert jwks.cache.stats()["unknown_kid_refetches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_token_is_rejected(client, private_pem):
+    expired = make_token(private_pem, exp=int(time.time()) - settings.AUTH_CLOCK_SKEW_SECONDS - 60)
+    async with client:
+        response = await client.get("/whoami", headers=bearer(expired))
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+@pytest.mark.asyncio
+async def test_other_authorized_party_is_rejected(client, private_pem):
+    async with client:
+        response = await client.get("/whoami", headers=bearer(make_token(private_pem, azp="https://evil.example.com")))
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Invalid token: Token was issued for another origin"
+
+
+@pytest.mark.asyncio
+async def test_missing_token_is_rejected(client):
+    async with client:
+        response = await client.get("/whoami")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_malformed_jwks_keeps_refreshing():
+    documents = [["not", "a", "dict"], {"keys": [1, {"kid": ["x"]}]}]
+
+    async def broken_jwks():
+        return documents.pop(0)
+
+    cache = JWKSCache(fetcher=broken_jwks)
+    await cache.refresh()
+    await cache.refresh()
+    assert cache.stats() == {"refreshes": 1, "refresh_errors": 1, "unknown_kid_refetches": 0, "keys": 0}